@@ -0,0 +1,328 @@
+"""
+Mergeable partial aggregate of the traffic metrics.
+
+A TrafficAggregate holds every counter that process_csv_data needs. Rows can be
+added to several aggregates (for example one per chunk of a file) and the
+aggregates merged afterwards; peak hours and percentages are only worked out
+from the merged counts, so the outcomes match a single serial pass.
+
+Per junction counts are kept in a JunctionTable: junction names and hours are
+interned into integer ids in order of first appearance, and the vehicles are
+counted in a dense hours x junctions table. Every junction in the file gets
+its totals, peak hours and scooter share from that one table. The table also
+keeps the other plain counters (trucks, electric vehicles, ...) of every hour
+and junction, so the summary store can roll up and compare every count per
+junction.
+
+Speeds are counted into the mergeable sketches of speed_stats.SpeedStats.
+"""
+
+from speed_stats import SpeedStats
+
+# Names of the two junctions reported in the outcomes
+ELM_RABBIT = "Elm Avenue/Rabbit Road"
+HANLEY_WESTWAY = "Hanley Highway/Westway"
+
+# Names of the plain counters kept by a TrafficAggregate
+COUNTERS = (
+    "total_vehicles",
+    "total_trucks",
+    "total_electric_vehicles",
+    "two_wheeled_vehicles",
+    "busses_leaving_north",
+    "vehicles_no_turns",
+    "vehicles_over_speed",
+    "total_bicycles",
+)
+
+# Counters also kept per hour and junction by a JunctionTable (its counts are the vehicles)
+JUNCTION_COUNTERS = COUNTERS[1:]
+
+
+class JunctionTable:
+    def __init__(self):
+        """
+        Starts an empty table of vehicles per hour and junction.
+        """
+        
+        self.hours = []          # Hour labels ("HH"), the position in the list is the hour id
+        self.hour_ids = {}       # Hour label -> hour id
+        self.junctions = []      # Junction names, the position in the list is the junction id
+        self.junction_ids = {}   # Junction name -> junction id
+        self.counts = []         # counts[hour id][junction id] = vehicles
+        self.scooters = []       # scooters[junction id] = scooters at the junction
+        self.hour_order = []     # hour_order[junction id] = hour ids in the order they first appear at the junction
+        self.counters = []       # counters[hour id][junction id] = the JUNCTION_COUNTERS of those vehicles
+
+    def add_hour(self, hour):
+        """
+        Gives a new hour the next free id, with no vehicles at any junction yet, and returns the id.
+        """
+        
+        hour_id = self.hour_ids[hour] = len(self.hours)
+        self.hours.append(hour)
+        self.counts.append([0] * len(self.junctions))
+        self.counters.append([[0] * len(JUNCTION_COUNTERS) for _ in self.junctions])
+        return hour_id
+
+    def add(self, hour, junction, scooters=0, count=1, counters=None):
+        """
+        Adds count vehicles (scooters of them scooters) seen at a junction in an hour.
+        counters holds how many of them count for each of JUNCTION_COUNTERS (True counts as 1), if given.
+        New hours and junctions get the next free id.
+        """
+        
+        hour_id = self.hour_ids.get(hour)
+        if hour_id is None:
+            hour_id = self.add_hour(hour)
+
+        junction_id = self.junction_ids.get(junction)
+        if junction_id is None:
+            junction_id = self.junction_ids[junction] = len(self.junctions)
+            self.junctions.append(junction)
+            for hour_counts in self.counts:
+                hour_counts.append(0)
+            for hour_counters in self.counters:
+                hour_counters.append([0] * len(JUNCTION_COUNTERS))
+            self.scooters.append(0)
+            self.hour_order.append([])
+
+        hour_counts = self.counts[hour_id]
+        if not hour_counts[junction_id]:
+            self.hour_order[junction_id].append(hour_id)
+        hour_counts[junction_id] += count
+        self.scooters[junction_id] += scooters
+        if counters is not None:
+            cell = self.counters[hour_id][junction_id]
+            for index, value in enumerate(counters):
+                if value:
+                    cell[index] += value
+
+    def merge(self, other):
+        """
+        Adds the counts of another table to this one and returns this table.
+        Tables must be merged in file order so hours keep their order of first appearance.
+        """
+        
+        # Every hour of the other table gets its place in order, even if no junction of this table has it yet
+        for hour in other.hours:
+            if hour not in self.hour_ids:
+                self.add_hour(hour)
+
+        for junction_id, junction in enumerate(other.junctions):
+            for hour_id in other.hour_order[junction_id]:
+                self.add(other.hours[hour_id], junction, 0, other.counts[hour_id][junction_id],
+                         other.counters[hour_id][junction_id])
+            self.scooters[self.junction_ids[junction]] += other.scooters[junction_id]
+        return self
+
+    def total(self, junction):
+        """
+        Returns the vehicles recorded at a junction (0 if it is not in the file).
+        """
+        
+        junction_id = self.junction_ids.get(junction)
+        if junction_id is None:
+            return 0
+        return sum(hour_counts[junction_id] for hour_counts in self.counts)
+
+    def scooter_count(self, junction):
+        """
+        Returns the scooters recorded at a junction (0 if it is not in the file).
+        """
+        
+        junction_id = self.junction_ids.get(junction)
+        return 0 if junction_id is None else self.scooters[junction_id]
+
+    def hourly_counts(self, junction):
+        """
+        Returns the vehicles per hour at a junction, in the order the hours first appear at that junction.
+        """
+        
+        junction_id = self.junction_ids.get(junction)
+        if junction_id is None:
+            return {}
+        return {self.hours[hour_id]: self.counts[hour_id][junction_id] for hour_id in self.hour_order[junction_id]}
+
+    def cell_counters(self, hour, junction):
+        """
+        Returns the JUNCTION_COUNTERS of the vehicles at a junction in an hour, as a dict (zeros if there were none).
+        """
+        
+        hour_id, junction_id = self.hour_ids.get(hour), self.junction_ids.get(junction)
+        if hour_id is None or junction_id is None:
+            return dict.fromkeys(JUNCTION_COUNTERS, 0)
+        return dict(zip(JUNCTION_COUNTERS, self.counters[hour_id][junction_id]))
+
+    def hourly_data(self):
+        """
+        Returns the data for the histogram (Task D): hour -> {junction: vehicles} for every hour and junction.
+        """
+        
+        return {hour: dict(zip(self.junctions, hour_counts)) for hour, hour_counts in zip(self.hours, self.counts)}
+
+    def report_metrics(self):
+        """
+        Returns the per junction entries of the raw counts dict used by build_outcomes.
+        """
+        
+        return {
+            "vehicles_elm_rabbit": self.total(ELM_RABBIT),
+            "scooters_count": self.scooter_count(ELM_RABBIT),
+            "vehicles_hanley_westway": self.total(HANLEY_WESTWAY),
+            "hourly_counts": self.hourly_counts(HANLEY_WESTWAY),
+            "junction_table": self.to_dict(),
+        }
+
+    def to_dict(self):
+        """
+        Returns the table as plain lists, so it can be saved as JSON.
+        """
+        
+        return {
+            "hours": self.hours,
+            "junctions": self.junctions,
+            "counts": self.counts,
+            "scooters": self.scooters,
+            "hour_order": self.hour_order,
+            "counters": self.counters,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a table from the output of to_dict.
+        """
+        
+        table = cls()
+        table.hours = list(data["hours"])
+        table.hour_ids = {hour: hour_id for hour_id, hour in enumerate(table.hours)}
+        table.junctions = list(data["junctions"])
+        table.junction_ids = {junction: junction_id for junction_id, junction in enumerate(table.junctions)}
+        table.counts = [list(hour_counts) for hour_counts in data["counts"]]
+        table.scooters = list(data["scooters"])
+        table.hour_order = [list(hour_ids) for hour_ids in data["hour_order"]]
+        table.counters = [[list(cell) for cell in hour_counters] for hour_counters in data["counters"]]
+        return table
+
+
+class TrafficAggregate:
+    def __init__(self):
+        """
+        Starts an empty aggregate with every counter at zero.
+        """
+        
+        # Initialize variables for metrics
+        self.total_vehicles = 0            # Total vehicles for the date
+        self.total_trucks = 0              # Total trucks
+        self.total_electric_vehicles = 0   # Electric vehicles
+        self.two_wheeled_vehicles = 0      # Two-wheeled vehicles (bikes, scooters, motorcycles)
+        self.busses_leaving_north = 0      # Buses leaving Elm Avenue heading North
+        self.vehicles_no_turns = 0         # Vehicles going straight
+        self.vehicles_over_speed = 0       # Vehicles exceeding speed limit
+        self.rain_hours_set = set()        # To count unique rain hours.
+        self.total_bicycles = 0            # Total bicycles recorded
+        self.junctions = JunctionTable()   # Vehicles per hour and scooters at every junction | Data for histogram (Task D)
+        self.speeds = SpeedStats()         # Speed sketches per junction, hour and vehicle type
+
+    def add_row(self, row):
+        """
+        Adds one CSV row (a dict from csv.DictReader) to the counts.
+        """
+        
+        #The total number of vehicles passing through all junctions for the selected date.
+        self.total_vehicles += 1           # Increment total vehicle count.
+
+        #The total number of trucks passing through all junctions for the selected date.
+        truck = row["VehicleType"] == "Truck"
+        if truck:
+            self.total_trucks += 1
+
+        #The total number of electric vehicles passing through all junctions for the selected date.
+        electric = row["elctricHybrid"].lower() == "true"
+        if electric:
+            self.total_electric_vehicles += 1
+
+        #The number of “two wheeled” vehicles through all junctions for the date (bikes, motorbike, scooters).
+        two_wheeled = row["VehicleType"] in ["Bicycle", "Motorcycle", "Scooter"]
+        if two_wheeled:
+            self.two_wheeled_vehicles += 1
+
+        #The total number of busses leaving Elm Avenue/Rabbit Road junction heading north
+        bus_north = (
+            row["JunctionName"] == "Elm Avenue/Rabbit Road"
+            and row["travel_Direction_out"] == "N"
+            and row["VehicleType"] == "Buss"
+        )
+        if bus_north:
+            self.busses_leaving_north += 1
+
+        #The total number of vehicles passing through both junctions without turning left or right.
+        no_turn = row["travel_Direction_in"] == row["travel_Direction_out"]
+        if no_turn:
+            self.vehicles_no_turns += 1
+
+        #The total number of vehicles recorded as over the speed limit for the selected date.
+        speed = int(row["VehicleSpeed"])
+        limit = int(row["JunctionSpeedLimit"])
+        over_speed = speed > limit
+        if over_speed:
+            self.vehicles_over_speed += 1
+
+        #Count rain hours (Light Rain or Heavy Rain)
+        if row["Weather_Conditions"] in ["Light Rain", "Heavy Rain"]:
+            hour = row["timeOfDay"][:2]  #Extract the hour part
+            self.rain_hours_set.add(hour)     #Add hour to the rain hours set
+            
+        # Count bicycles and calculate average bicycles per hour
+        bicycle = row["VehicleType"] == "Bicycle"
+        if bicycle:
+            self.total_bicycles += 1
+            
+        # Count the vehicle per hour at its junction: junction totals, peak hours,
+        # scooter shares and the histogram (Task D) all come from this table,
+        # which also keeps the counters above per hour and junction (in JUNCTION_COUNTERS order)
+        self.junctions.add(row["timeOfDay"][:2], row["JunctionName"], row["VehicleType"] == "Scooter", 1,
+                           (truck, electric, two_wheeled, bus_north, no_turn, over_speed, bicycle))
+
+        # Speed distribution per junction, hour and vehicle type, and how far speeding vehicles go over the limit
+        self.speeds.add(row["JunctionName"], row["timeOfDay"][:2], row["VehicleType"], speed, limit)
+
+    def merge(self, other):
+        """
+        Adds the counts of another aggregate to this one and returns this aggregate.
+        Aggregates must be merged in file order so hours keep their order of first appearance.
+        """
+        
+        # Plain counters are simply added
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        # Rain hours are a set, so the union keeps each hour once
+        self.rain_hours_set |= other.rain_hours_set
+
+        # Vehicles per hour and scooters at every junction
+        self.junctions.merge(other.junctions)
+
+        # Speed sketches merge by adding their counts
+        self.speeds.merge(other.speeds)
+        return self
+
+    @property
+    def hourly_data(self):
+        """
+        The data for the histogram (Task D): vehicles per hour at every junction.
+        """
+        
+        return self.junctions.hourly_data()
+
+    def metrics(self):
+        """
+        Returns the raw counts as the dict used by build_outcomes.
+        """
+        
+        metrics = {name: getattr(self, name) for name in COUNTERS}
+        metrics["rain_hours"] = len(self.rain_hours_set)
+        metrics.update(self.junctions.report_metrics())
+        metrics["speed_stats"] = self.speeds.to_dict()
+        return metrics
@@ -0,0 +1,370 @@
+"""
+Approximate outcomes of very large survey files from a sample of their rows.
+
+The engines of main.process_csv_data read every row. With a SamplingPlan,
+process_csv_data reads only a sample of the file and returns every outcome
+with a 95% confidence interval:
+
+    process_csv_data("traffic_data15062024.csv", sampling=SamplingPlan(sample_rows=10_000))
+
+How the sample is taken:
+- The data part of the file is cut into as many equal byte ranges as rows are
+  wanted and the line at one random byte of each range is read, so the time
+  depends on the sample size and not on the size of the file
+- Equal byte ranges spread the sample evenly over the file in file order. No
+  row order is assumed: the sample survey files happen to be ordered by hour
+  and then junction, so there the sample is spread over the hours much like a
+  sample stratified by hour, while generate_data.py writes its rows in random
+  order, where the sample is no better than a simple random one
+- A line is picked with a chance proportional to its length in bytes, so every
+  sampled row is weighted by one over its length, which keeps the estimates
+  unbiased when rows differ in length (Horvitz-Thompson estimator)
+
+The intervals use the variance of simple random sampling. That is the right
+variance for a file in random order, and for a file ordered by hour it is
+usually on the safe side, since spreading the sample over the hours removes
+the variation between hours. The number of sampled rows is a row budget (sample_rows) or is worked out
+from an error target (max_error, the largest error in percentage points
+accepted on the shares 95% of the time).
+
+The hours of rain are the hours with rain seen in the sample, so they are a
+lower bound. The speed statistics are read off the weighted speed sketches of
+the sample and shown without intervals. The per hour and per junction tables
+are small enough to be estimated cell by cell, so no sketches (count-min,
+HyperLogLog) are used: they would only add error.
+
+Compressed files cannot be read at random positions and small files are read
+quicker in full, so both are processed exactly.
+"""
+
+import csv
+import math
+import os
+import random
+from collections import Counter, defaultdict
+
+from aggregate import COUNTERS, ELM_RABBIT, HANLEY_WESTWAY, JUNCTION_COUNTERS, JunctionTable, TrafficAggregate
+from compressed import codec_of
+from metric_registry import REGISTRY, outcome_values
+from speed_stats import SpeedStats
+from validation import DataQuality, RowChecker
+
+# z value of a 95% confidence interval
+Z = 1.96
+
+# Rows sampled when neither a row budget nor an error target is given
+DEFAULT_SAMPLE_ROWS = 10_000
+
+# A file is only sampled if it has at least this many rows per sampled row, otherwise it is read in full
+MIN_ROWS_PER_SAMPLED_ROW = 4
+
+# Bytes read at the start of the file to find the header and the usual line length
+HEAD_BYTES = 1 << 16
+
+# Bytes read on each side of a random position to find the line around it (widened for longer lines)
+WINDOW = 128
+
+
+class SamplingPlan:
+    def __init__(self, sample_rows=None, max_error=None, seed=None):
+        """
+        Says how many rows to sample:
+        - sample_rows is the row budget (DEFAULT_SAMPLE_ROWS if no error target is given either)
+        - max_error is the error target in percentage points on the shares; a row budget caps it
+        - seed makes the sample repeatable
+        """
+
+        if sample_rows is not None and sample_rows < 2:
+            raise ValueError("A sample needs at least 2 rows")
+        if max_error is not None and not 0 < max_error < 100:
+            raise ValueError("The error target must be between 0 and 100 percentage points")
+        self.sample_rows = sample_rows
+        self.max_error = max_error
+        self.seed = seed
+
+    def sample_size(self):
+        """
+        Returns the number of rows to sample.
+        The error target uses the worst case share of 50%, so every share meets it.
+        """
+
+        if self.max_error is None:
+            return self.sample_rows or DEFAULT_SAMPLE_ROWS
+        needed = max(2, math.ceil(Z * Z * 0.25 / (self.max_error / 100) ** 2))
+        return min(needed, self.sample_rows) if self.sample_rows else needed
+
+
+def line_at(file, position, start, end):
+    """
+    Returns the line of a binary file that holds the byte at position (with its line break) and its length.
+    start and end are the bytes where the data part of the file starts and ends.
+    """
+
+    window = WINDOW
+    while True:
+        low = max(start, position - window)
+        high = min(end, position + window)
+        file.seek(low)
+        block = file.read(high - low)
+        first = block.rfind(b"\n", 0, position - low) + 1
+        last = block.find(b"\n", position - low)
+        if (first or low == start) and (last >= 0 or high == end):
+            break
+        window *= 4
+    last = len(block) if last < 0 else last + 1
+    return block[first:last], last - first
+
+
+def round_to_total(values, total):
+    """
+    Rounds every value to a whole number so the rounded values add up to total (largest remainder first).
+    """
+
+    rounded = [math.floor(value) for value in values]
+    order = sorted(range(len(values)), key=lambda index: rounded[index] - values[index])
+    for index in order[:total - sum(rounded)]:
+        rounded[index] += 1
+    return rounded
+
+
+class TrafficSample:
+    def __init__(self, fields, data_bytes, file_path=""):
+        """
+        Starts an empty sample of a file:
+        - fields are the column names from its header
+        - data_bytes is the size of the file without the header line
+        """
+
+        self.checker = RowChecker(fields, DataQuality(file_path))
+        self.fields = self.checker.fields
+        self.data_bytes = data_bytes
+        self.lengths = Counter()                 # Line length -> sampled lines of that length
+        self.aggregates = {}                     # Line length -> TrafficAggregate of the good rows of that length
+        self.bad = defaultdict(Counter)          # Reason -> line length -> bad rows
+        self.order = JunctionTable()             # Junctions and hours in the order of the sample (file order)
+
+    @property
+    def size(self):
+        return sum(self.lengths.values())
+
+    def add_line(self, line, length):
+        """
+        Adds one sampled line of the file and its length in bytes.
+        """
+
+        self.lengths[length] += 1
+        values = next(csv.reader([line.decode()]), [])
+        if not values:
+            return   # An empty line holds no vehicle
+        reason = self.checker.problem(values)
+        if reason:
+            self.bad[reason][length] += 1
+            return
+        row = dict(zip(self.fields, values))
+        self.aggregates.setdefault(length, TrafficAggregate()).add_row(row)
+        self.order.add(row["timeOfDay"][:2], row["JunctionName"], 0, 0)
+
+    def counts(self, count):
+        """
+        Returns line length -> count(aggregate) for the aggregate of every line length.
+        """
+
+        return {length: count(aggregate) for length, aggregate in self.aggregates.items()}
+
+    def estimate(self, counts):
+        """
+        Estimates how many rows of the file have a property, from the sampled rows with it
+        (counts is line length -> sampled rows). Returns the estimate and the ends of its 95% confidence interval.
+        A property never seen in the sample gets the rule of three upper end (3 / sampled rows of the file).
+        """
+
+        size = self.size
+        weighted = sum(count / length for length, count in counts.items())
+        if not weighted:
+            return 0.0, 0.0, 3 * self.estimate(self.lengths)[0] / size
+        squares = sum(count / length ** 2 for length, count in counts.items())
+        value = self.data_bytes * weighted / size
+        variance = self.data_bytes ** 2 * max(squares - weighted ** 2 / size, 0) / (size * (size - 1))
+        half_width = Z * math.sqrt(variance)
+        return value, max(value - half_width, 0.0), value + half_width
+
+    def percentage(self, part, whole):
+        """
+        Estimates the percentage of the rows counted in whole that are also counted in part
+        (both line length -> sampled rows). Returns the estimate and the ends of its 95% confidence interval.
+        """
+
+        whole_weighted = sum(count / length for length, count in whole.items())
+        if not whole_weighted:
+            return 0.0, 0.0, 100.0
+        part_weighted = sum(count / length for length, count in part.items())
+        if not part_weighted:
+            return 0.0, 0.0, min(100.0, 300 / sum(whole.values()))
+        ratio = part_weighted / whole_weighted
+        squares = sum((part.get(length, 0) * (1 - ratio) ** 2 + (count - part.get(length, 0)) * ratio ** 2)
+                      / length ** 2 for length, count in whole.items())
+        size = self.size
+        half_width = Z * math.sqrt(size * squares / ((size - 1) * whole_weighted ** 2))
+        return 100 * ratio, 100 * max(ratio - half_width, 0.0), 100 * min(ratio + half_width, 1.0)
+
+    def results(self):
+        """
+        Returns the histogram data and the estimated counts, in the same form as main.compute_csv_metrics,
+        with the sample size and the confidence interval of every outcome under "approximation".
+        """
+
+        metrics = {}
+        intervals = {}
+
+        def add(name, estimate, scale=1):
+            value, low, high = estimate
+            metrics[name] = round(value / scale)
+            intervals[name] = [round(low / scale), round(high / scale)]
+
+        # Plain counters, then the shares and averages worked out from them
+        for name in COUNTERS:
+            add(name, self.estimate(self.counts(lambda aggregate: getattr(aggregate, name))))
+        vehicles = self.counts(lambda aggregate: aggregate.total_vehicles)
+        intervals["trucks_percentage"] = [round(end) for end in self.percentage(
+            self.counts(lambda aggregate: aggregate.total_trucks), vehicles)[1:]]
+        intervals["average_bicycles_per_hour"] = [round(end / 24) for end in intervals["total_bicycles"]]
+        metrics["rain_hours"] = len(set().union(*(aggregate.rain_hours_set for aggregate in self.aggregates.values())))
+
+        # Vehicles per hour and scooters at every junction, rounded so the hours add up to the junction total
+        table = JunctionTable.from_dict(self.order.to_dict())
+        junctions = {}
+        for junction_id, junction in enumerate(table.junctions):
+            hours = list(self.order.hourly_counts(junction))
+            cells = [self.estimate(self.counts(lambda aggregate: aggregate.junctions.hourly_counts(junction)
+                                               .get(hour, 0)))[0] for hour in hours]
+            junction_vehicles = self.counts(lambda aggregate: aggregate.junctions.total(junction))
+            junction_scooters = self.counts(lambda aggregate: aggregate.junctions.scooter_count(junction))
+            total = self.estimate(junction_vehicles)
+            for hour, count in zip(hours, round_to_total(cells, round(total[0]))):
+                table.counts[table.hour_ids[hour]][junction_id] = count
+                table.counters[table.hour_ids[hour]][junction_id] = [
+                    round(self.estimate(self.counts(lambda aggregate: aggregate.junctions.cell_counters(hour, junction)
+                                                    [name]))[0]) for name in JUNCTION_COUNTERS]
+            table.scooters[junction_id] = round(self.estimate(junction_scooters)[0])
+            junctions[junction] = {
+                "vehicles": [round(end) for end in total[1:]],
+                "scooters_percentage": [round(end) for end in self.percentage(junction_scooters,
+                                                                              junction_vehicles)[1:]],
+            }
+        metrics.update(table.report_metrics())
+
+        # Intervals of the outcomes of the two reported junctions (also when they were not in the sample)
+        for name, junction in (("vehicles_elm_rabbit", ELM_RABBIT), ("vehicles_hanley_westway", HANLEY_WESTWAY)):
+            interval = self.estimate(self.counts(lambda aggregate: aggregate.junctions.total(junction)))[1:]
+            intervals[name] = [round(end) for end in interval]
+        intervals["scooters_percentage"] = [round(end) for end in self.percentage(
+            self.counts(lambda aggregate: aggregate.junctions.scooter_count(ELM_RABBIT)),
+            self.counts(lambda aggregate: aggregate.junctions.total(ELM_RABBIT)))[1:]]
+        if metrics["hourly_counts"]:
+            hourly_counts = metrics["hourly_counts"]
+            peak_hour = max(hourly_counts, key=hourly_counts.get)
+            intervals["max_vehicles_hour"] = [round(end) for end in self.estimate(self.counts(
+                lambda aggregate: aggregate.junctions.hourly_counts(HANLEY_WESTWAY).get(peak_hour, 0)))[1:]]
+
+        # Speed sketches, every sampled row weighted like in the counts
+        speeds = SpeedStats()
+        for length, aggregate in self.aggregates.items():
+            speeds.merge(aggregate.speeds, self.data_bytes / (self.size * length))
+        metrics["speed_stats"] = speeds.to_dict()
+
+        metrics["approximation"] = {
+            "sample_rows": self.size,
+            "estimated_rows": round(self.estimate(self.lengths)[0]),
+            "bad_rows": round(sum(self.estimate(counts)[0] for counts in self.bad.values())),
+            "confidence": 0.95,
+            "intervals": intervals,
+            "junctions": junctions,
+        }
+        return table.hourly_data(), metrics
+
+
+def sample_file(file_path, plan):
+    """
+    Reads a sample of a CSV file as a SamplingPlan says and returns it as a TrafficSample,
+    or None if the file should be read in full (compressed, or too small for the sample to save time).
+    """
+
+    if codec_of(file_path):
+        return None
+    end = os.path.getsize(file_path)
+    with open(file_path, "rb", buffering=0) as file:
+        # The header, and the usual line length to tell whether sampling is worth it
+        head = file.read(HEAD_BYTES)
+        start = head.find(b"\n") + 1
+        head_lines = head.count(b"\n", start)
+        if not start or not head_lines:
+            return None
+        estimated_rows = (end - start) * head_lines / (head.rfind(b"\n") + 1 - start)
+        sample_size = plan.sample_size()
+        if sample_size * MIN_ROWS_PER_SAMPLED_ROW > estimated_rows:
+            return None
+
+        # One line at a random byte of each equal byte range, read in file order
+        sample = TrafficSample(next(csv.reader([head[:start].decode()])), end - start, file_path)
+        generator = random.Random(plan.seed)
+        stride = (end - start) / sample_size
+        for index in range(sample_size):
+            position = min(start + int((index + generator.random()) * stride), end - 1)
+            sample.add_line(*line_at(file, position, start, end))
+    return sample
+
+
+def interval_text(interval, unit=""):
+    """
+    Returns the text of a confidence interval added after an outcome.
+    """
+
+    low, high = interval
+    return f"(95% CI {low}{unit} to {high}{unit})"
+
+
+def approximate_outcome_lines(file_path, metrics):
+    """
+    Builds the outcome lines of a sampled file: the usual lines with the confidence interval of every estimate.
+    """
+
+    approximation = metrics["approximation"]
+    intervals = approximation["intervals"]
+    lines = [f"\nData file selected is {file_path}",
+             f"Approximate outcomes from a sample of {approximation['sample_rows']:,} "
+             f"of about {approximation['estimated_rows']:,} rows, with 95% confidence intervals"]
+    for name, value in outcome_values(metrics).items():
+        line = REGISTRY[name].line
+        if name == "junction_summaries":
+            for summary, junction in zip(value, approximation["junctions"].values()):
+                lines.append(f"{summary}, vehicles {interval_text(junction['vehicles'])}")
+        elif name == "rain_hours":
+            lines.append(line.format(value=value) + " (hours with rain seen in the sample, a lower bound)")
+        elif name in intervals:
+            unit = "%" if REGISTRY[name].kind == "ratio" else ""
+            text = line.format(value=value)
+            if text.endswith("."):
+                lines.append(f"{text[:-1]} {interval_text(intervals[name], unit)}.")
+            else:
+                lines.append(f"{text} {interval_text(intervals[name], unit)}")
+        elif isinstance(value, list):
+            lines.extend(line.format(value=item) for item in value)
+        else:
+            lines.append(line.format(value=value))
+    if approximation["bad_rows"]:
+        lines.append(f"Data quality: about {approximation['bad_rows']} bad rows not counted (estimated from the sample)")
+    lines[-1] += "\n"
+    return lines
+
+
+def sample_results(file_path, plan):
+    """
+    Returns the histogram data, outcome lines and estimated counts of a CSV file from a sample of its rows,
+    like main.process_csv_results, or None if the file should be processed exactly.
+    """
+
+    sample = sample_file(file_path, plan)
+    if sample is None:
+        return None
+    hourly_data, metrics = sample.results()
+    return hourly_data, approximate_outcome_lines(file_path, metrics), metrics
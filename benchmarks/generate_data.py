@@ -0,0 +1,140 @@
+"""
+Synthetic traffic survey data generator.
+
+Writes traffic_dataDDMMYYYY.csv files with the same ten columns as the real
+survey files, at any size from a few rows to hundreds of millions of rows.
+The distributions follow the sample files: morning and evening peaks, weather
+that changes by the hour, a speed limit per junction with speeds mostly under
+it, about a third of vehicles going straight on, and a vehicle mix that can be
+skewed towards the most common types.
+
+    python benchmarks/generate_data.py --rows 1000000 --junctions 20 --skew 1.5 --output data/
+"""
+
+import argparse
+import csv
+import os
+import random
+from datetime import datetime
+
+# Columns of a survey file, in file order
+FIELDS = ["JunctionName", "Date", "timeOfDay", "travel_Direction_in", "travel_Direction_out",
+          "Weather_Conditions", "JunctionSpeedLimit", "VehicleSpeed", "VehicleType", "elctricHybrid"]
+
+# The two junctions of the real survey come first, any extra junctions get generated names
+KNOWN_JUNCTIONS = ["Elm Avenue/Rabbit Road", "Hanley Highway/Westway"]
+
+# Share of vehicles per hour of the day (from the sample files)
+HOUR_WEIGHTS = [46, 51, 61, 66, 47, 75, 80, 108, 185, 175, 115, 98,
+                111, 124, 91, 85, 73, 161, 215, 133, 100, 74, 43, 54]
+
+# Vehicle types, most common first, with their share in the sample files and chance of being electric
+VEHICLE_TYPES = ["Car", "Bicycle", "Van", "Motorcycle", "Truck", "Buss", "Scooter"]
+VEHICLE_WEIGHTS = [601, 407, 381, 262, 247, 238, 235]
+ELECTRIC_CHANCE = {"Car": 0.45, "Bicycle": 0.3, "Van": 0.35, "Motorcycle": 0.3,
+                   "Truck": 0.2, "Buss": 0.4, "Scooter": 0.5}
+
+DIRECTIONS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+WEATHER = ["Clear", "Overcast", "Light Rain", "Heavy Rain", "Bright"]
+WEATHER_WEIGHTS = [45, 24, 16, 3, 12]
+SPEED_LIMITS = [20, 30, 40, 50]
+
+# Rows written at a time
+BATCH_SIZE = 100_000
+
+
+def junction_names(count):
+    """
+    Returns the names of count junctions, starting with the junctions of the real survey.
+    """
+
+    names = KNOWN_JUNCTIONS[:count]
+    names += [f"Junction {number} Road/Street {number}" for number in range(len(names) + 1, count + 1)]
+    return names
+
+
+def skewed_weights(weights, skew):
+    """
+    Raises the share of each type to the power skew: 1 keeps the sample mix,
+    higher values favour the most common types, 0 makes every type equally likely.
+    """
+
+    return [weight ** skew for weight in weights]
+
+
+def generate_rows(rows, date, junctions=2, skew=1.0, seed=None):
+    """
+    Yields batches of synthetic survey rows (lists of ten strings).
+    """
+
+    rng = random.Random(seed)
+    names = junction_names(junctions)
+    limits = {name: rng.choice(SPEED_LIMITS) for name in names}
+    # The real junctions keep their real speed limits
+    limits.update({"Elm Avenue/Rabbit Road": 30, "Hanley Highway/Westway": 20})
+    # Busier junctions come first (Zipf-like share of the traffic)
+    junction_weights = [1 / rank for rank in range(1, len(names) + 1)]
+    vehicle_weights = skewed_weights(VEHICLE_WEIGHTS, skew)
+    # Weather is the same for everyone within an hour
+    weather_by_hour = rng.choices(WEATHER, WEATHER_WEIGHTS, k=24)
+    date_text = date.strftime("%d/%m/%Y")
+
+    written = 0
+    while written < rows:
+        size = min(BATCH_SIZE, rows - written)
+        hours = rng.choices(range(24), HOUR_WEIGHTS, k=size)
+        junction_list = rng.choices(names, junction_weights, k=size)
+        types = rng.choices(VEHICLE_TYPES, vehicle_weights, k=size)
+        batch = []
+        for hour, junction, vehicle_type in zip(hours, junction_list, types):
+            direction_in = rng.choice(DIRECTIONS)
+            # About a third of vehicles go straight on
+            direction_out = direction_in if rng.random() < 0.36 else rng.choice(DIRECTIONS)
+            limit = limits[junction]
+            # Speeds spread around 60% of the limit, a few vehicles go up to 7 over it
+            speed = min(max(1, round(rng.gauss(0.62 * limit, 0.35 * limit))), limit + 7)
+            batch.append([
+                junction,
+                date_text,
+                f"{hour:02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}",
+                direction_in,
+                direction_out,
+                weather_by_hour[hour],
+                str(limit),
+                str(speed),
+                vehicle_type,
+                "True" if rng.random() < ELECTRIC_CHANCE[vehicle_type] else "False",
+            ])
+        written += size
+        yield batch
+
+
+def write_survey_file(output_dir, rows, date, junctions=2, skew=1.0, seed=None):
+    """
+    Writes one synthetic traffic_dataDDMMYYYY.csv file and returns its path.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"traffic_data{date:%d%m%Y}.csv")
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(FIELDS)
+        for batch in generate_rows(rows, date, junctions, skew, seed):
+            writer.writerows(batch)
+    return path
+
+
+# Generate files from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic traffic survey CSV files")
+    parser.add_argument("--rows", type=float, default=1e4, help="rows per file (1e4 to 1e8)")
+    parser.add_argument("--junctions", type=int, default=2, help="number of junctions")
+    parser.add_argument("--skew", type=float, default=1.0, help="vehicle mix skew (1 = sample mix)")
+    parser.add_argument("--date", default="15-06-2024", help="date of the file in DD-MM-YYYY format")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for repeatable files")
+    parser.add_argument("--output", default=".", help="folder for the generated file")
+    args = parser.parse_args()
+
+    file_path = write_survey_file(args.output, int(args.rows), datetime.strptime(args.date, "%d-%m-%Y"),
+                                  args.junctions, args.skew, args.seed)
+    print(f"Wrote {int(args.rows)} rows to {file_path}")
@@ -0,0 +1,225 @@
+"""
+Benchmark harness for the traffic data processor.
+
+For each file size it generates a synthetic survey file (see generate_data.py)
+and times, each in a fresh worker process:
+- parse:   reading the file with csv.DictReader and nothing else
+- process: process_csv_data with the chosen engine(s)
+- save:    save_results_to_file for the outcomes of the file
+
+Every result records rows/s (saves/s for the save stage), the peak RSS of the
+worker process and the peak traced Python memory per row (traced_peak_bytes_per_row:
+the tracemalloc peak divided by rows, measured in a separate run so tracing does not
+skew the timings). It is a high-water mark of the memory in use: memory that is freed
+and allocated again does not add to it. The same traced run also counts allocations:
+the memory blocks the stage left allocated per row, from a tracemalloc snapshot diff
+(traced_blocks_per_row, with the lines that allocated most of them in top_allocations)
+and from sys.getallocatedblocks() (allocated_blocks_per_row). Both hold the stage's
+result and anything it caches; a stage that keeps state per row shows up here.
+The results are written to a JSON file with the git commit, so runs of different
+commits can be compared:
+
+    python benchmarks/run_benchmarks.py --rows 1e4 1e5 1e6 --engines rows columnar
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Make the application modules importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_data import write_survey_file  # noqa: E402
+
+# Benchmarked stages
+STAGES = ("parse", "process", "save")
+
+# Lines reported in top_allocations, the ones that left the most blocks allocated
+TOP_ALLOCATIONS = 3
+
+
+def parse_only(file_path):
+    """
+    Reads every row of a CSV file with csv.DictReader and returns the number of rows.
+    """
+
+    with open(file_path, "r") as file:
+        return sum(1 for _ in csv.DictReader(file))
+
+
+def run_stage(stage, file_path, engine):
+    """
+    Runs one stage once and returns its result. For the save stage, returns the seconds spent saving
+    and the number of saves.
+    """
+
+    import main
+
+    if stage == "parse":
+        return parse_only(file_path)
+    hourly_data, outcomes = main.process_csv_data(file_path, engine)
+    if stage == "save":
+        # Save the outcomes many times over so the timing is measurable
+        repeats = 1000
+        with tempfile.TemporaryDirectory() as folder:
+            results_file = os.path.join(folder, "results.txt")
+            start = time.perf_counter()
+            for _ in range(repeats):
+                main.save_results_to_file(outcomes, results_file)
+            return time.perf_counter() - start, repeats
+    return hourly_data, outcomes
+
+
+def measure(stage, file_path, rows, engine, trace_memory):
+    """
+    Times one stage in the current (fresh) worker process.
+    Returns the elapsed seconds, peak RSS in bytes, and peak traced bytes and allocated blocks per row.
+    """
+
+    if stage == "save":
+        elapsed, repeats = run_stage(stage, file_path, engine)
+        result = {"seconds": elapsed, "calls": repeats, "calls_per_second": repeats / max(elapsed, 1e-9)}
+    else:
+        start = time.perf_counter()
+        run_stage(stage, file_path, engine)
+        elapsed = time.perf_counter() - start
+        result = {"seconds": elapsed, "rows_per_second": rows / max(elapsed, 1e-9)}
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_bytes"] = peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+    # A second, traced run measures the peak Python memory in use and counts the blocks
+    # the stage left allocated, both per row (the result is kept until the counts are taken)
+    if trace_memory and stage != "save":
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        blocks = sys.getallocatedblocks()
+        kept = run_stage(stage, file_path, engine)
+        blocks = sys.getallocatedblocks() - blocks
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        del kept
+
+        # Leave out the blocks of tracemalloc itself (the first snapshot)
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        result["traced_peak_bytes_per_row"] = peak / max(rows, 1)
+        result["traced_blocks_per_row"] = sum(stat.count_diff for stat in diff) / max(rows, 1)
+        result["allocated_blocks_per_row"] = blocks / max(rows, 1)
+        result["top_allocations"] = [
+            f"{os.path.relpath(stat.traceback[0].filename, ROOT)}:{stat.traceback[0].lineno} {stat.count_diff:+} blocks"
+            for stat in sorted(diff, key=lambda stat: -stat.count_diff)[:TOP_ALLOCATIONS] if stat.count_diff > 0]
+    return result
+
+
+def measure_in_worker(stage, file_path, rows, engine, trace_memory):
+    """
+    Runs measure() in a new process so peak RSS belongs to this stage alone.
+    """
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(measure, stage, file_path, rows, engine, trace_memory).result()
+
+
+def git_commit():
+    """
+    Returns the current git commit hash, or None outside a git checkout.
+    """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, engines, junctions, skew, data_dir, trace_memory):
+    """
+    Generates one file per size and benchmarks every stage and engine on it.
+    Returns the list of result records.
+    """
+
+    results = []
+    for rows in sizes:
+        file_path = write_survey_file(os.path.join(data_dir, f"{rows}"), rows,
+                                      datetime(2024, 6, 15), junctions, skew, seed=rows)
+        file_size = os.path.getsize(file_path)
+        for stage in STAGES:
+            # Parsing does not depend on the engine
+            for engine in (engines[:1] if stage == "parse" else engines):
+                result = measure_in_worker(stage, file_path, rows, engine, trace_memory)
+                result.update({"stage": stage, "engine": engine, "size_rows": rows, "file_bytes": file_size})
+                results.append(result)
+                rate = (f"{result['calls_per_second']:>14,.0f} saves/s" if stage == "save"
+                        else f"{result['rows_per_second']:>14,.0f} rows/s ")
+                print(f"{rows:>11,} rows  {stage:<8} {engine:<9} {result['seconds']:9.3f}s {rate}  "
+                      f"peak RSS {result['peak_rss_bytes'] / 2**20:8.1f} MiB"
+                      + (f"  {result['traced_peak_bytes_per_row']:8.1f} B/row peak"
+                         f"  {result['traced_blocks_per_row']:7.3f} blocks/row kept"
+                         if "traced_peak_bytes_per_row" in result else ""))
+    return results
+
+
+def compare(old_path, new_path):
+    """
+    Prints the change in rows/s between two result files, stage by stage.
+    """
+
+    with open(old_path) as file:
+        old = {(r["stage"], r["engine"], r["size_rows"]): r for r in json.load(file)["results"]}
+    with open(new_path) as file:
+        new = json.load(file)["results"]
+    for result in new:
+        key = (result["stage"], result["engine"], result["size_rows"])
+        if key in old:
+            rate = "calls_per_second" if key[0] == "save" else "rows_per_second"
+            ratio = result[rate] / max(old[key][rate], 1e-9)
+            print(f"{key[2]:>11,} rows  {key[0]:<8} {key[1]:<9} {ratio:6.2f}x")
+
+
+# Run the benchmarks from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the traffic data processor")
+    parser.add_argument("--rows", type=float, nargs="+", default=[1e4, 1e5], help="file sizes in rows")
+    parser.add_argument("--engines", nargs="+", default=["rows"], help="engines passed to process_csv_data")
+    parser.add_argument("--junctions", type=int, default=2, help="number of junctions in the generated files")
+    parser.add_argument("--skew", type=float, default=1.0, help="vehicle mix skew of the generated files")
+    parser.add_argument("--data-dir", default=None, help="folder for the generated files (default: temporary)")
+    parser.add_argument("--no-trace", "--no-alloc", dest="no_trace", action="store_true",
+                        help="skip the tracemalloc runs that measure the peak traced memory and blocks per row")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        records = run_benchmarks([int(rows) for rows in args.rows], args.engines, args.junctions,
+                                 args.skew, args.data_dir or temp_dir, not args.no_trace)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": records,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {args.output}")
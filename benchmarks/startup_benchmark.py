@@ -0,0 +1,165 @@
+"""
+Startup benchmark of the traffic data processor.
+
+Scripted and cron runs pay for the start of a new Python process every time,
+so this times whole runs of main.py in fresh processes on a small generated
+file (see generate_data.py):
+- python:        an empty interpreter (the floor no change can go below)
+- import:        importing main and nothing else
+- first result:  "main.py --batch DATE" until the outcomes of the day are saved;
+                 a checkout without --batch (like the first commit) is run the
+                 interactive way instead, answering its date prompts on stdin
+
+Each command runs many times and the fastest and median runs are reported.
+--root times another checkout of the repository with the same file, so a
+change can be compared with the commit before it, and --imports lists the
+modules that take longest to import:
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --root ../traffic-data-analysis-old --output old.json
+    python benchmarks/startup_benchmark.py --imports
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from generate_data import write_survey_file
+from run_benchmarks import ROOT, git_commit
+
+# Date of the generated file
+DATE = datetime(2024, 6, 15)
+
+
+def has_option(root, option):
+    """
+    Checks whether the main.py of a checkout has a command line option
+    (the first versions had no --batch, only prompts).
+    """
+
+    with open(os.path.join(root, "main.py"), encoding="utf-8") as file:
+        return f'"{option}"' in file.read()
+
+
+def commands(root, data_dir):
+    """
+    Returns the timed commands as (name, argument list, stdin text or None) tuples.
+    The first result of a checkout without --batch is reached through its prompts: the day, month
+    and year of the file, then N to not load another dataset.
+    """
+
+    main_path = os.path.join(root, "main.py")
+    results_file = os.path.join(data_dir, "results.txt")
+    if has_option(root, "--batch"):
+        # Checkouts that stored every day in the summary database by default need it turned off
+        no_summary = ["--no-summary"] if has_option(root, "--no-summary") else []
+        first_result = ([sys.executable, main_path, "--batch", f"{DATE:%d-%m-%Y}", "--no-cache", *no_summary,
+                         "--results-file", results_file], None)
+    else:
+        first_result = ([sys.executable, main_path], f"{DATE:%d}\n{DATE:%m}\n{DATE:%Y}\nN\n")
+    return [
+        ("python", [sys.executable, "-c", "pass"], None),
+        ("import", [sys.executable, "-c", f"import sys; sys.path.insert(0, {root!r}); import main"], None),
+        ("first result", *first_result),
+    ]
+
+
+def time_command(arguments, cwd, repeats, stdin_text=None):
+    """
+    Runs a command repeats times and returns the seconds of every run.
+    A command given stdin_text is an interactive run: it is started without $DISPLAY, so the
+    histogram window it opens after saving the outcomes fails at once instead of waiting to be
+    closed, and the run counts if the outcomes were saved to results.txt.
+    """
+
+    environment = dict(os.environ)
+    if stdin_text is not None:
+        environment.pop("DISPLAY", None)
+    results_file = os.path.join(cwd, "results.txt")
+    seconds = []
+    for _ in range(repeats):
+        if os.path.exists(results_file):
+            os.remove(results_file)
+        start = time.perf_counter()
+        run = subprocess.run(arguments, cwd=cwd, input=stdin_text, text=True, env=environment,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+        saved = os.path.exists(results_file) and os.path.getsize(results_file) > 0
+        if run.returncode != 0 and not (stdin_text is not None and saved):
+            raise subprocess.CalledProcessError(run.returncode, arguments)
+    return seconds
+
+
+def slowest_imports(root, count=15):
+    """
+    Returns the count modules with the longest cumulative import time when main is imported,
+    as (microseconds, module) pairs, using python -X importtime.
+    """
+
+    run = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                          f"import sys; sys.path.insert(0, {root!r}); import main"],
+                         capture_output=True, text=True, check=True)
+    imports = []
+    for line in run.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def run_startup_benchmark(root, rows, repeats, data_dir):
+    """
+    Generates the file and times every command on it. Returns the list of result records.
+    """
+
+    write_survey_file(data_dir, rows, DATE, seed=rows)
+    results = []
+    for name, arguments, stdin_text in commands(root, data_dir):
+        time_command(arguments, data_dir, 1, stdin_text)   # Warm up the disk cache and the .pyc files
+        seconds = time_command(arguments, data_dir, repeats, stdin_text)
+        result = {"command": name, "rows": rows, "runs": repeats,
+                  "fastest_ms": min(seconds) * 1000, "median_ms": statistics.median(seconds) * 1000}
+        results.append(result)
+        print(f"{name:<14} fastest {result['fastest_ms']:7.1f} ms   median {result['median_ms']:7.1f} ms")
+    return results
+
+
+# Run the benchmark from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the traffic data processor")
+    parser.add_argument("--root", default=ROOT, help="checkout of the repository to time (default: this one)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in the generated file")
+    parser.add_argument("--repeats", type=int, default=20, help="runs of every command")
+    parser.add_argument("--imports", action="store_true", help="list the slowest imports of main and exit")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+    root = os.path.abspath(args.root)
+
+    if args.imports:
+        for microseconds, module in slowest_imports(root):
+            print(f"{microseconds / 1000:8.1f} ms  {module}")
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        records = run_startup_benchmark(root, args.rows, args.repeats, temp_dir)
+
+    if args.output:
+        report = {
+            "commit": git_commit() if root == ROOT else None,
+            "root": root,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": records,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nResults written to {args.output}")
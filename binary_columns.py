@@ -0,0 +1,330 @@
+"""
+Compact binary columnar format for the traffic survey CSV files.
+
+A traffic_dataDDMMYYYY.csv file is converted into traffic_dataDDMMYYYY.tcol:
+- Text columns are dictionary encoded (uint8 or uint16 codes plus a table of labels)
+- VehicleSpeed and JunctionSpeedLimit are packed into the smallest integer type that fits
+- timeOfDay is stored as seconds since midnight (uint32)
+
+Layout: an 8 byte magic number, a little endian uint32 header length, a JSON
+header (row count, source file size and modification time, dictionaries and
+the offset of every column), then the column data, each column aligned to 8
+bytes. The file is read through mmap and NumPy views, so no column is copied;
+BinaryColumns.close (or a with block) releases the mapping. Conversion reads
+the CSV file in batches of BATCH_ROWS rows, so the rows are never all held as
+text at once.
+
+Run "python binary_columns.py FILE [FILE ...]" to convert CSV files by hand.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import islice
+
+from compressed import codec_of, open_csv
+from validation import DataQuality, ValidatedReader
+
+MAGIC = b"TCOL\x00\x01\x00\x00"   # Identifies the file type and format version
+FORMAT_VERSION = 1
+EXTENSION = ".tcol"
+
+# Columns stored as small integers and the column holding the time of day
+INTEGER_COLUMNS = ("VehicleSpeed", "JunctionSpeedLimit")
+TIME_COLUMN = "timeOfDay"
+
+# Columns that share one dictionary, so their codes can be compared directly
+SHARED_DICTIONARIES = {"travel_Direction_in": "direction", "travel_Direction_out": "direction"}
+
+# array typecodes for the stored types (all little endian on disk)
+TYPECODES = {"uint8": "B", "uint16": "H", "uint32": "I", "int32": "i"}
+
+# Rows read and appended to the columns per batch while converting
+BATCH_ROWS = 100_000
+
+
+def binary_path(csv_path):
+    """
+    Returns the path of the binary file that belongs to a CSV file.
+    A compressed file shares it with the plain file (traffic_data15062024.csv.gz -> traffic_data15062024.tcol).
+    """
+
+    if codec_of(csv_path):
+        csv_path, _ = os.path.splitext(csv_path)   # Strip the compression suffix first
+    root, _ = os.path.splitext(csv_path)
+    return root + EXTENSION
+
+
+def time_to_seconds(value):
+    """
+    Converts an HH:MM:SS time of day to seconds since midnight.
+    Raises ValueError if the time is not in that exact format.
+    """
+
+    parts = value.split(":")
+    if len(parts) != 3 or len(parts[0]) != 2:
+        raise ValueError(f"timeOfDay '{value}' is not in HH:MM:SS format")
+    hours, minutes, seconds = (int(part) for part in parts)
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def smallest_integer_type(values):
+    """
+    Returns the name of the smallest stored type that can hold every value.
+    """
+
+    low = min(values, default=0)
+    high = max(values, default=0)
+    if low >= 0 and high < 1 << 8:
+        return "uint8"
+    if low >= 0 and high < 1 << 16:
+        return "uint16"
+    return "int32"
+
+
+def pack(values, dtype):
+    """
+    Packs a sequence of integers into little endian bytes of the given stored type.
+    """
+
+    packed = array(TYPECODES[dtype], values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def convert_csv(csv_path, output_path=None, quality=None):
+    """
+    Converts a traffic survey CSV file into the binary columnar format.
+    The file is written to a temporary name first and then renamed, so readers never see half a file.
+    Rows that fail validation are left out; the data quality summary is kept in the header and,
+    once the file is written, merged into quality (a DataQuality) if given.
+    Returns the path of the binary file.
+    """
+
+    output_path = output_path or binary_path(csv_path)
+    stat = os.stat(csv_path)
+
+    # Read the good rows of the CSV file a batch at a time and append each batch to the columns
+    file_quality = DataQuality(csv_path)
+    dictionaries = {}   # Dictionary name -> {label: code}
+    with open_csv(csv_path, newline="") as file:
+        reader = ValidatedReader(file, file_quality)
+        fields = reader.fields
+        # Integers are kept as 64 bit values until the smallest stored type is known
+        columns = {name: array("q") if name in INTEGER_COLUMNS else array("I") for name in fields}
+        for batch in iter(lambda: list(islice(reader, BATCH_ROWS)), []):
+            for name, values in zip(fields, zip(*batch)):
+                if name in INTEGER_COLUMNS:
+                    columns[name].extend(map(int, values))
+                elif name == TIME_COLUMN:
+                    columns[name].extend(map(time_to_seconds, values))
+                else:
+                    # Dictionary encode the column, codes follow the order of first appearance
+                    table = dictionaries.setdefault(SHARED_DICTIONARIES.get(name, name), {})
+                    for value in dict.fromkeys(values):
+                        table.setdefault(value, len(table))
+                    columns[name].extend(map(table.__getitem__, values))
+    row_count = len(columns[fields[0]]) if fields else 0
+
+    blocks = []         # (column name, header entry, packed bytes)
+    for name, values in columns.items():
+        if name in INTEGER_COLUMNS:
+            dtype = smallest_integer_type(values)
+            blocks.append((name, {"encoding": "integer", "dtype": dtype}, pack(values, dtype)))
+        elif name == TIME_COLUMN:
+            blocks.append((name, {"encoding": "seconds", "dtype": "uint32"}, pack(values, "uint32")))
+        else:
+            dictionary_name = SHARED_DICTIONARIES.get(name, name)
+            dictionaries.setdefault(dictionary_name, {})
+            blocks.append((name, {"encoding": "dictionary", "dictionary": dictionary_name}, values))
+
+    # Dictionary codes are packed once every dictionary is complete
+    for index, (name, entry, data) in enumerate(blocks):
+        if entry["encoding"] == "dictionary":
+            entry["dtype"] = "uint8" if len(dictionaries[entry["dictionary"]]) <= 1 << 8 else "uint16"
+            blocks[index] = (name, entry, pack(data, entry["dtype"]))
+
+    # Work out the offset of every column; the header size depends on the offsets, so repeat until stable
+    header = {}
+    header_bytes = b""
+    while True:
+        offset = align(len(MAGIC) + 4 + len(header_bytes))
+        columns_header = {}
+        for name, entry, data in blocks:
+            columns_header[name] = dict(entry, offset=offset, length=len(data))
+            offset = align(offset + len(data))
+        header = {
+            "version": FORMAT_VERSION,
+            "row_count": row_count,
+            "source": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+            "fields": fields,
+            "data_quality": file_quality.summary(),
+            "dictionaries": {name: list(table) for name, table in dictionaries.items()},
+            "columns": columns_header,
+        }
+        encoded = json.dumps(header).encode()
+        if len(encoded) == len(header_bytes):
+            header_bytes = encoded
+            break
+        header_bytes = encoded
+
+    # Write the file under a temporary name, then rename it into place
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header_bytes)))
+        file.write(header_bytes)
+        for name, entry, data in blocks:
+            file.write(b"\0" * (header["columns"][name]["offset"] - file.tell()))
+            file.write(data)
+    os.replace(temp_path, output_path)
+    if quality is not None:
+        quality.merge(file_quality)
+    return output_path
+
+
+def align(offset, boundary=8):
+    """
+    Rounds an offset up to the next multiple of boundary.
+    """
+
+    return (offset + boundary - 1) // boundary * boundary
+
+
+def read_header(path):
+    """
+    Reads the JSON header of a binary file, or returns None if the file is missing or not in this format.
+    """
+
+    try:
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return None
+            (length,) = struct.unpack("<I", file.read(4))
+            return json.loads(file.read(length))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def is_stale(csv_path, header):
+    """
+    Checks whether a binary file header no longer matches its CSV file.
+    """
+
+    if header is None or header.get("version") != FORMAT_VERSION:
+        return True
+    stat = os.stat(csv_path)
+    source = header["source"]
+    return source["size"] != stat.st_size or source["mtime_ns"] != stat.st_mtime_ns
+
+
+def ensure_binary(csv_path, quality=None):
+    """
+    Returns the path of an up-to-date binary file for a CSV file,
+    building it the first time and rebuilding it when the CSV file has changed.
+    The data quality of the CSV file is added to quality (a DataQuality) if given.
+    """
+
+    path = binary_path(csv_path)
+    header = read_header(path)
+    if is_stale(csv_path, header):
+        convert_csv(csv_path, path, quality)
+    elif quality is not None:
+        quality.add_summary(header.get("data_quality", {}))
+    return path
+
+
+class BinaryColumns:
+    def __init__(self, path):
+        """
+        Opens a binary file through mmap and exposes its columns as zero-copy NumPy arrays,
+        with the same attributes as columnar.TrafficColumns.
+        """
+
+        import numpy as np
+
+        self.header = read_header(path)
+        if self.header is None:
+            raise ValueError(f"'{path}' is not a traffic binary columnar file")
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.row_count = self.header["row_count"]
+        dictionaries = self.header["dictionaries"]
+
+        def column(name):
+            entry = self.header["columns"][name]
+            return np.frombuffer(self.buffer, dtype=np.dtype(entry["dtype"]).newbyteorder("<"),
+                                 count=self.row_count, offset=entry["offset"])
+
+        # Category columns are used as they are stored
+        self.junction = column("JunctionName")
+        self.junction_labels = dictionaries["JunctionName"]
+        self.vehicle_type = column("VehicleType")
+        self.vehicle_type_labels = dictionaries["VehicleType"]
+        self.weather = column("Weather_Conditions")
+        self.weather_labels = dictionaries["Weather_Conditions"]
+        self.direction_in = column("travel_Direction_in")
+        self.direction_out = column("travel_Direction_out")
+        self.direction_labels = dictionaries["direction"]
+
+        # Speeds as packed integers
+        self.vehicle_speed = column("VehicleSpeed")
+        self.speed_limit = column("JunctionSpeedLimit")
+
+        # Electric flag from the codes whose label reads "true"
+        electric_labels = dictionaries["elctricHybrid"]
+        true_codes = [code for code, label in enumerate(electric_labels) if label.lower() == "true"]
+        self.electric = np.isin(column("elctricHybrid"), true_codes)
+
+        # Hour codes in order of first appearance, like the CSV engines
+        hours = column(TIME_COLUMN) // 3600
+        values, first_index = np.unique(hours, return_index=True)
+        order = np.argsort(first_index, kind="stable")
+        self.hour_labels = [f"{values[i]:02d}" for i in order]
+        remap = np.zeros(int(values.max()) + 1 if len(values) else 1, dtype=np.int32)
+        remap[values[order]] = np.arange(len(order), dtype=np.int32)
+        self.hour = remap[hours]
+
+    def close(self):
+        """
+        Drops the column views and closes the mmap of the file.
+        """
+
+        # The mmap cannot be closed while NumPy views still point into it
+        for name in ("junction", "vehicle_type", "weather", "direction_in", "direction_out",
+                     "vehicle_speed", "speed_limit"):
+            setattr(self, name, None)
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compute_binary_metrics(csv_path, quality=None):
+    """
+    Computes the raw counts and hourly histogram data of a CSV file from its binary file,
+    building or rebuilding the binary file first when needed.
+    If the binary file cannot be written (for example a read-only folder), the CSV file is read instead.
+    """
+
+    from columnar import TrafficColumns, compute_metrics_from_columns
+
+    try:
+        data = BinaryColumns(ensure_binary(csv_path, quality))
+    except PermissionError:
+        return compute_metrics_from_columns(TrafficColumns(csv_path, quality))
+    with data:
+        return compute_metrics_from_columns(data)
+
+
+# Convert the CSV files given on the command line
+if __name__ == "__main__":
+    for csv_file in sys.argv[1:]:
+        print(f"{csv_file} -> {convert_csv(csv_file)}")
@@ -0,0 +1,281 @@
+"""
+Persistent cache of the aggregates computed from each CSV file.
+
+Entries are stored on disk as JSON files (one per CSV file) and hold the raw
+counts and histogram data of the file, together with its fingerprint: path,
+size and modification time. The file is only hashed when its modification time
+changes without its size: the hash is kept with the new entry, so a file that is
+touched again without being changed is still a cache hit. A cache miss never
+reads the file a second time just to hash it. An in-memory LRU layer sits on top
+so a repeat query in the same session is a dictionary lookup.
+
+The entries live in the user's cache folder (see user_cache_dir), not in the
+folder the program is run from. hashlib and json are imported on first use,
+so importing this module (as main.py does at start-up) stays cheap.
+"""
+
+import os
+from collections import OrderedDict
+
+# Version of the entry layout, entries written with another version are ignored
+CACHE_VERSION = 5
+
+
+def user_cache_dir():
+    """
+    Returns the folder for the files kept between runs (the aggregate cache and the summary database):
+    traffic-data-analysis in $XDG_CACHE_HOME or ~/.cache, or in %LOCALAPPDATA% on Windows.
+    """
+
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "traffic-data-analysis")
+
+
+# Default folder for the cache files
+DEFAULT_CACHE_DIR = os.path.join(user_cache_dir(), "aggregates")
+
+# Default limits for the two cache layers
+DEFAULT_MEMORY_ENTRIES = 32
+DEFAULT_MAX_DISK_BYTES = 64 * 1024 * 1024
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    """
+    Returns the BLAKE2 hash of a file's contents, read in blocks.
+    """
+
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AggregateCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        """
+        Initializes the cache:
+        - cache_dir is the folder for the on-disk entries (created when first needed)
+        - memory_entries is the number of files kept in the in-memory LRU layer
+        - max_disk_bytes bounds the total size of the on-disk entries
+        """
+
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()   # Absolute file path -> cached entry, least recently used first
+        self.memory_hits = 0          # Lookups answered from memory
+        self.disk_hits = 0            # Lookups answered from disk
+        self.misses = 0               # Lookups that needed the file to be processed
+        self.hashes = {}              # Absolute file path -> (size, mtime_ns, content hash) taken by is_fresh
+
+    def entry_path(self, file_path):
+        """
+        Returns the path of the on-disk entry for a CSV file.
+        """
+
+        import hashlib
+
+        name = hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def is_fresh(self, entry, file_path, stat):
+        """
+        Checks whether a cached entry still matches the file:
+        - Same size and modification time, or
+        - Same size and same content hash (the file was touched but not changed)
+        The hash of the file is remembered, so put() can store it without reading the file again.
+        """
+
+        if entry["size"] != stat.st_size:
+            return False
+        if entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        content_hash = file_content_hash(file_path)
+        self.hashes[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns, content_hash)
+        if entry.get("content_hash") == content_hash:
+            # Remember the new modification time so the next lookup skips the hash
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self.write_entry(file_path, entry)
+            return True
+        return False
+
+    def get(self, file_path):
+        """
+        Returns the cached (hourly_data, metrics) of a CSV file, or None if there is no fresh entry.
+        Raises FileNotFoundError if the CSV file does not exist.
+        """
+
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+
+        # First look in memory
+        entry = self.memory.get(key)
+        if entry is not None and self.is_fresh(entry, file_path, stat):
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry["hourly_data"], entry["metrics"]
+
+        # Then look on disk
+        entry = self.read_entry(file_path)
+        if entry is not None and self.is_fresh(entry, file_path, stat):
+            self.remember(key, entry)
+            self.disk_hits += 1
+            # Touch the entry so disk eviction sees it as recently used
+            os.utime(self.entry_path(file_path))
+            return entry["hourly_data"], entry["metrics"]
+
+        self.misses += 1
+        return None
+
+    def put(self, file_path, hourly_data, metrics):
+        """
+        Stores the aggregates of a CSV file in memory and on disk.
+        The content hash is only stored if is_fresh() already took it for this version of the file.
+        """
+
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        size, mtime_ns, content_hash = self.hashes.pop(key, (None, None, None))
+        entry = {
+            "version": CACHE_VERSION,
+            "file_path": key,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "content_hash": content_hash if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns) else None,
+            "hourly_data": hourly_data,
+            "metrics": metrics,
+        }
+        self.remember(entry["file_path"], entry)
+        self.write_entry(file_path, entry)
+        self.evict()
+
+    def remember(self, key, entry):
+        """
+        Adds an entry to the in-memory LRU layer, dropping the least recently used one if it is full.
+        """
+
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def read_entry(self, file_path):
+        """
+        Reads the on-disk entry of a CSV file, or returns None if it is missing, unreadable
+        or written by another version.
+        """
+
+        import json
+
+        try:
+            with open(self.entry_path(file_path), "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("version") == CACHE_VERSION else None
+
+    def write_entry(self, file_path, entry):
+        """
+        Writes the on-disk entry of a CSV file atomically (write to a temporary file, then rename).
+        """
+
+        import json
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.entry_path(file_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(entry, file)
+        os.replace(temp_path, path)
+
+    def evict(self):
+        """
+        Deletes the least recently used on-disk entries until the cache fits in max_disk_bytes.
+        """
+
+        try:
+            names = [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return
+        entries = []
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        # Remove the oldest entries first
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, file_path=None):
+        """
+        Removes the cached entry of one CSV file, or every entry if no file is given.
+        """
+
+        if file_path is None:
+            self.memory.clear()
+            paths = []
+            if os.path.isdir(self.cache_dir):
+                paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)]
+        else:
+            self.memory.pop(os.path.abspath(file_path), None)
+            paths = [self.entry_path(file_path)]
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+        """
+
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+def add_stats(total, stats):
+    """
+    Adds the counters of stats (see AggregateCache.stats) to total (a dict that may be empty) and returns total,
+    for example to sum the caches of the worker processes of a batch run.
+    """
+
+    for name in ("memory_hits", "disk_hits", "misses"):
+        total[name] = total.get(name, 0) + stats[name]
+    lookups = total["memory_hits"] + total["disk_hits"] + total["misses"]
+    total["hit_rate"] = (total["memory_hits"] + total["disk_hits"]) / lookups if lookups else 0.0
+    return total
+
+
+def stats_line(stats):
+    """
+    Returns the counters of stats (see AggregateCache.stats) as one line of text.
+    """
+
+    return (f"Aggregate cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
@@ -0,0 +1,168 @@
+"""
+Chunked parallel processing of a single large CSV file.
+
+The file is split into byte ranges that start and end on line boundaries.
+Each range is processed on a worker process into a TrafficAggregate, and the
+partial aggregates are merged in file order before any outcome is worked out.
+Quoted fields that contain line breaks are not supported (the survey files
+never have them).
+
+Compressed files cannot be split by byte offset, so they are decompressed as
+one stream and cut into batches of lines that are sent to the workers instead.
+"""
+
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from aggregate import TrafficAggregate
+from compressed import codec_of, open_csv
+from validation import DataQuality, ValidatedReader, check_fields
+
+# Smallest chunk worth sending to a worker process
+MIN_CHUNK_BYTES = 1 << 20
+
+# Lines per batch of a compressed file, and batches in flight per worker (bounds the memory used)
+BATCH_LINES = 50_000
+BATCHES_PER_WORKER = 2
+
+
+def split_file_chunks(file_path, chunk_count):
+    """
+    Splits a CSV file into at most chunk_count byte ranges:
+    - Returns the header fields and a list of (start, end) byte offsets
+    - Every range starts at the beginning of a line and ends just after a newline (or at the end of the file)
+    """
+    
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as file:
+        header = file.readline()             # The first line holds the column names
+        data_start = file.tell()             # Rows start right after the header
+
+        # Work out the rough size of each chunk
+        chunk_size = max((file_size - data_start) // max(chunk_count, 1), 1)
+        chunks = []
+        start = data_start
+        while start < file_size:
+            # Jump ahead by one chunk and move forward to the end of that line
+            file.seek(min(start + chunk_size, file_size))
+            if file.tell() < file_size:
+                file.readline()
+            end = file.tell()
+            chunks.append((start, end))
+            start = end
+
+    fields = next(csv.reader([header.decode()]), [])
+    return fields, chunks
+
+
+def read_chunk_lines(file_path, start, end):
+    """
+    Yields the lines of a file between two byte offsets as text, without loading the whole range.
+    """
+    
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        remaining = end - start              # Bytes left in this chunk
+        for line in file:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line.decode()
+
+
+def process_chunk(file_path, fields, start, end):
+    """
+    Processes the rows in one byte range of a CSV file and returns its partial TrafficAggregate,
+    its DataQuality (line numbers counted from the start of the range) and the number of lines in the range.
+    """
+    
+    return process_lines(fields, read_chunk_lines(file_path, start, end), file_path)
+
+
+def process_lines(fields, lines, file_path=""):
+    """
+    Processes a batch of CSV lines (without the header) and returns its partial TrafficAggregate,
+    its DataQuality (line numbers counted from the start of the batch) and the number of lines in the batch.
+    """
+
+    aggregate = TrafficAggregate()
+    quality = DataQuality(file_path)
+    reader = ValidatedReader(lines, quality, fields)
+    for row in reader.dicts():
+        aggregate.add_row(row)
+    return aggregate, quality, reader.line_num
+
+
+def stream_partials(file_path, workers):
+    """
+    Yields the partials (see process_lines) of a compressed CSV file in file order:
+    - the file is read as one decompressing stream and cut into batches of BATCH_LINES lines
+    - at most BATCHES_PER_WORKER batches per worker are in flight at any time
+    """
+
+    with open_csv(file_path, newline="") as file:
+        fields = next(csv.reader([file.readline()]), [])
+        check_fields(fields)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            while True:
+                lines = list(islice(file, BATCH_LINES))
+                if lines:
+                    pending.append(executor.submit(process_lines, fields, lines, file_path))
+                # Wait for the oldest batch when the pipeline is full or the file has ended
+                while pending and (not lines or len(pending) >= workers * BATCHES_PER_WORKER):
+                    yield pending.pop(0).result()
+                if not lines:
+                    break
+
+
+def merge_partials(partials, quality=None):
+    """
+    Merges (aggregate, quality, line count) partials in file order and returns the histogram data and raw counts.
+    The line numbers of quarantined rows are moved on by the lines of the header and the earlier partials.
+    """
+
+    aggregate = TrafficAggregate()
+    lines_before = 1                         # The header line
+    for partial, partial_quality, line_count in partials:
+        aggregate.merge(partial)
+        if quality is not None:
+            quality.merge(partial_quality, lines_before)
+        lines_before += line_count
+    return aggregate.hourly_data, aggregate.metrics()
+
+
+def compute_chunked_metrics(file_path, workers=None, chunk_count=None, quality=None):
+    """
+    Processes one CSV file in chunks on worker processes:
+    - Returns the histogram data and raw counts, exactly like the serial row loop
+    - chunk_count defaults to one chunk per worker, but never chunks smaller than MIN_CHUNK_BYTES
+    - compressed files are streamed to the workers in batches of lines instead
+    - bad rows and unknown values of every chunk are merged into quality (a DataQuality) if given
+    Raises ValueError if the header of the file misses any of the survey columns (for example an empty file).
+    """
+    
+    workers = workers or os.cpu_count() or 1
+    if codec_of(file_path):
+        return merge_partials(stream_partials(file_path, workers), quality)
+
+    if chunk_count is None:
+        chunk_count = max(1, min(workers, os.path.getsize(file_path) // MIN_CHUNK_BYTES))
+    fields, chunks = split_file_chunks(file_path, chunk_count)
+    # An empty file, or one without the survey columns, is refused like the row loop refuses it
+    check_fields(fields)
+
+    # A single chunk does not need a pool of workers
+    if len(chunks) <= 1:
+        partials = [process_chunk(file_path, fields, start, end) for start, end in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map keeps the chunks in file order, which the merge relies on
+            partials = list(executor.map(process_chunk,
+                                         [file_path] * len(chunks), [fields] * len(chunks),
+                                         [start for start, end in chunks], [end for start, end in chunks]))
+
+    # Merge the partial aggregates in file order
+    return merge_partials(partials, quality)
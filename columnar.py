@@ -0,0 +1,239 @@
+"""
+Columnar engine for processing the traffic survey CSV files.
+
+The file is loaded once into typed, array backed columns and every outcome
+is computed with batched NumPy reductions instead of a per row loop. Lines are
+read in batches of BATCH_ROWS and split straight into columns (see
+ValidatedReader.columns), so only one batch is held as text at a time.
+The row loop in main.process_csv_data stays the reference implementation.
+"""
+
+from operator import itemgetter
+
+import numpy as np
+
+from aggregate import ELM_RABBIT, JUNCTION_COUNTERS, JunctionTable
+from compressed import open_csv
+from speed_stats import SpeedStats
+from validation import DataQuality, ValidatedReader
+
+# Vehicle types counted as two-wheeled vehicles
+TWO_WHEELED_TYPES = ("Bicycle", "Motorcycle", "Scooter")
+
+# Weather conditions counted as rain
+RAIN_CONDITIONS = ("Light Rain", "Heavy Rain")
+
+# Rows read and encoded per batch
+BATCH_ROWS = 100_000
+
+
+def encode_batch(values, table):
+    """
+    Dictionary-encodes one batch of a column of strings:
+    - Returns the integer code of every value as a NumPy array
+    - Adds values not seen before to table (value -> code), which is shared by every batch of the column,
+      so codes follow the order of first appearance over the whole column
+    """
+
+    for value in dict.fromkeys(values):   # Distinct values of the batch, first appearance first
+        table.setdefault(value, len(table))
+    return np.fromiter(map(table.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+def joined(parts, dtype):
+    """
+    Joins the per batch arrays of a column into one array (an empty one if there were no rows).
+    """
+
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+
+def category_code(labels, value):
+    """
+    Returns the code of a category value, or -1 if it never appears in the column.
+    """
+
+    try:
+        return labels.index(value)
+    except ValueError:
+        return -1
+
+
+class TrafficColumns:
+    def __init__(self, file_path, quality=None):
+        """
+        Loads the ten survey columns of a CSV file into typed arrays:
+        - Junction, vehicle type, weather and directions as small integer category codes
+        - Speeds and speed limits as integer arrays
+        - timeOfDay as an hour code
+        Rows that fail validation are left out and recorded in quality (a DataQuality) if given.
+        """
+
+        # Category columns are encoded against tables shared by every batch; both direction columns
+        # share one table so they can be compared code by code
+        tables = {name: {} for name in ("junction", "vehicle_type", "weather", "direction", "hour", "electric")}
+        parts = {name: [] for name in ("junction", "vehicle_type", "weather", "direction_in", "direction_out",
+                                       "hour", "electric", "vehicle_speed", "speed_limit")}
+        encoded = (("junction", "JunctionName", "junction"), ("vehicle_type", "VehicleType", "vehicle_type"),
+                   ("weather", "Weather_Conditions", "weather"), ("direction_in", "travel_Direction_in", "direction"),
+                   ("direction_out", "travel_Direction_out", "direction"), ("electric", "elctricHybrid", "electric"))
+
+        # Read the good rows a batch of columns at a time and add each batch to the columns
+        with open_csv(file_path, newline="") as file:
+            reader = ValidatedReader(file, quality or DataQuality(file_path))
+            for column in reader.columns(BATCH_ROWS):
+                for part, name, table in encoded:
+                    parts[part].append(encode_batch(column[name], tables[table]))
+                # The hour is the first two characters of timeOfDay, kept in order of first appearance
+                parts["hour"].append(encode_batch(list(map(itemgetter(slice(2)), column["timeOfDay"])),
+                                                  tables["hour"]))
+                # Speeds as integer arrays, each distinct spelling converted once
+                for part, name in (("vehicle_speed", "VehicleSpeed"), ("speed_limit", "JunctionSpeedLimit")):
+                    table = {}
+                    codes = encode_batch(column[name], table)
+                    parts[part].append(np.array(list(map(int, table)), dtype=np.int64)[codes])
+
+        # Category columns stored as integer codes plus a table of labels
+        self.junction = joined(parts["junction"], np.int32)
+        self.junction_labels = list(tables["junction"])
+        self.vehicle_type = joined(parts["vehicle_type"], np.int32)
+        self.vehicle_type_labels = list(tables["vehicle_type"])
+        self.weather = joined(parts["weather"], np.int32)
+        self.weather_labels = list(tables["weather"])
+        self.direction_in = joined(parts["direction_in"], np.int32)
+        self.direction_out = joined(parts["direction_out"], np.int32)
+        self.direction_labels = list(tables["direction"])
+        self.hour = joined(parts["hour"], np.int32)
+        self.hour_labels = list(tables["hour"])
+        self.vehicle_speed = joined(parts["vehicle_speed"], np.int64)
+        self.speed_limit = joined(parts["speed_limit"], np.int64)
+
+        # Number of rows (one row represents one vehicle)
+        self.row_count = len(self.junction)
+
+        # Electric or hybrid flag as a boolean array, worked out once per distinct spelling
+        self.electric = np.isin(joined(parts["electric"], np.int32),
+                                [code for label, code in tables["electric"].items() if label.lower() == "true"])
+
+
+def junction_table(data, is_scooter, counter_masks):
+    """
+    Builds the JunctionTable of loaded columns with one bincount over (junction, hour) codes,
+    and one more per counter for its rows (counter_masks are boolean arrays in JUNCTION_COUNTERS order).
+    Hours and junctions keep their codes, which are already in order of first appearance.
+    """
+
+    hour_count = len(data.hour_labels)
+    junction_count = len(data.junction_labels)
+    cells = data.junction.astype(np.int64) * hour_count + data.hour
+
+    table = JunctionTable()
+    table.hours = list(data.hour_labels)
+    table.hour_ids = {hour: code for code, hour in enumerate(table.hours)}
+    table.junctions = list(data.junction_labels)
+    table.junction_ids = {junction: code for code, junction in enumerate(table.junctions)}
+
+    # Vehicles per hour and junction, as the dense hours x junctions table
+    counts = np.bincount(cells, minlength=junction_count * hour_count).reshape(junction_count, hour_count)
+    table.counts = counts.T.tolist()
+    table.scooters = np.bincount(data.junction[is_scooter], minlength=junction_count).tolist()
+
+    # Counters per hour and junction, as hours x junctions x counters
+    counters = np.stack([np.bincount(cells[mask], minlength=junction_count * hour_count)
+                         .reshape(junction_count, hour_count) for mask in counter_masks])
+    table.counters = counters.transpose(2, 1, 0).tolist()
+
+    # Hours of each junction in the order they first appear at that junction
+    table.hour_order = [[] for _ in range(junction_count)]
+    used_cells, first_index = np.unique(cells, return_index=True)
+    for cell in used_cells[np.argsort(first_index, kind="stable")].tolist():
+        table.hour_order[cell // hour_count].append(cell % hour_count)
+    return table
+
+
+def speed_stats(data):
+    """
+    Builds the speed sketches of loaded columns with one bincount over (group, speed) per dimension.
+    Groups keep their codes, which are already in order of first appearance.
+    """
+
+    stats = SpeedStats()
+    speeds = data.vehicle_speed.astype(np.int64)
+    width = int(speeds.max()) + 1 if len(speeds) else 1
+    for dimension, codes, labels in (("junctions", data.junction, data.junction_labels),
+                                     ("hours", data.hour, data.hour_labels),
+                                     ("vehicle_types", data.vehicle_type, data.vehicle_type_labels)):
+        counts = np.bincount(codes.astype(np.int64) * width + speeds,
+                             minlength=len(labels) * width).reshape(len(labels), width)
+        for label, label_counts in zip(labels, counts):
+            used = np.flatnonzero(label_counts)
+            stats.add_counts(dimension, label, zip(used.tolist(), label_counts[used].tolist()))
+
+    # How far the speeding vehicles went over the limit
+    excess = speeds - data.speed_limit.astype(np.int64)
+    excess_counts = np.bincount(excess[excess > 0])
+    used = np.flatnonzero(excess_counts)
+    stats.add_counts("over_limit", None, zip(used.tolist(), excess_counts[used].tolist()))
+    return stats
+
+
+def compute_columnar_metrics(file_path, quality=None):
+    """
+    Computes the raw counts used by main.build_outcomes and the hourly histogram data
+    for a CSV file with batched reductions over its columns.
+    """
+
+    return compute_metrics_from_columns(TrafficColumns(file_path, quality))
+
+
+def compute_metrics_from_columns(data):
+    """
+    Computes the raw counts and the hourly histogram data from loaded columns.
+    data can be any object with the same column attributes as TrafficColumns.
+    """
+
+    # Codes of the categories used by the outcomes (-1 if the category is absent)
+    elm = category_code(data.junction_labels, ELM_RABBIT)
+    north = category_code(data.direction_labels, "N")
+
+    # Count of every vehicle type in one pass
+    type_counts = np.bincount(data.vehicle_type, minlength=len(data.vehicle_type_labels))
+
+    def type_count(name):
+        code = category_code(data.vehicle_type_labels, name)
+        return int(type_counts[code]) if code >= 0 else 0
+
+    is_elm = data.junction == elm
+    is_scooter = data.vehicle_type == category_code(data.vehicle_type_labels, "Scooter")
+    is_rain = np.isin(data.weather, [category_code(data.weather_labels, name) for name in RAIN_CONDITIONS])
+
+    # Rows of every counter kept per hour and junction, in JUNCTION_COUNTERS order
+    counter_masks = dict(zip(JUNCTION_COUNTERS, (
+        data.vehicle_type == category_code(data.vehicle_type_labels, "Truck"),
+        data.electric,
+        np.isin(data.vehicle_type, [category_code(data.vehicle_type_labels, name) for name in TWO_WHEELED_TYPES]),
+        is_elm & (data.direction_out == north) & (data.vehicle_type == category_code(data.vehicle_type_labels, "Buss")),
+        data.direction_in == data.direction_out,
+        data.vehicle_speed > data.speed_limit,
+        data.vehicle_type == category_code(data.vehicle_type_labels, "Bicycle"),
+    )))
+
+    metrics = {
+        "total_vehicles": data.row_count,
+        "total_trucks": type_count("Truck"),
+        "total_electric_vehicles": int(np.count_nonzero(data.electric)),
+        "two_wheeled_vehicles": sum(type_count(name) for name in TWO_WHEELED_TYPES),
+        "busses_leaving_north": int(np.count_nonzero(counter_masks["busses_leaving_north"])),
+        "vehicles_no_turns": int(np.count_nonzero(counter_masks["vehicles_no_turns"])),
+        "vehicles_over_speed": int(np.count_nonzero(counter_masks["vehicles_over_speed"])),
+        "rain_hours": len(np.unique(data.hour[is_rain])),
+        "total_bicycles": type_count("Bicycle"),
+    }
+
+    # Totals, scooters, peak hours and counters of every junction, and the histogram data (Task D)
+    table = junction_table(data, is_scooter, counter_masks.values())
+    metrics.update(table.report_metrics())
+
+    # Speed sketches per junction, hour and vehicle type
+    metrics["speed_stats"] = speed_stats(data).to_dict()
+    return table.hourly_data(), metrics
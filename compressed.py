@@ -0,0 +1,193 @@
+"""
+Reading survey files that are archived compressed.
+
+A day's file may be kept as traffic_dataDDMMYYYY.csv or compressed as
+.csv.gz, .csv.xz, .csv.bz2 or .csv.zst. find_csv_file() picks whichever of
+them exists and open_csv() opens any of them as a text stream for the CSV
+reader.
+
+Compressed files are decompressed on a background thread that hands blocks
+to the reader through a small bounded queue, so decompression overlaps with
+parsing (zlib, lzma and bz2 release the GIL while they work) and memory stays
+at a few blocks whatever the size of the file.
+"""
+
+import io
+import os
+
+# Size of each decompressed block, and how many blocks may wait for the reader
+BLOCK_SIZE = 1 << 20
+MAX_BLOCKS = 8
+
+# File extensions of the supported codecs, in the order find_csv_file tries them
+CODEC_EXTENSIONS = (".gz", ".zst", ".xz", ".bz2")
+
+
+# The codec modules (and the threading of ThreadedDecompressor) are imported when a
+# compressed file is opened, so reading plain CSV files does not pay for them
+def open_gzip(file_path):
+    import gzip
+    return gzip.open(file_path, "rb")
+
+
+def open_xz(file_path):
+    import lzma
+    return lzma.open(file_path, "rb")
+
+
+def open_bz2(file_path):
+    import bz2
+    return bz2.open(file_path, "rb")
+
+
+def open_zstd(file_path):
+    """
+    Opens a zstd compressed file as a binary stream of decompressed bytes.
+    Uses the standard library on Python 3.14+ and the zstandard package before that.
+    """
+
+    try:
+        from compression import zstd
+        return zstd.open(file_path, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files needs the zstandard package (pip install zstandard) "
+                          "or Python 3.14+") from None
+    return zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+
+
+# How each codec is opened as a binary stream of decompressed bytes
+OPENERS = {
+    ".gz": open_gzip,
+    ".zst": open_zstd,
+    ".xz": open_xz,
+    ".bz2": open_bz2,
+}
+
+
+def codec_of(file_path):
+    """
+    Returns the codec extension of a compressed file (".gz", ...), or None for a plain file.
+    """
+
+    extension = os.path.splitext(file_path)[1].lower()
+    return extension if extension in OPENERS else None
+
+
+def find_csv_file(file_path):
+    """
+    Returns file_path if it exists, otherwise the first compressed copy of it that exists
+    (file_path + ".gz", ".zst", ".xz" or ".bz2"). Returns file_path unchanged if none exists,
+    so opening it still raises FileNotFoundError.
+    """
+
+    if os.path.exists(file_path) or codec_of(file_path):
+        return file_path
+    for extension in CODEC_EXTENSIONS:
+        if os.path.exists(file_path + extension):
+            return file_path + extension
+    return file_path
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    def __init__(self, stream, block_size=BLOCK_SIZE, max_blocks=MAX_BLOCKS):
+        """
+        Reads a decompressing binary stream on a background thread:
+        - block_size is the number of decompressed bytes read at a time
+        - max_blocks bounds the blocks waiting to be read, and so the memory used
+        """
+
+        import queue
+        import threading
+
+        super().__init__()
+        self.stream = stream
+        self.block_size = block_size
+        self.blocks = queue.Queue(max_blocks)
+        self.pending = memoryview(b"")    # Part of the current block not read yet
+        self.finished = False             # The end of the stream was reached
+        self.error = None                 # Error raised while decompressing, re-raised to the reader
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, name="decompress", daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        """
+        Background thread: reads blocks until the end of the stream (or close()) and queues them.
+        A None block marks the end.
+        """
+
+        try:
+            while not self.stop.is_set():
+                block = self.stream.read(self.block_size)
+                if not block:
+                    break
+                self.put(block)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.put(None)
+
+    def put(self, block):
+        """
+        Queues a block, giving up if the reader closes the stream while the queue is full.
+        """
+
+        import queue
+
+        while not self.stop.is_set():
+            try:
+                self.blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """
+        Copies decompressed bytes into buffer and returns how many, or 0 at the end of the stream.
+        """
+
+        while not self.pending:
+            if self.finished:
+                return 0
+            block = self.blocks.get()
+            if block is None:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+                return 0
+            self.pending = memoryview(block)
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+    def close(self):
+        """
+        Stops the background thread and closes the compressed file.
+        """
+
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+def open_csv(file_path, newline=None):
+    """
+    Opens a CSV file for reading as text, plain or compressed (decompressed on a background thread).
+    newline is passed on like open() does (the csv module recommends newline="").
+    """
+
+    codec = codec_of(file_path)
+    if codec is None:
+        return open(file_path, "r", newline=newline)
+    raw = ThreadedDecompressor(OPENERS[codec](file_path))
+    return io.TextIOWrapper(io.BufferedReader(raw, BLOCK_SIZE), newline=newline)
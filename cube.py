@@ -0,0 +1,284 @@
+"""
+Pre-aggregated hourly cube of a traffic survey CSV file.
+
+Every row is counted into a cell keyed by (hour, junction, vehicle type,
+direction in, direction out, weather, electric flag, over-limit flag). The
+cube is built once per file, saved next to it as traffic_dataDDMMYYYY.cube.json
+and rebuilt when the CSV file changes. Every outcome of process_csv_data, and
+any ad-hoc filter over the dimensions, is then answered from the cells alone:
+
+    cube = load_cube("traffic_data21062024.csv")
+    cube.count(vehicle_type="Truck", electric=True, direction_out="S",
+               junction="Hanley Highway/Westway", hour=range(7, 9),
+               weather=("Light Rain", "Heavy Rain"))
+
+Cells are kept in the order they first appear in the file, so grouped results
+list hours in the same order as the row by row engine. Speeds are not a
+dimension (a cell per speed would multiply the cells); the speed sketches
+of the file (speed_stats.py) are built in the same pass and saved with the cube.
+"""
+
+import json
+import os
+from collections import Counter
+
+from aggregate import ELM_RABBIT, JunctionTable
+from compressed import codec_of, open_csv
+from speed_stats import SpeedStats
+from validation import DataQuality, ValidatedReader
+
+CUBE_VERSION = 2
+EXTENSION = ".cube.json"
+
+# Dimensions of every cell, in key order
+DIMENSIONS = ("hour", "junction", "vehicle_type", "direction_in", "direction_out",
+              "weather", "electric", "over_limit")
+
+# Vehicle types counted as two-wheeled vehicles and weather counted as rain
+TWO_WHEELED_TYPES = ("Bicycle", "Motorcycle", "Scooter")
+RAIN_CONDITIONS = ("Light Rain", "Heavy Rain")
+
+
+def cube_path(csv_path):
+    """
+    Returns the path of the cube file that belongs to a CSV file.
+    A compressed file shares it with the plain file (traffic_data15062024.csv.gz -> traffic_data15062024.cube.json).
+    """
+
+    if codec_of(csv_path):
+        csv_path, _ = os.path.splitext(csv_path)   # Strip the compression suffix first
+    root, _ = os.path.splitext(csv_path)
+    return root + EXTENSION
+
+
+def row_keys(reader, speeds=None):
+    """
+    Yields the cube key of every row dict (as csv.DictReader or ValidatedReader.dicts() gives them).
+    If speeds (a SpeedStats) is given, the speed of every row is added to it as well.
+    """
+
+    for row in reader:
+        speed = int(row["VehicleSpeed"])
+        limit = int(row["JunctionSpeedLimit"])
+        if speeds is not None:
+            speeds.add(row["JunctionName"], row["timeOfDay"][:2], row["VehicleType"], speed, limit)
+        yield (
+            row["timeOfDay"][:2],
+            row["JunctionName"],
+            row["VehicleType"],
+            row["travel_Direction_in"],
+            row["travel_Direction_out"],
+            row["Weather_Conditions"],
+            row["elctricHybrid"].lower() == "true",
+            speed > limit,
+        )
+
+
+def allowed_values(value):
+    """
+    Turns a filter value into the set of values allowed for one dimension:
+    - A single value (a string, number or bool) must match exactly
+    - Any other collection (list, tuple, set, range) matches any of its items
+    Hours may be given as numbers or as "HH" strings.
+    """
+
+    if isinstance(value, (str, bool, int)):
+        return {value}
+    return set(value)
+
+
+class TrafficCube:
+    def __init__(self, cells, source=None, data_quality=None, speed_stats=None):
+        """
+        Creates a cube from an ordered dict of cell key -> count.
+        source holds the size and modification time of the CSV file it was built from,
+        data_quality the data quality summary of that file and speed_stats its speed sketches (SpeedStats.to_dict).
+        """
+
+        self.cells = cells
+        self.source = source or {}
+        self.data_quality = data_quality or {}
+        self.speed_stats = speed_stats or SpeedStats().to_dict()
+
+    @classmethod
+    def from_csv(cls, csv_path, quality=None):
+        """
+        Builds the cube of a CSV file in one pass over its good rows.
+        Rows that fail validation are left out and recorded in quality (a DataQuality) if given.
+        """
+
+        stat = os.stat(csv_path)
+        quality = quality or DataQuality(csv_path)
+        speeds = SpeedStats()
+        with open_csv(csv_path) as file:
+            cells = Counter(row_keys(ValidatedReader(file, quality).dicts(), speeds))
+        return cls(dict(cells), {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, quality.summary(),
+                   speeds.to_dict())
+
+    def save(self, path):
+        """
+        Saves the cube as a sparse index: one table of labels per dimension and one row of codes per cell.
+        The file is written to a temporary name first and then renamed.
+        """
+
+        labels = [dict() for _ in DIMENSIONS]   # Label -> code, per dimension
+        cells = []
+        for key, count in self.cells.items():
+            codes = [table.setdefault(value, len(table)) for table, value in zip(labels, key)]
+            cells.append(codes + [count])
+        index = {
+            "version": CUBE_VERSION,
+            "source": self.source,
+            "data_quality": self.data_quality,
+            "speed_stats": self.speed_stats,
+            "dimensions": list(DIMENSIONS),
+            "labels": {name: list(table) for name, table in zip(DIMENSIONS, labels)},
+            "cells": cells,
+        }
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(index, file, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a cube saved with save(), or returns None if the file is missing or from another version.
+        """
+
+        try:
+            with open(path, "r") as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if index.get("version") != CUBE_VERSION:
+            return None
+        labels = [index["labels"][name] for name in DIMENSIONS]
+        cells = {
+            tuple(table[code] for table, code in zip(labels, cell[:-1])): cell[-1]
+            for cell in index["cells"]
+        }
+        return cls(cells, index["source"], index.get("data_quality"), index.get("speed_stats"))
+
+    def select(self, **filters):
+        """
+        Yields (key, count) for every cell that passes the filters.
+        Filters are named after DIMENSIONS, for example junction="Elm Avenue/Rabbit Road" or hour=range(7, 9).
+        """
+
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimension(s): {', '.join(sorted(unknown))}")
+
+        tests = []
+        for position, name in enumerate(DIMENSIONS):
+            if name in filters:
+                allowed = allowed_values(filters[name])
+                if name == "hour":
+                    # Compare hours as "HH" strings whether they were given as numbers or strings
+                    allowed = {f"{hour:02d}" if isinstance(hour, int) else hour for hour in allowed}
+                tests.append((position, allowed))
+
+        for key, count in self.cells.items():
+            if all(key[position] in allowed for position, allowed in tests):
+                yield key, count
+
+    def count(self, **filters):
+        """
+        Returns the number of vehicles that pass the filters.
+        """
+
+        return sum(count for _, count in self.select(**filters))
+
+    def group_by(self, dimension, **filters):
+        """
+        Returns the number of vehicles per value of one dimension, for the vehicles that pass the filters.
+        Values are listed in the order they first appear in the file.
+        """
+
+        position = DIMENSIONS.index(dimension)
+        groups = {}
+        for key, count in self.select(**filters):
+            groups[key[position]] = groups.get(key[position], 0) + count
+        return groups
+
+    def no_turn_count(self, **filters):
+        """
+        Returns the number of vehicles that leave in the direction they came from (not turning).
+        """
+
+        return sum(count for key, count in self.select(**filters) if key[3] == key[4])
+
+    def metrics(self):
+        """
+        Returns the raw counts used by build_outcomes, worked out from the cells.
+        """
+
+        rain_hours = self.group_by("hour", weather=RAIN_CONDITIONS)
+        return {
+            "total_vehicles": self.count(),
+            "total_trucks": self.count(vehicle_type="Truck"),
+            "total_electric_vehicles": self.count(electric=True),
+            "two_wheeled_vehicles": self.count(vehicle_type=TWO_WHEELED_TYPES),
+            "busses_leaving_north": self.count(junction=ELM_RABBIT, direction_out="N", vehicle_type="Buss"),
+            "vehicles_no_turns": self.no_turn_count(),
+            "vehicles_over_speed": self.count(over_limit=True),
+            "rain_hours": len(rain_hours),
+            "total_bicycles": self.count(vehicle_type="Bicycle"),
+            **self.junction_table().report_metrics(),
+            "speed_stats": self.speed_stats,
+        }
+
+    def junction_table(self):
+        """
+        Returns the vehicles per hour, scooters and counters of every junction as a JunctionTable.
+        Cells are in order of first appearance, so hours and junctions keep the order of the file.
+        """
+
+        table = JunctionTable()
+        for key, count in self.cells.items():
+            hour, junction, vehicle_type, direction_in, direction_out, _, electric, over_limit = key
+            # Vehicles of the cell that count for each of aggregate.JUNCTION_COUNTERS
+            flags = (vehicle_type == "Truck", electric, vehicle_type in TWO_WHEELED_TYPES,
+                     junction == ELM_RABBIT and direction_out == "N" and vehicle_type == "Buss",
+                     direction_in == direction_out, over_limit, vehicle_type == "Bicycle")
+            table.add(hour, junction, count if vehicle_type == "Scooter" else 0, count,
+                      [count if flag else 0 for flag in flags])
+        return table
+
+    def hourly_data(self):
+        """
+        Returns the per hour counts of every junction used by the histogram (Task D).
+        """
+
+        return self.junction_table().hourly_data()
+
+
+def load_cube(csv_path, quality=None):
+    """
+    Returns the cube of a CSV file, building and saving it the first time
+    and rebuilding it when the CSV file has changed.
+    The data quality of the CSV file is added to quality (a DataQuality) if given.
+    """
+
+    path = cube_path(csv_path)
+    stat = os.stat(csv_path)
+    cube = TrafficCube.load(path)
+    if cube is None or cube.source != {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+        cube = TrafficCube.from_csv(csv_path, quality)
+        try:
+            cube.save(path)
+        except PermissionError:
+            pass   # The cube still answers this query, it just is not kept for next time
+    elif quality is not None:
+        quality.add_summary(cube.data_quality)
+    return cube
+
+
+def compute_cube_metrics(csv_path, quality=None):
+    """
+    Computes the raw counts and hourly histogram data of a CSV file from its cube.
+    """
+
+    cube = load_cube(csv_path, quality)
+    return cube.hourly_data(), cube.metrics()
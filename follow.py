@@ -0,0 +1,203 @@
+"""
+Follow mode for live junction feeds.
+
+Rows appended to a CSV file (or written to stdin through a pipe) are added to
+a TrafficAggregate as they arrive, and a callback receives the counts (with the
+data quality summary) on a fixed interval so refreshed outcomes can be shown
+without re-reading the file.
+
+- The file is read in blocks of at most READ_BLOCK_BYTES, so a large backlog is
+  never held in memory at once; the complete lines of each block are handed on
+  as one batch and checked by ValidatedReader, the same fast path the engines
+  use; updates are only sent between batches, so they never show a read that
+  is half counted
+- Only complete lines are parsed; a partially written trailing line waits for the rest of it
+- When the followed file is rotated (replaced by a new file or truncated, for example at
+  midnight), the old file is read to the end, a final update is sent and counting starts again
+"""
+
+import csv
+import os
+import queue
+import threading
+import time
+
+from aggregate import TrafficAggregate
+from validation import DEFAULT_QUARANTINE_FILE, DataQuality, ValidatedReader, check_fields
+
+# Most lines of a pipe handed on in one batch, and most bytes of a file read at a time
+MAX_BATCH_LINES = 50_000
+READ_BLOCK_BYTES = 1 << 20
+
+
+def tail_file_events(file_path, poll_interval=0.5, stop=None):
+    """
+    Yields events for a growing file until stop is set:
+    - ("lines", [text, ...]) with the complete lines of each block read (at most READ_BLOCK_BYTES)
+    - ("rotated", None) when the file was replaced or truncated
+    - ("idle", None) when there is nothing new to read
+    """
+
+    stop = stop or threading.Event()
+    file = None
+    pending = b""   # Bytes of a line that is still being written
+    while not stop.is_set():
+        # Wait for the file to exist (a new day's file may not be created yet)
+        if file is None:
+            try:
+                file = open(file_path, "rb")
+            except FileNotFoundError:
+                yield "idle", None
+                stop.wait(poll_interval)
+                continue
+
+        # Read the next block of what was appended since the last read
+        data = file.read(READ_BLOCK_BYTES)
+        if data:
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            if lines:
+                yield "lines", [line.decode().rstrip("\r") for line in lines]
+            continue
+
+        # Nothing new: check whether the file was rotated
+        if file_rotated(file, file_path):
+            # Anything left without a newline is the last line of the old file
+            if pending.strip():
+                yield "lines", [pending.decode().rstrip("\r")]
+            pending = b""
+            file.close()
+            file = None
+            yield "rotated", None
+            continue
+
+        yield "idle", None
+        stop.wait(poll_interval)
+
+    if file is not None:
+        file.close()
+
+
+def file_rotated(file, file_path):
+    """
+    Checks whether the path now points to a different file, or the open file was truncated.
+    """
+
+    try:
+        path_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return True
+    open_stat = os.fstat(file.fileno())
+    if (path_stat.st_dev, path_stat.st_ino) != (open_stat.st_dev, open_stat.st_ino):
+        return True
+    return path_stat.st_size < file.tell()
+
+
+def stream_events(stream, poll_interval=0.5):
+    """
+    Yields the same events as tail_file_events for a text stream such as stdin.
+    A background thread reads the stream so updates are still sent while the pipe is quiet;
+    the lines waiting when a batch is taken (at most MAX_BATCH_LINES) go into one "lines" event.
+    The events end when the stream reaches end of file.
+    """
+
+    lines = queue.Queue()
+
+    def read_lines():
+        for line in stream:
+            lines.put(line)
+        lines.put(None)   # End of file
+
+    threading.Thread(target=read_lines, daemon=True).start()
+    while True:
+        try:
+            batch = [lines.get(timeout=poll_interval)]
+        except queue.Empty:
+            yield "idle", None
+            continue
+        # Take every other line that is already waiting
+        while batch[-1] is not None and len(batch) < MAX_BATCH_LINES:
+            try:
+                batch.append(lines.get_nowait())
+            except queue.Empty:
+                break
+        ended = batch[-1] is None
+        if ended:
+            batch.pop()
+        if batch:
+            yield "lines", [line.rstrip("\r\n") for line in batch]
+        if ended:
+            return
+
+
+def follow_events(events, on_update, interval=10.0, source="", quarantine_file=DEFAULT_QUARANTINE_FILE):
+    """
+    Counts the rows from a stream of events and calls on_update(metrics, final) with the counts
+    (TrafficAggregate.metrics() with the "data_quality" summary of the rows so far):
+    - Every interval seconds while rows keep coming (final is False), after a whole batch of lines is counted
+    - When the file is rotated and when the events end (final is True)
+    The first line after the start and after every rotation is the CSV header.
+    Rows that fail validation are not counted; they are written to quarantine_file
+    (named after source) at every rotation and at the end.
+    Returns the number of rows that could not be read (wrong number of fields, bad numbers, ...).
+    """
+
+    aggregate = TrafficAggregate()
+    quality = DataQuality(source)            # Bad rows of the current file
+    fields = None                            # Column names from the header line
+    line_number = 0                          # Physical lines read from the current file (blank lines included)
+    skipped_rows = 0                         # Rows that could not be read
+    last_update = time.monotonic()
+    changed = False                          # Rows were added since the last update
+
+    try:
+        for kind, lines in events:
+            if kind == "lines":
+                # The header is the first line that is not blank
+                while fields is None and lines:
+                    line, lines = lines[0], lines[1:]
+                    line_number += 1
+                    if line:
+                        fields = next(csv.reader([line]))
+                        check_fields(fields)
+                if lines:
+                    # The batch is checked on its own and its bad rows moved to their line in the file
+                    batch_quality = DataQuality(source)
+                    reader = ValidatedReader(lines, batch_quality, fields)
+                    for row in reader.dicts():
+                        aggregate.add_row(row)
+                    quality.merge(batch_quality, line_number)
+                    line_number += len(lines)
+                    changed = True
+            elif kind == "rotated":
+                # Send the final counts of the old file and start again for the new one
+                on_update(current_metrics(aggregate, quality), True)
+                skipped_rows += quality.bad_rows
+                quality.save_quarantine(quarantine_file)
+                aggregate = TrafficAggregate()
+                quality = DataQuality(source)
+                fields = None
+                line_number = 0
+                changed = False
+
+            # Send refreshed counts on the interval
+            if changed and time.monotonic() - last_update >= interval:
+                on_update(current_metrics(aggregate, quality), False)
+                last_update = time.monotonic()
+                changed = False
+    except KeyboardInterrupt:
+        pass   # Stopping with Ctrl+C still sends the final counts
+
+    on_update(current_metrics(aggregate, quality), True)
+    quality.save_quarantine(quarantine_file)
+    return skipped_rows + quality.bad_rows
+
+
+def current_metrics(aggregate, quality):
+    """
+    Returns the counts so far with the data quality summary, as the engines return them.
+    """
+
+    metrics = aggregate.metrics()
+    metrics["data_quality"] = quality.summary()
+    return metrics
@@ -0,0 +1,254 @@
+"""
+Headless histogram rendering.
+
+Draws the same hourly bar chart as HistogramApp (title, axis, one bar per
+junction for every hour, value labels, hour labels and legend) straight from hourly_data, without
+a Tk window, and saves it as SVG (always available) or PNG (needs Pillow).
+HistogramExporter writes the files on a background thread so data processing
+never waits for rendering; a file that cannot be saved is reported as soon as
+it fails, and the other days go on.
+"""
+
+import os
+import sys
+
+from aggregate import ELM_RABBIT, HANLEY_WESTWAY
+
+# Chart layout, the same as HistogramApp
+CANVAS_WIDTH = 1100
+CANVAS_HEIGHT = 680
+BAR_WIDTH = 15
+BAR_SPACING = 10
+X_START = 50
+LEGEND_X = 70
+LEGEND_Y = 30
+
+# Bar colours of the two surveyed junctions, any other junction takes the next PALETTE colour
+JUNCTION_COLOURS = {ELM_RABBIT: "green", HANLEY_WESTWAY: "red"}
+PALETTE = ("#1f77b4", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf")
+
+# Narrower bars than this get no value label, and the legend lists at most LEGEND_ROWS junctions
+MIN_LABELLED_BAR_WIDTH = 10
+LEGEND_ROWS = 10
+
+FORMATS = ("svg", "png")
+
+
+def junction_colours(hourly_data):
+    """
+    Returns (junction, colour) for every junction in the histogram data:
+    the two surveyed junctions first, then the others in order of first appearance.
+    """
+
+    junctions = list(dict.fromkeys(junction for values in hourly_data.values() for junction in values))
+    known = [junction for junction in JUNCTION_COLOURS if junction in junctions]
+    others = [junction for junction in junctions if junction not in JUNCTION_COLOURS]
+    return ([(junction, JUNCTION_COLOURS[junction]) for junction in known]
+            + [(junction, PALETTE[i % len(PALETTE)]) for i, junction in enumerate(others)])
+
+
+def bar_width(hour_count, junction_count):
+    """
+    Returns the width of one bar, narrowed when needed so every hour's group of bars fits across the canvas.
+    """
+
+    if not hour_count or not junction_count:
+        return BAR_WIDTH
+    return min(BAR_WIDTH, ((CANVAS_WIDTH - 2 * X_START) / hour_count - BAR_SPACING) / junction_count)
+
+
+def chart_shapes(hourly_data, date):
+    """
+    Works out every shape of the chart as plain tuples, so each output format only has to draw them:
+    - ("rect", x1, y1, x2, y2, fill)
+    - ("line", x1, y1, x2, y2, colour, width)
+    - ("text", x, y, text, size, bold, colour, anchor) where anchor is "middle" or "start"
+    """
+
+    shapes = []
+    y_base = CANVAS_HEIGHT - 50   # Base y-coordinate for the X-axis
+
+    # Title at the top
+    shapes.append(("text", CANVAS_WIDTH / 2, 20, f"Histogram of Vehicle Frequency per Hour ({date})",
+                   18, True, "black", "middle"))
+
+    # X-axis and its title
+    shapes.append(("line", X_START, y_base, CANVAS_WIDTH - 50, y_base, "black", 2))
+    shapes.append(("text", (CANVAS_WIDTH - 50 + X_START) / 2, y_base + 40, "Hours 00:00 to 24:00",
+                   12, True, "black", "middle"))
+
+    # Scale the bars to fit the canvas height
+    colours = junction_colours(hourly_data)
+    max_value = max((max(values.values(), default=0) for values in hourly_data.values()), default=0)
+    y_scale = (y_base - 50) / (max_value or 1)
+    width = bar_width(len(hourly_data), len(colours))
+
+    # One bar per junction for each hour with its count, and the hour label underneath
+    for i, hour in enumerate(sorted(hourly_data)):
+        x1 = X_START + i * (width * len(colours) + BAR_SPACING)
+        for offset, (junction, colour) in enumerate(colours):
+            value = hourly_data[hour].get(junction, 0)
+            x = x1 + offset * width
+            y = y_base - value * y_scale
+            shapes.append(("rect", x, y, x + width, y_base, colour))
+            if width >= MIN_LABELLED_BAR_WIDTH:
+                shapes.append(("text", x + width / 2, y - 10, str(value), 8, False, colour, "middle"))
+        shapes.append(("text", x1 + width * len(colours) / 2, y_base + 20, hour, 10, False, "black", "middle"))
+
+    # Legend in the top left corner
+    for row, (junction, colour) in enumerate(colours[:LEGEND_ROWS]):
+        y = LEGEND_Y + row * 30
+        shapes.append(("rect", LEGEND_X, y, LEGEND_X + 20, y + 20, colour))
+        shapes.append(("text", LEGEND_X + 30, y + 10, junction, 10, False, "black", "start"))
+    if len(colours) > LEGEND_ROWS:
+        shapes.append(("text", LEGEND_X + 30, LEGEND_Y + LEGEND_ROWS * 30 + 10,
+                       f"and {len(colours) - LEGEND_ROWS} more junctions", 10, False, "black", "start"))
+    return shapes
+
+
+def render_svg(hourly_data, date):
+    """
+    Returns the histogram as an SVG document.
+    """
+
+    from xml.sax.saxutils import escape   # Imported here, it pulls in urllib and slows down every start of main.py
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{CANVAS_WIDTH}" height="{CANVAS_HEIGHT}" '
+             f'viewBox="0 0 {CANVAS_WIDTH} {CANVAS_HEIGHT}" font-family="Helvetica, Arial, sans-serif">',
+             f'<rect width="{CANVAS_WIDTH}" height="{CANVAS_HEIGHT}" fill="white"/>']
+    for shape in chart_shapes(hourly_data, date):
+        if shape[0] == "rect":
+            _, x1, y1, x2, y2, fill = shape
+            parts.append(f'<rect x="{x1:g}" y="{y1:g}" width="{x2 - x1:g}" height="{y2 - y1:g}" '
+                         f'fill="{fill}" stroke="black"/>')
+        elif shape[0] == "line":
+            _, x1, y1, x2, y2, colour, width = shape
+            parts.append(f'<line x1="{x1:g}" y1="{y1:g}" x2="{x2:g}" y2="{y2:g}" stroke="{colour}" '
+                         f'stroke-width="{width}"/>')
+        else:
+            _, x, y, text, size, bold, colour, anchor = shape
+            weight = ' font-weight="bold"' if bold else ""
+            parts.append(f'<text x="{x:g}" y="{y:g}" font-size="{size}"{weight} fill="{colour}" '
+                         f'text-anchor="{anchor}" dominant-baseline="middle">{escape(text)}</text>')
+    parts.append("</svg>")
+    return "\n".join(parts) + "\n"
+
+
+def check_format(image_format):
+    """
+    Raises ValueError for an unknown image format, and ImportError for PNG when Pillow is not installed,
+    so a run can stop before any data is processed.
+    """
+
+    from importlib.util import find_spec
+
+    if image_format not in FORMATS:
+        raise ValueError(f"Unknown image format '{image_format}'. Choose one of: {', '.join(FORMATS)}")
+    if image_format == "png" and find_spec("PIL") is None:
+        raise ImportError("PNG export needs Pillow (pip install pillow); use the svg format instead")
+
+
+def render_png(hourly_data, date, file_path):
+    """
+    Saves the histogram as a PNG file. Needs Pillow.
+    """
+
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        raise ImportError("PNG export needs Pillow (pip install pillow); use the svg format instead") from None
+
+    image = Image.new("RGB", (CANVAS_WIDTH, CANVAS_HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    for shape in chart_shapes(hourly_data, date):
+        if shape[0] == "rect":
+            _, x1, y1, x2, y2, fill = shape
+            draw.rectangle((x1, y1, x2, y2), fill=fill, outline="black")
+        elif shape[0] == "line":
+            _, x1, y1, x2, y2, colour, width = shape
+            draw.line((x1, y1, x2, y2), fill=colour, width=width)
+        else:
+            _, x, y, text, size, bold, colour, anchor = shape
+            try:
+                font = ImageFont.load_default(size=size)
+            except TypeError:   # Older Pillow versions have a single default size
+                font = ImageFont.load_default()
+            draw.text((x, y), text, fill=colour, font=font, anchor="mm" if anchor == "middle" else "lm")
+    image.save(file_path, "PNG")
+
+
+def export_histogram(hourly_data, date, output_dir, image_format="svg"):
+    """
+    Renders the histogram of one day and saves it as histogram_<date>.<format> in output_dir.
+    Returns the path of the saved file.
+    """
+
+    if image_format not in FORMATS:
+        raise ValueError(f"Unknown image format '{image_format}'. Choose one of: {', '.join(FORMATS)}")
+    os.makedirs(output_dir, exist_ok=True)
+    file_path = os.path.join(output_dir, f"histogram_{date}.{image_format}")
+    if image_format == "svg":
+        with open(file_path, "w") as file:
+            file.write(render_svg(hourly_data, date))
+    else:
+        render_png(hourly_data, date, file_path)
+    return file_path
+
+
+def report_failure(date, error):
+    """
+    Default report of a histogram that could not be saved: one line on standard error.
+    """
+
+    print(f"Could not save the histogram of {date}: {error}", file=sys.stderr)
+
+
+class HistogramExporter:
+    def __init__(self, output_dir, image_format="svg", workers=1, on_error=report_failure):
+        """
+        Saves histograms on background threads:
+        - output_dir is the folder for the image files
+        - image_format is "svg" or "png" (checked with check_format)
+        - on_error(date, error) is called as soon as the histogram of a day fails to save
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        check_format(image_format)
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.on_error = on_error
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="histogram")
+        self.futures = []
+        self.failures = 0            # Histograms that could not be saved
+
+    def submit(self, hourly_data, date):
+        """
+        Queues the histogram of one day and returns straight away with a future for the file path.
+        """
+
+        future = self.executor.submit(export_histogram, hourly_data, date, self.output_dir, self.image_format)
+        future.add_done_callback(lambda done: self.check(done, date))
+        self.futures.append(future)
+        return future
+
+    def check(self, future, date):
+        """
+        Reports the error of a finished histogram, if it failed.
+        """
+
+        error = future.exception()
+        if error is not None:
+            self.failures += 1
+            self.on_error(date, error)
+
+    def close(self):
+        """
+        Waits for every queued histogram and returns the paths of the saved files
+        (the ones that failed were already reported and are counted in failures).
+        """
+
+        self.executor.shutdown(wait=True)
+        paths = [future.result() for future in self.futures if future.exception() is None]
+        self.futures = []
+        return paths
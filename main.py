@@ -1,9 +1,19 @@
 #Author: E. A. Dulan Nimnaka
 #Date: 11/12/2024
 
-import csv
-from datetime import datetime
-import tkinter as tk
+import os
+import sys
+import time
+from itertools import islice
+
+# Only the modules every run needs are imported here, and they import their own
+# heavier dependencies (hashlib, json, csv, the codecs) when first used; the rest
+# (argparse, the metric registry, the results sinks, the histogram layout) are
+# imported by the functions that use them, so the program starts quickly
+import profiling
+from cache import DEFAULT_CACHE_DIR, AggregateCache, add_stats, stats_line, user_cache_dir
+from compressed import find_csv_file, open_csv
+from validation import DEFAULT_QUARANTINE_FILE, DataQuality, ValidatedReader, quality_lines
 
 # Task A: Input Validation
 
@@ -48,12 +58,15 @@ def validate_date_input():
                     print("Integer required! Please enter valid numbers.")            #if input is not an integer
                     
             # Validate the full date
+            from datetime import datetime
             try:
                 date = datetime(year, month, day)  #validate if the full date exists
                 return f"{day:02d}-{month:02d}-{year}"  #format the date and return
             except ValueError:
                 print(f"Invalid date {day:02d}-{month:02d}-{year}. Please try again.")     #if date is invalid
 
+        except EOFError:
+            raise   #no more input (stdin closed), let the caller stop
         except Exception as e:
             print(f"Unexpected error: {e}. Please try again.")     #unexpected errors
 
@@ -71,164 +84,257 @@ def validate_continue_input():
         else:   
             print("INVALID input. Please enter 'Y' or 'N'.")     #invalid input
 
-def define_file_path(date):
+def define_file_path(date, folder=""):
     
-    #create a file path based on the validated date.
+    #create a file path based on the validated date (in folder, or the current folder).
     day, month, year = date.split("-")                #Split the date string into day, month, and year
-    return f"traffic_data{day}{month}{year}.csv"      #Return the file path string in day, month, year format
+    return find_csv_file(os.path.join(folder, f"traffic_data{day}{month}{year}.csv"))   #Return the file path (or its compressed copy) in day, month, year format
 
 # Task B: Process CSV Data
 
-def process_csv_data(file_path):
+# Names of the engines that can be used to process a CSV file
+# "auto" (the default) reads the binary columnar copy of the file, see choose_engine
+# "rows" is the original row by row loop and stays the reference implementation
+# "columnar" loads the columns into typed arrays and uses batched reductions (needs NumPy)
+# "chunked" splits one large file into byte ranges processed on worker processes
+# "binary" reads a memory-mapped binary columnar copy of the file, built when missing or stale (needs NumPy)
+# "cube" answers from a pre-aggregated hourly cube of the file, built when missing or stale
+# "fused" runs the metric registry as one generated loop over the rows
+ENGINES = ("auto", "rows", "columnar", "chunked", "binary", "cube", "fused")
+DEFAULT_ENGINE = "auto"
+
+# Files at least this large are converted to the binary columnar format by the "auto" engine;
+# a smaller file is read row by row quicker than NumPy is loaded
+AUTO_BINARY_MIN_BYTES = 1 << 20
+
+
+def choose_engine(file_path, engine):
+    """
+    Returns the engine that processes a file. "auto" becomes:
+    - "binary" if the file has an up-to-date binary columnar copy (.tcol), or is at least
+      AUTO_BINARY_MIN_BYTES, so the copy is built now and read on the next runs
+    - "rows" otherwise, and whenever NumPy is not installed
+    Any other engine is returned as it is.
+    """
+    
+    if engine != "auto":
+        return engine
+    from importlib.util import find_spec
+    if find_spec("numpy") is None:
+        return "rows"
+    from binary_columns import binary_path, is_stale, read_header
+    if os.path.getsize(file_path) >= AUTO_BINARY_MIN_BYTES:
+        return "binary"
+    return "rows" if is_stale(file_path, read_header(binary_path(file_path))) else "binary"
+
+
+def process_csv_data(file_path, engine=DEFAULT_ENGINE, cache=None, metric_names=None, store=None,
+                     sampling=None, quarantine_file=DEFAULT_QUARANTINE_FILE):
     """
     Processes the CSV data for the selected date and extracts:
     - Total vehicles
     - Total trucks
     - Total electric vehicles
     - Two-wheeled vehicles, and other requested metrics
+    The engine argument selects how the file is processed ("auto", "rows", "columnar", "chunked", "binary", "cube"
+    or "fused"); "auto" reads the binary columnar copy of the file when it has one, see choose_engine.
+    If an AggregateCache is given, a file that was already processed is not read again.
+    If metric_names is given, only those metrics from the metric registry are computed and shown.
+    If a SummaryStore is given, the counts of the day are stored in it (not when metric_names is given).
+    If an approximate.SamplingPlan is given, a large file is estimated from a sample of its rows instead,
+    with a confidence interval for every outcome (not cached or stored; small and compressed files stay exact).
+    Rows that fail validation are written to quarantine_file.
+    """
+    
+    hourly_data, outcomes, _ = process_csv_results(file_path, engine, cache, metric_names, store, sampling,
+                                                   quarantine_file)
+    return hourly_data, outcomes
+
+
+def process_csv_results(file_path, engine=DEFAULT_ENGINE, cache=None, metric_names=None, store=None,
+                        sampling=None, quarantine_file=DEFAULT_QUARANTINE_FILE):
+    """
+    Same as process_csv_data, but also returns the values behind the outcome lines
+    (the raw counts, or the metric values when metric_names is given) for the structured results formats.
     """
     
+    # A chosen set of metrics runs as one fused loop that skips every other metric
+    # (the vehicles are always counted too, so batch runs can report the rows they read)
+    if metric_names is not None:
+        from metric_registry import get_evaluator, outcome_lines
+        evaluator = get_evaluator(tuple(dict.fromkeys([*metric_names, "total_vehicles"])))
+        quality = DataQuality(file_path)
+        with profiling.stage("selected metrics"), open_csv(file_path) as file:
+            values = evaluator.run(ValidatedReader(file, quality).dicts())
+        record_quality(quality, values, quarantine_file)
+        outcomes = outcome_lines(file_path, values, metric_names) + quality_outcomes(values)
+        return values.get("hourly_data", {}), outcomes, values
+
+    # A sampling plan estimates a large file from a sample of its rows
+    if sampling is not None:
+        from approximate import sample_results
+        with profiling.stage("sampling"):
+            results = sample_results(file_path, sampling)
+        if results is not None:
+            return results
+
+    # Take the counts from the cache if the file was already processed
+    cached = None
+    if cache is not None:
+        with profiling.stage("cache lookup"):
+            cached = cache.get(file_path)
+
+    # Otherwise count everything in the file (and sample what each metric costs when profiling)
+    if cached is not None:
+        hourly_data, metrics = cached
+    else:
+        hourly_data, metrics = compute_csv_metrics(file_path, engine, quarantine_file)
+        profiling.record_metric_costs(file_path)
+        if cache is not None:
+            with profiling.stage("cache store"):
+                cache.put(file_path, hourly_data, metrics)
+
+    # Keep the counts of the day in the summary store for multi-day queries
+    if store is not None:
+        with profiling.stage("summary store"):
+            store.record_day(file_date_label(file_path), file_path, metrics)
+
+    # Turn the counts into outcome lines
+    with profiling.stage("outcome lines"):
+        outcomes = build_outcomes(file_path, metrics)
+    return hourly_data, outcomes, metrics
+
+
+def compute_csv_metrics(file_path, engine=DEFAULT_ENGINE, quarantine_file=DEFAULT_QUARANTINE_FILE):
+    """
+    Reads a CSV file and returns the histogram data and a dict of raw counts
+    (the numbers behind the outcome lines, before percentages and peak hours are worked out).
+    Rows that fail validation are left out and written to quarantine_file;
+    the counts include a "data_quality" summary.
+    """
+    
+    # Check that the requested engine exists, and pick one for "auto"
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'. Choose one of: {', '.join(ENGINES)}")
+    engine = choose_engine(file_path, engine)
+
+    # Bad rows and unknown values of the file are collected here
+    quality = DataQuality(file_path)
+
+    # Engines other than the row loop are timed as one stage when profiling is on
+    if engine != "rows":
+        with profiling.stage(f"{engine} engine"):
+            hourly_data, metrics = compute_engine_metrics(file_path, engine, quality)
+        profiling.add_rows(f"{engine} engine", metrics["total_vehicles"])
+        record_quality(quality, metrics, quarantine_file)
+        return hourly_data, metrics
+
+    from aggregate import TrafficAggregate
+
     try:
-        # Initialize variables for metrics
-        total_vehicles = 0            # Total vehicles for the date
-        total_trucks = 0              # Total trucks
-        total_electric_vehicles = 0   # Electric vehicles
-        two_wheeled_vehicles = 0      # Two-wheeled vehicles (bikes, scooters, motorcycles)
-        busses_leaving_north = 0      # Buses leaving Elm Avenue heading North
-        vehicles_no_turns = 0         # Vehicles going straight
-        vehicles_over_speed = 0       # Vehicles exceeding speed limit
-        vehicles_elm_rabbit = 0       # Vehicles recorded at Elm Avenue/Rabbit Road
-        scooters_count = 0            # Scooters at Elm Avenue/Rabbit Road
-        vehicles_hanley_westway = 0   # Vehicles at Hanley Highway/Westway
-        max_vehicles_hour = 0         # Peak traffic count in an hour
-        max_vehicles_time = ""        # Store the time or times of the peak traffic hour
-        rain_hours = 0                # Count of rain hours
-        rain_hours_set = set()        # To count unique rain hours.
-        hourly_counts = {}            # To count vehicles per hour.
-        total_bicycles = 0            # Total bicycles recorded
-        hourly_data = {}              # Store traffic data per hour for each junction | Data for histogram (Task D)
+        # Every counter lives in a TrafficAggregate so partial results can be merged
+        aggregate = TrafficAggregate()
 
         # Open the CSV file for reading data
-        with open(file_path, "r") as file:
-            reader = csv.DictReader(file)        # Reads the CSV file as a dictionary.
-            
-            # Loop through each row in the file.
-            for row in reader:
-                #The total number of vehicles passing through all junctions for the selected date.
-                total_vehicles += 1           # Increment total vehicle count.
-
-                #The total number of trucks passing through all junctions for the selected date.
-                if row["VehicleType"] == "Truck":
-                    total_trucks += 1
-
-                #The total number of electric vehicles passing through all junctions for the selected date.
-                if row["elctricHybrid"].lower() == "true":
-                    total_electric_vehicles += 1
-
-                #The number of “two wheeled” vehicles through all junctions for the date (bikes, motorbike, scooters).
-                if row["VehicleType"] in ["Bicycle", "Motorcycle", "Scooter"]:
-                    two_wheeled_vehicles += 1
-
-                #The total number of busses leaving Elm Avenue/Rabbit Road junction heading north
-                if (
-                    row["JunctionName"] == "Elm Avenue/Rabbit Road"
-                    and row["travel_Direction_out"] == "N"
-                    and row["VehicleType"] == "Buss"
-                ):
-                    busses_leaving_north += 1
-
-                #The total number of vehicles passing through both junctions without turning left or right.
-                if row["travel_Direction_in"] == row["travel_Direction_out"]:
-                    vehicles_no_turns += 1
-
-                #The total number of vehicles recorded as over the speed limit for the selected date.
-                if int(row["VehicleSpeed"]) > int(row["JunctionSpeedLimit"]):
-                    vehicles_over_speed += 1
-
-                #The total number of vehicles recorded through only Elm Avenue/Rabbit Road junction for the selected date.
-                if row["JunctionName"] == "Elm Avenue/Rabbit Road":
-                    vehicles_elm_rabbit += 1
-                    #Count only scooters at Elm Avenue/Rabbit Road
-                    if row["VehicleType"] == "Scooter":
-                        scooters_count += 1
-
-                #The total number of vehicles recorded through only Hanley Highway/Westway junction for the selected date.
-                if row["JunctionName"] == "Hanley Highway/Westway":
-                    vehicles_hanley_westway += 1
-                    hour = row["timeOfDay"][:2]        # Extract the hour.
-                    hourly_counts[hour] = hourly_counts.get(hour, 0) + 1 # Count vehicles per hour
-
-                #Count rain hours (Light Rain or Heavy Rain)
-                if row["Weather_Conditions"] in ["Light Rain", "Heavy Rain"]:
-                    hour = row["timeOfDay"][:2]  #Extract the hour part
-                    rain_hours_set.add(hour)     #Add hour to the rain hours set
-                    
-                # Count bicycles and calculate average bicycles per hour
-                if row["VehicleType"] == "Bicycle":
-                    total_bicycles += 1
-                    
-                # Store data for creating histograms (Task D)
-                hour = row["timeOfDay"][:2]  # Extract hour (HH)
-                junction = row["JunctionName"]
-                vehicle_count = 1  # Each row represents one vehicle passing
-                
-                # Initialize hourly data for this hour if not already done
-                if hour not in hourly_data:
-                    hourly_data[hour] = {"Elm Avenue/Rabbit Road": 0, "Hanley Highway/Westway": 0}
-                
-                # Increment counts for each junction based on the row's junction name
-                if junction == "Elm Avenue/Rabbit Road":
-                    hourly_data[hour]["Elm Avenue/Rabbit Road"] += vehicle_count
-                elif junction == "Hanley Highway/Westway":
-                    hourly_data[hour]["Hanley Highway/Westway"] += vehicle_count
+        with open_csv(file_path) as file:
+            if profiling.ACTIVE is not None:
+                # With profiling on, the file is still streamed but the rows are parsed in batches,
+                # so reading the file, parsing the rows and the metric checks are timed separately
+                reader = ValidatedReader(profiling.timed_lines(file), quality).dicts()
+                while True:
+                    with profiling.stage("parse rows"):
+                        batch = list(islice(reader, profiling.BATCH_ROWS))
+                    if not batch:
+                        break
+                    with profiling.stage("metric checks"):
+                        for row in batch:
+                            aggregate.add_row(row)
+                    profiling.add_rows("parse rows", len(batch))
+                    profiling.add_rows("metric checks", len(batch))
+            else:
+                reader = ValidatedReader(file, quality).dicts()   # Reads the good rows of the CSV file as dictionaries.
                 
+                # Loop through each row in the file.
+                for row in reader:
+                    aggregate.add_row(row)
 
-            #The number of vehicles recorded in the peak (busiest) hour on Hanley Highway/Westway.
-            if hourly_counts:
-                max_vehicles_hour = max(hourly_counts.values())       #Find the peak number of vehicles in any hour
-                
-                #The time or times of the peak (busiest) traﬃc hour (or hours) on Hanley Highway/Westway 
-                max_vehicles_time = ", ".join(
-                    [f"Between {hour}:00 and {int(hour)+1}:00" for hour, count in hourly_counts.items() if count == max_vehicles_hour]
-                )
-
-        # Calculate the percentage
-        # The percentage of all vehicles recorded that are Trucks for the selected date (rounded to an integer).
-        trucks_percentage = round((total_trucks / total_vehicles) * 100) if total_vehicles else 0
-        # The percentage of vehicles through Elm Avenue/Rabbit Road that are Scooters (rounded to integer)
-        scooters_percentage = round((scooters_count / vehicles_elm_rabbit) * 100) if vehicles_elm_rabbit else 0
-        
-        # Calculate the average number of bicycles per hour
-        average_bicycles_per_hour = round(total_bicycles/24)
-        
-        # Calculate the number of rain hours
-        rain_hours = len(rain_hours_set)
-
-        #Return all calculated metrics in a list
-        return hourly_data, [
-            f"\nData file selected is {file_path}",
-            f"The total number of vehicles recorded for this date is {total_vehicles}",
-            f"The total number of trucks recorded for this date is {total_trucks}",
-            f"The total number of electric vehicles for this date is {total_electric_vehicles}",
-            f"The total number of two-wheeled vehicles for this date is {two_wheeled_vehicles}",
-            f"The total number of buses leaving Elm Avenue/Rabbit Road heading North is {busses_leaving_north}",
-            f"The total number of vehicles through both junctions not turning left or right is {vehicles_no_turns}",
-            f"The percentage of total vehicles recorded that are trucks for this date is {trucks_percentage}%",
-            f"The average number of bicycles per hour for this date is {average_bicycles_per_hour}",
-            f"The total number of vehicles recorded as over the speed limit for this date is {vehicles_over_speed}",
-            f"The total number of vehicles recorded through Elm Avenue/Rabbit Road junction is {vehicles_elm_rabbit}",
-            f"The total number of vehicles recorded through Hanley Highway/Westway junction is {vehicles_hanley_westway}",
-            f"{scooters_percentage}% of vehicles recorded through Elm Avenue/Rabbit Road are scooters.",
-            f"The highest number of vehicles in an hour on Hanley Highway/Westway is {max_vehicles_hour}",
-            f"The most vehicles through Hanley Highway/Westway were recorded between {max_vehicles_time}",
-            f"The number of hours of rain for this date is {rain_hours}\n"
-            ]
-        return hourly_data, outcomes  # Ensure outcomes are returned when successful
+        #Return the histogram data and the raw counts
+        metrics = aggregate.metrics()
+        record_quality(quality, metrics, quarantine_file)
+        return aggregate.hourly_data, metrics
     
     except FileNotFoundError:
         raise FileNotFoundError  # Raise the error if the file isn't found
 
 
+def compute_engine_metrics(file_path, engine, quality):
+    """
+    Runs one of the engines other than the row loop and returns the histogram data and raw counts.
+    Bad rows and unknown values are recorded in quality (a DataQuality).
+    """
+    
+    # The columnar engine lives in its own module so NumPy is only needed when it is used
+    if engine == "columnar":
+        from columnar import compute_columnar_metrics
+        return compute_columnar_metrics(file_path, quality)
+
+    # The chunked engine merges partial aggregates from worker processes
+    if engine == "chunked":
+        from chunked import compute_chunked_metrics
+        return compute_chunked_metrics(file_path, quality=quality)
+
+    # The binary engine converts the CSV file once and then reads the binary file
+    if engine == "binary":
+        from binary_columns import compute_binary_metrics
+        return compute_binary_metrics(file_path, quality)
+
+    # The cube engine works out every outcome from the saved cube cells
+    if engine == "cube":
+        from cube import compute_cube_metrics
+        return compute_cube_metrics(file_path, quality)
+
+    # The fused engine runs every registered metric in one generated loop
+    if engine == "fused":
+        from metric_registry import get_evaluator
+        with open_csv(file_path) as file:
+            metrics = get_evaluator().run(ValidatedReader(file, quality).dicts())
+        return metrics.pop("hourly_data"), metrics
+
+
+def record_quality(quality, metrics, quarantine_file=DEFAULT_QUARANTINE_FILE):
+    """
+    Writes the quarantined rows of a file to quarantine_file and adds its data quality summary to the counts.
+    """
+    
+    quality.save_quarantine(quarantine_file)
+    metrics["data_quality"] = quality.summary()
+
+
+def quality_outcomes(metrics):
+    """
+    Returns the data quality lines shown after the outcomes, or no lines if every row of the file was good.
+    """
+    
+    lines = quality_lines(metrics.get("data_quality", {}))
+    if lines:
+        lines[-1] += "\n"
+    return lines
+
+
+def build_outcomes(file_path, metrics):
+    """
+    Builds the list of outcome lines from the raw counts of a processed file:
+    - Works out the peak hour (or hours) on Hanley Highway/Westway and at every junction
+    - Calculates the percentages and averages
+    - Formats every outcome as a line of text
+    The percentages, averages and line templates come from the metric registry.
+    A data quality summary follows when rows of the file were quarantined or had unknown values.
+    """
+    
+    from metric_registry import outcome_lines
+    return outcome_lines(file_path, metrics) + quality_outcomes(metrics)
+
+
 def display_outcomes(outcomes):
     """
     Displays the calculated outcomes in a clear and formatted way.
@@ -244,13 +350,12 @@ def display_outcomes(outcomes):
 def save_results_to_file(outcomes, file_name="results.txt"):
     """
     Saves the processed outcomes to a text file and appends if the program loops.
+    The lines and the separator after them are written as one block, so they never mix with other writers.
     """
     
-    #Open the file in append mode
-    with open(file_name, 'a') as file:
-        for line in outcomes:                    #Loop through each line
-            file.write(f"{line}\n")              #Write each outcome to the text file followed by a newline
-        file.write("\n***************************\n")       #Add a separator after writing all outcomes
+    #Each outcome on its own line followed by the separator, appended to the file in one write
+    from results_sink import append_atomically, text_block
+    append_atomically(file_name, text_block(outcomes))
 
 # Task D: Histogram Display (using tkinter Canvas)
 
@@ -260,7 +365,10 @@ class HistogramApp:
         Initializes the histogram application with the traffic data and selected date.
         """
         
-        # traffic_data, A list of how many vehicles passed each hour for two roads
+        # Tkinter is only imported when a window is opened, so headless runs start faster
+        import tkinter as tk
+        
+        # traffic_data, A list of how many vehicles passed each hour for every junction
         self.traffic_data = traffic_data
         # date, The date we’re making the graph for
         self.date = date
@@ -301,10 +409,13 @@ class HistogramApp:
         Draws the histogram with axes, labels, and bars.
         """
         
+        from histogram_export import MIN_LABELLED_BAR_WIDTH, bar_width, junction_colours
+
         # Find the maximum vehicle count across all hours and junction locations
         # The bars are proportionally scaled to fit within the canvas height, which is ensured by this.
-        max_value = max(max(values["Elm Avenue/Rabbit Road"], values["Hanley Highway/Westway"]) for values in self.traffic_data.values())
-        bar_width = 15                       # Width of each bar
+        max_value = max(max(values.values(), default=0) for values in self.traffic_data.values()) or 1
+        colours = junction_colours(self.traffic_data)  # (junction, colour) of every junction, one bar each per hour
+        width = bar_width(len(self.traffic_data), len(colours))  # Width of each bar (narrower with many junctions)
         bar_spacing = 10                     # Spacing between bars of different hours
         x_start = 50                         # Starting x-coordinate for the Y-axis
         y_base = self.canvas_height - 50     # Base y-coordinate for the X-axis (bottom of the canvas)
@@ -332,28 +443,21 @@ class HistogramApp:
         # Iterate through the sorted hours in the traffic data
         hours = sorted(self.traffic_data.keys())
         for i, hour in enumerate(hours):
-            elm_value = self.traffic_data[hour]["Elm Avenue/Rabbit Road"]     # Get Elm Avenue count for the hour
-            hanley_value = self.traffic_data[hour]["Hanley Highway/Westway"]  # Get Hanley Highway count for the hour
+            x1 = x_start + i * (width * len(colours) + bar_spacing)  # Calculate x-coordinate for the first bar of the hour
 
-            x1 = x_start + i * (bar_width * 2 + bar_spacing)  # Calculate x-coordinate for Elm bar
-            # Each bar's height is determined by the scaled traffic count (y1_elm and y1_hanley)
-            y1_elm = y_base - elm_value * y_scale             # Calculate y-coordinate based on vehicle count and scaling
-            y1_hanley = y_base - hanley_value * y_scale       # Similar calculation for Hanley bar
-
-            # Elm Avenue/Rabbit Road bars (green color)
-            self.canvas.create_rectangle(x1, y1_elm, x1 + bar_width, y_base, fill="green", outline="black")
-            self.canvas.create_text(x1 + bar_width / 2, y1_elm - 10,  # Display count above the bar
-                                     text=str(elm_value), font=("Helvetica", 8), fill="green")
-
-            # Hanley Highway/Westway bars (red color)
-            x2 = x1 + bar_width  # Start of Hanley bar is next to Elm bar
-            self.canvas.create_rectangle(x2, y1_hanley, x2 + bar_width, y_base, fill="red", outline="black")
-            self.canvas.create_text(x2 + bar_width / 2, y1_hanley - 10,  # Display count above the bar
-                                     text=str(hanley_value), font=("Helvetica", 8), fill="red")
+            # One bar per junction, side by side (Elm Avenue/Rabbit Road green, Hanley Highway/Westway red)
+            for offset, (junction, colour) in enumerate(colours):
+                value = self.traffic_data[hour].get(junction, 0)  # Get the junction's count for the hour
+                x = x1 + offset * width                           # Each bar starts where the previous one ends
+                y = y_base - value * y_scale                      # Calculate y-coordinate based on vehicle count and scaling
+                self.canvas.create_rectangle(x, y, x + width, y_base, fill=colour, outline="black")
+                if width >= MIN_LABELLED_BAR_WIDTH:               # Display count above the bar if there is room
+                    self.canvas.create_text(x + width / 2, y - 10,
+                                             text=str(value), font=("Helvetica", 8), fill=colour)
 
             # Add hour labels
-            # Labels under each pair of bars, centered between them
-            self.canvas.create_text(x1 + bar_width,
+            # Labels under each group of bars, centered below them
+            self.canvas.create_text(x1 + width * len(colours) / 2,
                                     y_base + 20,
                                     text=hour,
                                     font=("Helvetica", 10),
@@ -364,59 +468,58 @@ class HistogramApp:
         Adds a legend to the histogram to indicate which bar corresponds to which junction.
         """
         
+        from histogram_export import LEGEND_ROWS, junction_colours
+
         legend_x = 70  # X-coordinate of the legend's starting position
         legend_y = 30  # Y-coordinate of the legend's starting position
         
-        # Elm Avenue/Rabbit Road (green color)
-        # Draws a small green rectangle to represent the Elm Avenue/Rabbit Road data
-        self.canvas.create_rectangle(legend_x,
-                                     legend_y,
-                                     legend_x + 20,
-                                     legend_y + 20,
-                                     fill="green",
-                                     outline="black")
-        
-        # The label is offset horizontally (legend_x + 30) and vertically centered (legend_y + 10)
-        # anchor="w" ensures the text aligns to the left of its starting position
-        self.canvas.create_text(legend_x + 30,
-                                legend_y + 10,
-                                text="Elm Avenue/Rabbit Road",
-                                anchor="w",
-                                font=("Helvetica", 10),
-                                fill="black")
-
-        legend_y += 30 # Move to the next line for the Hanley legend
-        
-        # Hanley Highway/Westway bars (red color)
-        # Draws a red rectangle and corresponding text label for Hanley Highway/Westway data
-        self.canvas.create_rectangle(legend_x,
-                                     legend_y,
-                                     legend_x + 20,
-                                     legend_y + 20,
-                                     fill="red",
-                                     outline="black")
-        
-        self.canvas.create_text(legend_x + 30,
-                                legend_y + 10,
-                                text="Hanley Highway/Westway",
-                                anchor="w",
-                                font=("Helvetica", 10),
-                                fill="black")
+        # One small coloured rectangle and label per junction, in the same colours as the bars
+        colours = junction_colours(self.traffic_data)
+        for junction, colour in colours[:LEGEND_ROWS]:
+            self.canvas.create_rectangle(legend_x,
+                                         legend_y,
+                                         legend_x + 20,
+                                         legend_y + 20,
+                                         fill=colour,
+                                         outline="black")
+            
+            # The label is offset horizontally (legend_x + 30) and vertically centered (legend_y + 10)
+            # anchor="w" ensures the text aligns to the left of its starting position
+            self.canvas.create_text(legend_x + 30,
+                                    legend_y + 10,
+                                    text=junction,
+                                    anchor="w",
+                                    font=("Helvetica", 10),
+                                    fill="black")
+
+            legend_y += 30 # Move to the next line for the next junction
+
+        # Long lists of junctions are shortened so the legend does not cover the bars
+        if len(colours) > LEGEND_ROWS:
+            self.canvas.create_text(legend_x + 30,
+                                    legend_y + 10,
+                                    text=f"and {len(colours) - LEGEND_ROWS} more junctions",
+                                    anchor="w",
+                                    font=("Helvetica", 10),
+                                    fill="black")
 
     def run(self):
         """
         Runs the Tkinter main loop to display the histogram.
         """
         
-        self.setup_window()     # Configure the window and canvas
-        self.draw_histogram()   # Draw the histogram with bars and labels
-        self.add_legend()       # Add a legend to the canvas
+        with profiling.stage("histogram drawing"):  # Timed when profiling is on
+            self.setup_window()     # Configure the window and canvas
+            self.draw_histogram()   # Draw the histogram with bars and labels
+            self.add_legend()       # Add a legend to the canvas
         self.root.mainloop()    # Enter the Tkinter main event loop to display the UI
 
 # Task E: Code Loops to Handle Multiple CSV Files
 
 class MultiCSVProcessor:
-    def __init__(self):
+    def __init__(self, engine=DEFAULT_ENGINE, cache=None, metric_names=None, gui=True, exporter=None, store=None,
+                 results_formats=("text",), results_file="results.txt", profile=False, profile_dir=None,
+                 sampling=None, print_format=None, quarantine_file=DEFAULT_QUARANTINE_FILE):
         """
         Initializes the application for processing multiple CSV files.
         """
@@ -424,7 +527,34 @@ class MultiCSVProcessor:
         # store the data from the current CSV file we're working on
         self.current_data = None
         # Name of a text file where we'll save results for later
-        self.results_file = "results.txt"
+        self.results_file = results_file
+        # One results sink per output format ("text" writes results_file, "jsonl" and "csv" write next to it)
+        from results_sink import SINKS, open_sinks
+        self.sinks = open_sinks(results_formats, results_file)
+        # Optional format ("text", "jsonl" or "csv") to also print the outcomes of each batch day in
+        # (progress lines then go to stderr, so the output can be piped)
+        self.print_format = print_format
+        if print_format is not None:
+            self.sinks.append(SINKS[print_format]("-", max_buffered=1))
+        # Time every stage of each day and print a breakdown table (profile_dir also keeps a cProfile file per day)
+        self.profile = profile
+        self.profile_dir = profile_dir
+        # Engine used to process each CSV file ("rows", "columnar", "chunked", "binary", "cube" or "fused")
+        self.engine = engine
+        # Optional AggregateCache so a date entered again is not processed again
+        self.cache = cache
+        # Optional list of metric registry names, to compute only some of the outcomes
+        self.metric_names = metric_names
+        # Show the Tkinter histogram window after each file (turn off for headless runs)
+        self.gui = gui
+        # Optional HistogramExporter that saves each histogram as an image in the background
+        self.exporter = exporter
+        # Optional SummaryStore that keeps the counts of every processed day for multi-day queries
+        self.store = store
+        # Optional approximate.SamplingPlan to estimate large files from a sample of their rows
+        self.sampling = sampling
+        # CSV file that receives the rows that fail validation
+        self.quarantine_file = quarantine_file
 
     def load_csv_file(self, file_path):
         """
@@ -432,7 +562,8 @@ class MultiCSVProcessor:
         """
         # Here we call another function to read and process the CSV file
         # If the file works, we store its data in 'self.current_data' and return True
-        data = process_csv_data(file_path)
+        data = process_csv_data(file_path, self.engine, self.cache, self.metric_names, self.store, self.sampling,
+                                self.quarantine_file)
         if data:
             self.current_data = data
             return True
@@ -451,6 +582,8 @@ class MultiCSVProcessor:
         Handles user input for processing multiple files.
         """
         # This is where the program asks the user questions and processes files
+        if self.profile:
+            profiling.enable()   # Once for the whole run; the profile is emptied after each day's report
         while True:      # Repeat until the user says they want to stop
             while True:  # Repeat until a valid file is loaded
                 # Ask the user to input a date
@@ -458,8 +591,11 @@ class MultiCSVProcessor:
                 # Turn the date into the correct file path
                 file_path = define_file_path(date)
                 
-                try:  # Process the CSV file
-                    hourly_data, outcomes = process_csv_data(file_path)
+                try:  # Process the CSV file (timed stage by stage when profiling)
+                    with profiling.profile_day(date, self.profile_dir):
+                        hourly_data, outcomes, values = process_csv_results(file_path, self.engine, self.cache,
+                                                                            self.metric_names, self.store,
+                                                                            self.sampling, self.quarantine_file)
                     # If the file is valid and processed successfully, exit this loop
                     if outcomes:
                         break
@@ -470,17 +606,32 @@ class MultiCSVProcessor:
 
             # Show the results of the file on the screen
             display_outcomes(outcomes)
-            # Save the results to a text file
-            save_results_to_file(outcomes, self.results_file)
+            # Save the results to the results file(s) straight away
+            self.save_results(date, file_path, outcomes, values, self.metric_names)
+            self.flush_results()
             
             # If the file has hourly data
+            # Save the histogram image in the background, without waiting for it
+            if hourly_data and self.exporter is not None:
+                self.exporter.submit(hourly_data, date)
             # Integrates a graphical component (HistogramApp) for data visualization
-            if hourly_data:
+            if hourly_data and self.gui:
                 app = HistogramApp(hourly_data, date)
                 app.run()
+
+            # Show where the time of this day went
+            if self.profile:
+                print(f"\nProfile of {date}:")
+                print("\n".join(profiling.ACTIVE.report()))
+                profiling.ACTIVE.clear()
+                if self.cache is not None:
+                    print(stats_line(self.cache.stats()))
             
             # Ask the user if they want to process another file
             if not validate_continue_input():
+                # Wait for any histogram images that are still being saved
+                self.finish_exports()
+                profiling.disable()
                 # If they say no, thank them and end the loop
                 print("\nEnd of Run! Thank you for using the Traffic Data Processor!")
                 break
@@ -492,13 +643,412 @@ class MultiCSVProcessor:
         """
         Main loop for handling multiple CSV files until the user decides to quit.
         """
-        self.handle_user_interaction()
+        try:
+            self.handle_user_interaction()
+        except EOFError:
+            # The input ended (for example a cron job with no terminal), so stop instead of asking forever
+            self.finish_exports()
+            sys.exit("\nNo more input. Use --batch DD-MM-YYYY [DD-MM-YYYY] or --glob PATTERN to run without prompts.")
+
+    def progress(self, message):
+        """
+        Shows a progress line of a batch run, on stderr when the outcomes themselves are printed.
+        """
+        print(message, file=sys.stdout if self.print_format is None else sys.stderr)
+
+    def save_results(self, date, file_path, outcomes, values, metric_names=None):
+        """
+        Adds the outcomes of one day to every results sink (written when the sink's buffer is full or flushed).
+        """
+        with profiling.stage("save results"):
+            for sink in self.sinks:
+                sink.write(date, file_path, outcomes, values, metric_names)
+
+    def flush_results(self):
+        """
+        Writes every buffered day to the results files.
+        """
+        with profiling.stage("save results"):
+            for sink in self.sinks:
+                sink.flush()
+
+    def finish_exports(self):
+        """
+        Waits for the histogram images that are still being saved and reports them.
+        """
+        if self.exporter is not None:
+            paths = self.exporter.close()
+            if paths:
+                self.progress(f"Saved {len(paths)} histogram image(s) to {self.exporter.output_dir}")
+            if self.exporter.failures:
+                self.progress(f"{self.exporter.failures} histogram image(s) could not be saved")
+
+    def process_batch(self, file_paths, workers=None):
+        """
+        Processes many CSV files without asking the user anything:
+        - Runs process_csv_data for each file on a pool of worker processes (in this process for a single file)
+        - Writes the outcomes of each day to the results file in date order
+        - Skips files that are missing and shows progress and throughput
+        Returns the number of files that were processed.
+        """
+        # Order the files by the date in their name so the results file reads in date order
+        file_paths = sorted(file_paths, key=file_date_sort_key)
+        total_files = len(file_paths)
+        finished = {}          # Results that are done but still waiting for an earlier day
+        next_to_write = 0      # Index of the next file to write to the results file
+        processed_files = 0    # Files processed successfully
+        processed_rows = 0     # Rows read across all processed files
+        cache_stats = {}       # Hits and misses of the aggregate cache, summed over the days
+        start_time = time.perf_counter()
+        # Stage timings of every day are added up in this process
+        if self.profile:
+            profiling.enable()
+
+        # Handle each file as soon as it finishes, in whatever order that happens
+        for done, (index, result) in enumerate(self.day_results(file_paths, workers), start=1):
+            file_path = file_paths[index]
+            if result is None:
+                # A missing day does not stop the run
+                outcomes, rows, hourly_data, metrics, stages, day_cache_stats = None, 0, None, None, None, None
+                self.progress(f"[{done}/{total_files}] {file_path} not found - skipped")
+            else:
+                outcomes, rows, hourly_data, metrics, stages, day_cache_stats = result
+                processed_files += 1
+                processed_rows += rows
+                if day_cache_stats is not None:
+                    add_stats(cache_stats, day_cache_stats)
+                if stages is not None and profiling.ACTIVE is not None:
+                    profiling.ACTIVE.merge(stages)
+                # Only this process writes to the summary store, the workers just return the counts
+                # (estimates from a sample and runs of chosen metrics are not stored)
+                if self.store is not None and "approximation" not in metrics and self.metric_names is None:
+                    self.store.record_day(file_date_label(file_path), file_path, metrics)
+                # Histogram images are rendered in the background while the pool keeps working
+                if hourly_data and self.exporter is not None:
+                    self.exporter.submit(hourly_data, file_date_label(file_path))
+                elapsed = max(time.perf_counter() - start_time, 1e-9)
+                bad_rows = metrics.get("data_quality", {}).get("bad_rows", 0)
+                quarantined = f", {bad_rows} bad rows quarantined" if bad_rows else ""
+                self.progress(f"[{done}/{total_files}] {file_path}: {rows} rows{quarantined} "
+                              f"({processed_rows / elapsed:,.0f} rows/s, {processed_files / elapsed:.2f} files/s)")
+            finished[index] = (outcomes, metrics)
+
+            # Buffer every finished day that is next in date order (the sinks write them in batches)
+            while next_to_write in finished:
+                outcomes, metrics = finished.pop(next_to_write)
+                if outcomes:
+                    file_path = file_paths[next_to_write]
+                    self.save_results(file_date_label(file_path), file_path, outcomes, metrics, self.metric_names)
+                next_to_write += 1
+
+        # Write the days still in the buffers
+        self.flush_results()
+
+        # Print a summary of the whole run
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        self.progress(f"\nProcessed {processed_files} of {total_files} files ({processed_rows} rows) "
+                      f"in {elapsed:.2f}s - {processed_rows / elapsed:,.0f} rows/s, "
+                      f"{processed_files / elapsed:.2f} files/s")
+        if cache_stats:
+            self.progress(stats_line(cache_stats))
+        # Show where the time of the whole run went (worker stages are summed over all days)
+        if self.profile:
+            self.progress("\nProfile of all days:")
+            self.progress("\n".join(profiling.disable().report()))
+        # Wait for any histogram images that are still being saved
+        self.finish_exports()
+        return processed_files
+
+    def day_results(self, file_paths, workers=None):
+        """
+        Processes the files and yields (index, result) for each one as soon as it finishes,
+        where result is what process_day returns, or None if the file is missing:
+        - A single file (or workers=1) is processed in this process, which saves starting a pool
+        - Otherwise the files are processed on a pool of worker processes
+        """
+        cache_dir = self.cache.cache_dir if self.cache is not None else None
+        if len(file_paths) == 1 or workers == 1:
+            for index, file_path in enumerate(file_paths):
+                try:
+                    # Stages are timed by the profiler process_batch enabled in this process
+                    yield index, process_day(file_path, self.engine, cache_dir, False, self.profile_dir,
+                                             self.quarantine_file, self.sampling, self.metric_names)
+                except FileNotFoundError:
+                    yield index, None
+            return
+
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Hand every file to the pool
+            futures = {executor.submit(process_day, file_path, self.engine, cache_dir,
+                                       self.profile, self.profile_dir, self.quarantine_file,
+                                       self.sampling, self.metric_names): index
+                       for index, file_path in enumerate(file_paths)}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except FileNotFoundError:
+                    yield futures[future], None
             
 
+# Task F: Batch Processing of Multiple Days
+
+def dates_in_range(start_date, end_date):
+    """
+    Returns every date from start_date to end_date (both included) in DD-MM-YYYY format.
+    - Both dates are given in DD-MM-YYYY format, like validate_date_input returns
+    """
+    
+    from datetime import date, timedelta
+    
+    def parse(text):
+        # DD-MM-YYYY split by hand (strptime would import _strptime and locale); bad dates raise ValueError
+        day, month, year = map(int, text.split("-"))
+        return date(year, month, day)
+    
+    start = parse(start_date)          # First day of the range
+    end = parse(end_date)              # Last day of the range
+    days = (end - start).days + 1      # Number of days in the range
+    return [f"{start + timedelta(days=offset):%d-%m-%Y}" for offset in range(days)]
+
+
+def batch_file_paths(start_date=None, end_date=None, pattern=None):
+    """
+    Builds the list of CSV files for a batch run, either:
+    - One file per day in a date range (missing days are kept and skipped later), or
+    - Every file matching a glob pattern
+    """
+    
+    if pattern is not None:
+        import glob
+        return glob.glob(pattern)
+    return [define_file_path(date) for date in dates_in_range(start_date, end_date or start_date)]
+
+
+def file_date_sort_key(file_path):
+    """
+    Sort key that orders traffic_dataDDMMYYYY.csv files by date.
+    Files without a date in their name go last, ordered by name.
+    """
+    
+    import re
+    match = re.search(r"traffic_data(\d{2})(\d{2})(\d{4})", os.path.basename(file_path))
+    if match:
+        day, month, year = match.groups()
+        return (0, f"{year}{month}{day}", file_path)
+    return (1, "", file_path)
+
+
+def file_date_label(file_path):
+    """
+    Returns the date of a traffic_dataDDMMYYYY.csv file as DD-MM-YYYY, or the file name if it has no date.
+    """
+    
+    import re
+    match = re.search(r"traffic_data(\d{2})(\d{2})(\d{4})", os.path.basename(file_path))
+    if match:
+        return "-".join(match.groups())
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def process_day(file_path, engine=DEFAULT_ENGINE, cache_dir=None, profile=False, profile_dir=None,
+                quarantine_file=DEFAULT_QUARANTINE_FILE, sampling=None, metric_names=None):
+    """
+    Processes one CSV file in a worker process and returns its outcomes, row count, histogram data,
+    raw counts, stage profile (None unless profile is True) and the hits and misses of the aggregate cache
+    (AggregateCache.stats, None without a cache).
+    If cache_dir is given, the on-disk aggregate cache in that folder is used.
+    If profile_dir is given, a cProfile file of the day is saved in that folder.
+    Bad rows are written to quarantine_file.
+    If sampling (an approximate.SamplingPlan) is given, large files are estimated from a sample of their rows.
+    If metric_names is given, only those metrics from the metric registry are computed.
+    """
+    
+    cache = AggregateCache(cache_dir) if cache_dir is not None else None
+    if profile:
+        profiling.enable()
+    try:
+        with profiling.profile_day(file_date_label(file_path), profile_dir):
+            hourly_data, outcomes, metrics = process_csv_results(file_path, engine, cache, metric_names,
+                                                                 sampling=sampling, quarantine_file=quarantine_file)
+    finally:
+        # Only stop the profiler this call started (a day processed in the main process keeps its caller's)
+        profiler = profiling.disable() if profile else None
+    stages = profiler.to_dict() if profiler is not None else None
+    # A sampled file only had its sampled rows read
+    rows = metrics["approximation"]["sample_rows"] if "approximation" in metrics else metrics["total_vehicles"]
+    cache_stats = cache.stats() if cache is not None else None
+    return outcomes, rows, hourly_data, metrics, stages, cache_stats
+
+
+# Task G: Follow Mode for Live Feeds
+
+def follow_feed(file_path, interval=10.0, sinks=None, quarantine_file=DEFAULT_QUARANTINE_FILE):
+    """
+    Follows a growing CSV file (or stdin when file_path is "-") and shows refreshed outcomes:
+    - Every interval seconds while new rows arrive
+    - A final block when the file is rotated and when the feed ends
+    Final blocks are saved to the results sinks (results.txt if none are given).
+    Rows that fail validation are written to quarantine_file.
+    """
+    
+    from datetime import datetime
+
+    from follow import follow_events, stream_events, tail_file_events
+    from results_sink import open_sinks
+    
+    label = "stdin" if file_path == "-" else file_path   # Name shown in the outcomes
+    
+    def show_update(metrics, final):
+        # Show the time of the update, then the outcomes so far and the data quality summary
+        status = "Final" if final else "Live"
+        print(f"\n[{status} update at {datetime.now():%H:%M:%S}]")
+        outcomes = build_outcomes(label, metrics)
+        display_outcomes(outcomes)
+        if final and metrics["total_vehicles"]:
+            for sink in sinks or open_sinks(["text"]):
+                sink.write(file_date_label(label), label, outcomes, metrics)
+                sink.flush()
+    
+    # Read from the pipe or tail the file
+    if file_path == "-":
+        events = stream_events(sys.stdin)
+    else:
+        events = tail_file_events(file_path)
+    skipped_rows = follow_events(events, show_update, interval, label, quarantine_file)
+    if skipped_rows:
+        print(f"{skipped_rows} rows could not be read and were written to {quarantine_file}.")
+
+
 # Main system execution
-def main_system():
+def main_system(argv=None):
+    # Read the optional command line options for non-interactive batch runs
+    import argparse
+    parser = argparse.ArgumentParser(description="Traffic Data Processor")
+    parser.add_argument("--batch", nargs="+", metavar="DD-MM-YYYY",
+                        help="process a date or a date range (start and end) without prompts")
+    parser.add_argument("--glob", metavar="PATTERN",
+                        help="process every CSV file matching PATTERN without prompts")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes for batch runs")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="engine used to process each CSV file (default: auto, the binary columnar copy "
+                             "of the file when it has one or is large; rows is the reference row loop)")
+    parser.add_argument("--metrics", metavar="NAME[,NAME...]",
+                        help="compute only these metrics from the metric registry")
+    parser.add_argument("--follow", metavar="PATH",
+                        help="follow a growing CSV file (or '-' for stdin) and refresh the outcomes as rows arrive")
+    parser.add_argument("--interval", type=float, default=10.0,
+                        help="seconds between refreshed outcomes in follow mode")
+    parser.add_argument("--no-gui", action="store_true",
+                        help="do not open the Tkinter histogram window")
+    parser.add_argument("--export-histograms", metavar="DIR",
+                        help="save each histogram as an image in DIR (rendered in the background)")
+    parser.add_argument("--image-format", choices=("svg", "png"), default="svg",
+                        help="image format for --export-histograms (png needs Pillow)")
+    parser.add_argument("--cache-dir", metavar="DIR", default=DEFAULT_CACHE_DIR,
+                        help="folder of the aggregate cache (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always process the CSV files instead of using the aggregate cache")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="delete every cached aggregate before running")
+    parser.add_argument("--summary-db", nargs="?", const="", metavar="PATH",
+                        help="also store the counts of every processed day in a SQLite file for queries over "
+                             "many days, see summary_store.py (without PATH: traffic_summary.db in "
+                             f"{user_cache_dir()})")
+    parser.add_argument("--results-file", metavar="PATH", default="results.txt",
+                        help="text results file; other formats are written next to it with their own extension")
+    parser.add_argument("--profile", nargs="?", const="", metavar="DIR",
+                        help="print how long each processing stage took; with DIR, also save a cProfile "
+                             "file per day (profile_DD-MM-YYYY.prof) for snakeviz or flame graph tools")
+    parser.add_argument("--results-format", nargs="+", choices=("text", "jsonl", "csv"), default=["text"],
+                        help="formats of the saved results: text (sentences), jsonl and/or csv")
+    parser.add_argument("--print", dest="print_format", choices=("text", "jsonl", "csv"),
+                        help="also print the outcomes of every batch day to standard output in this format "
+                             "(progress lines then go to standard error)")
+    parser.add_argument("--quarantine-file", metavar="PATH", default=DEFAULT_QUARANTINE_FILE,
+                        help="CSV file that receives the rows that fail validation, with line numbers and reasons")
+    parser.add_argument("--sample-rows", type=int, metavar="N",
+                        help="estimate large files from a sample of N rows, with 95%% confidence intervals")
+    parser.add_argument("--max-error", type=float, metavar="POINTS",
+                        help="estimate large files from a sample big enough for shares to be within POINTS "
+                             "percentage points (95%% of the time); --sample-rows caps the sample")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed of --sample-rows and --max-error, for repeatable samples")
+    args = parser.parse_args(argv)
+
+    if args.print_format and not (args.batch or args.glob):
+        parser.error("--print needs --batch or --glob")
+    # PNG histograms need Pillow, which is checked now rather than when the first image is saved
+    if args.image_format == "png":
+        from histogram_export import check_format
+        try:
+            check_format(args.image_format)
+        except ImportError as error:
+            parser.error(str(error))
+    # Two results formats must not write to the same file (sinks only open their file when they write)
+    from results_sink import open_sinks
+    try:
+        open_sinks(args.results_format, args.results_file)
+    except ValueError as error:
+        parser.error(str(error))
+
+    # Aggregates of files that were already processed are kept in a cache
+    cache = None if args.no_cache else AggregateCache(args.cache_dir)
+    if args.clear_cache:
+        (cache or AggregateCache(args.cache_dir)).invalidate()
+
     # Start the program by creating a MultiCSVProcessor object
-    multi_csv_processor = MultiCSVProcessor()
+    metric_names = args.metrics.split(",") if args.metrics else None
+    if metric_names is not None:
+        from metric_registry import resolve
+        try:
+            resolve(metric_names)
+        except ValueError as error:
+            parser.error(str(error))
+    sampling = None
+    if args.sample_rows is not None or args.max_error is not None:
+        if metric_names is not None:
+            parser.error("--metrics cannot be combined with --sample-rows or --max-error")
+        from approximate import SamplingPlan
+        try:
+            sampling = SamplingPlan(args.sample_rows, args.max_error, args.seed)
+        except ValueError as error:
+            parser.error(str(error))
+    exporter = None
+    if args.export_histograms:
+        from histogram_export import HistogramExporter
+        exporter = HistogramExporter(args.export_histograms, args.image_format)
+    store = None
+    if args.summary_db is not None:
+        from summary_store import DEFAULT_DB_PATH, SummaryStore
+        store = SummaryStore(args.summary_db or DEFAULT_DB_PATH)
+    multi_csv_processor = MultiCSVProcessor(engine=args.engine, cache=cache, metric_names=metric_names,
+                                            gui=not args.no_gui, exporter=exporter, store=store,
+                                            results_formats=args.results_format, results_file=args.results_file,
+                                            profile=args.profile is not None, profile_dir=args.profile or None,
+                                            sampling=sampling, print_format=args.print_format,
+                                            quarantine_file=args.quarantine_file)
+    # Say where the summary store writes, as it is outside the folder the program runs in
+    if store is not None and not args.follow:
+        multi_csv_processor.progress(f"Storing the counts of every day in {store.path}")
+
+    # Follow mode keeps reading new rows until the feed ends or Ctrl+C is pressed
+    if args.follow:
+        follow_feed(args.follow, args.interval, multi_csv_processor.sinks, args.quarantine_file)
+        return
+
+    # Batch mode processes every requested day and then stops
+    if args.batch or args.glob:
+        if args.batch and len(args.batch) > 2:
+            parser.error("--batch takes a single date or a start and end date")
+        if args.glob:
+            file_paths = batch_file_paths(pattern=args.glob)
+        else:
+            file_paths = batch_file_paths(*args.batch)
+        multi_csv_processor.process_batch(file_paths, workers=args.workers)
+        return
+
     # Call the 'process_files()' method to begin processing files
     multi_csv_processor.process_files()
 
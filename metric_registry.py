@@ -0,0 +1,364 @@
+"""
+Declarative registry of the traffic metrics.
+
+Every metric is declared once as a filter plus an aggregation:
+- "count"     counts the rows that pass the filter
+- "distinct"  counts the distinct values of a field (for example hours) over the rows that pass
+- "group"     counts the rows that pass per value of a field (the buckets used for peak hours)
+- "junctions" counts the rows per hour and the scooters of every junction in a JunctionTable
+- "speeds"    counts the speeds per junction, hour and vehicle type in a SpeedStats
+- "ratio", "average", "peak count", "peak times", "histogram", "junction summaries"
+  and "speed summaries" are derived from other metrics after the pass
+
+FusedEvaluator turns the selected metrics into one fused loop over the rows.
+Each field (junction, vehicle type, hour, ...) and each shared predicate is
+worked out at most once per row, and only if a selected metric needs it, so
+metrics that are not selected cost nothing. The outcome lines are built from
+the line template of each metric; a metric whose value is a list (one entry
+per junction) gets one line per entry.
+"""
+
+from functools import lru_cache
+
+from aggregate import ELM_RABBIT, HANLEY_WESTWAY, JUNCTION_COUNTERS, JunctionTable
+from speed_stats import SpeedStats, speed_lines
+
+# How each field is read from a csv.DictReader row
+FIELDS = {
+    "junction": 'row["JunctionName"]',
+    "vehicle_type": 'row["VehicleType"]',
+    "hour": 'row["timeOfDay"][:2]',
+    "direction_in": 'row["travel_Direction_in"]',
+    "direction_out": 'row["travel_Direction_out"]',
+    "weather": 'row["Weather_Conditions"]',
+    "electric_flag": 'row["elctricHybrid"]',
+    "vehicle_speed": 'int(row["VehicleSpeed"])',
+    "speed_limit": 'int(row["JunctionSpeedLimit"])',
+}
+
+# Shared predicates: name -> (fields used, Python expression over those fields)
+PREDICATES = {
+    "truck": (("vehicle_type",), 'vehicle_type == "Truck"'),
+    "bus": (("vehicle_type",), 'vehicle_type == "Buss"'),
+    "bicycle": (("vehicle_type",), 'vehicle_type == "Bicycle"'),
+    "scooter": (("vehicle_type",), 'vehicle_type == "Scooter"'),
+    "two_wheeled": (("vehicle_type",), 'vehicle_type in ("Bicycle", "Motorcycle", "Scooter")'),
+    "electric": (("electric_flag",), 'electric_flag.lower() == "true"'),
+    "elm_rabbit": (("junction",), f'junction == "{ELM_RABBIT}"'),
+    "hanley_westway": (("junction",), f'junction == "{HANLEY_WESTWAY}"'),
+    "leaving_north": (("direction_out",), 'direction_out == "N"'),
+    "no_turn": (("direction_in", "direction_out"), "direction_in == direction_out"),
+    "over_limit": (("vehicle_speed", "speed_limit"), "vehicle_speed > speed_limit"),
+    "rain": (("weather",), 'weather in ("Light Rain", "Heavy Rain")'),
+}
+
+
+class Metric:
+    def __init__(self, name, kind, where=(), field=None, inputs=(), line=None):
+        """
+        Declares one metric:
+        - kind is the aggregation ("count", "distinct", "group", "junctions", "speeds", "ratio", "average",
+          "peak count", "peak times", "histogram", "junction summaries" or "speed summaries")
+        - where lists the predicates a row must pass (all of them)
+        - field is the field that "distinct" and "group" work on
+        - inputs are the metrics a derived metric is worked out from
+        - line is the outcome line template, filled in with {value}
+        """
+
+        self.name = name
+        self.kind = kind
+        self.where = tuple(where)
+        self.field = field
+        self.inputs = tuple(inputs)
+        self.line = line
+
+    @property
+    def derived(self):
+        # Derived metrics are worked out after the pass and cost nothing per row
+        return self.kind in ("ratio", "average", "peak count", "peak times", "histogram", "junction summaries",
+                             "speed summaries")
+
+
+# Every metric, in the order the outcome lines are shown
+REGISTRY = {}
+
+
+def register(metric):
+    """
+    Adds a metric to the registry and returns it.
+    """
+
+    if metric.name in REGISTRY:
+        raise ValueError(f"Metric '{metric.name}' is already registered")
+    for name in metric.where:
+        if name not in PREDICATES:
+            raise ValueError(f"Unknown predicate '{name}' in metric '{metric.name}'")
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+register(Metric("total_vehicles", "count",
+                line="The total number of vehicles recorded for this date is {value}"))
+register(Metric("total_trucks", "count", where=("truck",),
+                line="The total number of trucks recorded for this date is {value}"))
+register(Metric("total_electric_vehicles", "count", where=("electric",),
+                line="The total number of electric vehicles for this date is {value}"))
+register(Metric("two_wheeled_vehicles", "count", where=("two_wheeled",),
+                line="The total number of two-wheeled vehicles for this date is {value}"))
+register(Metric("busses_leaving_north", "count", where=("elm_rabbit", "leaving_north", "bus"),
+                line="The total number of buses leaving Elm Avenue/Rabbit Road heading North is {value}"))
+register(Metric("vehicles_no_turns", "count", where=("no_turn",),
+                line="The total number of vehicles through both junctions not turning left or right is {value}"))
+register(Metric("trucks_percentage", "ratio", inputs=("total_trucks", "total_vehicles"),
+                line="The percentage of total vehicles recorded that are trucks for this date is {value}%"))
+register(Metric("total_bicycles", "count", where=("bicycle",)))
+register(Metric("average_bicycles_per_hour", "average", inputs=("total_bicycles",),
+                line="The average number of bicycles per hour for this date is {value}"))
+register(Metric("vehicles_over_speed", "count", where=("over_limit",),
+                line="The total number of vehicles recorded as over the speed limit for this date is {value}"))
+register(Metric("vehicles_elm_rabbit", "count", where=("elm_rabbit",),
+                line="The total number of vehicles recorded through Elm Avenue/Rabbit Road junction is {value}"))
+register(Metric("vehicles_hanley_westway", "count", where=("hanley_westway",),
+                line="The total number of vehicles recorded through Hanley Highway/Westway junction is {value}"))
+register(Metric("scooters_count", "count", where=("elm_rabbit", "scooter")))
+register(Metric("scooters_percentage", "ratio", inputs=("scooters_count", "vehicles_elm_rabbit"),
+                line="{value}% of vehicles recorded through Elm Avenue/Rabbit Road are scooters."))
+register(Metric("hourly_counts", "group", where=("hanley_westway",), field="hour"))
+register(Metric("max_vehicles_hour", "peak count", inputs=("hourly_counts",),
+                line="The highest number of vehicles in an hour on Hanley Highway/Westway is {value}"))
+register(Metric("max_vehicles_time", "peak times", inputs=("hourly_counts",),
+                line="The most vehicles through Hanley Highway/Westway were recorded between {value}"))
+register(Metric("rain_hours", "distinct", where=("rain",), field="hour",
+                line="The number of hours of rain for this date is {value}"))
+register(Metric("junction_table", "junctions"))
+register(Metric("junction_summaries", "junction summaries", inputs=("junction_table",),
+                line="{value}"))
+register(Metric("hourly_data", "histogram", inputs=("junction_table",)))
+register(Metric("speed_stats", "speeds"))
+register(Metric("speed_summaries", "speed summaries", inputs=("speed_stats",),
+                line="{value}"))
+
+
+def resolve(names):
+    """
+    Returns the selected metrics plus every metric they depend on, in registry order.
+    """
+
+    needed = set()
+
+    def visit(name):
+        if name not in REGISTRY:
+            raise ValueError(f"Unknown metric '{name}'. Choose from: {', '.join(REGISTRY)}")
+        if name not in needed:
+            needed.add(name)
+            for input_name in REGISTRY[name].inputs:
+                visit(input_name)
+
+    for name in names:
+        visit(name)
+    return [REGISTRY[name] for name in REGISTRY if name in needed]
+
+
+def derive(metric, values):
+    """
+    Works out the value of a derived metric from the values of its inputs.
+    """
+
+    inputs = [values[name] for name in metric.inputs]
+    if metric.kind == "histogram":
+        return JunctionTable.from_dict(inputs[0]).hourly_data()
+    if metric.kind == "junction summaries":
+        return junction_summaries(JunctionTable.from_dict(inputs[0]))
+    if metric.kind == "speed summaries":
+        return speed_lines(SpeedStats.from_dict(inputs[0]))
+    if metric.kind == "ratio":
+        part, whole = inputs
+        return round((part / whole) * 100) if whole else 0
+    if metric.kind == "average":
+        return round(inputs[0] / 24)
+    if metric.kind == "peak count":
+        return max(inputs[0].values()) if inputs[0] else 0
+    return peak_times(inputs[0])
+
+
+def peak_times(counts):
+    """
+    Returns every hour that reaches the peak count, in order of first appearance.
+    """
+
+    if not counts:
+        return ""
+    peak = max(counts.values())
+    return ", ".join(f"Between {hour}:00 and {int(hour)+1}:00" for hour, count in counts.items() if count == peak)
+
+
+def junction_records(table):
+    """
+    Returns the outcomes of every junction of a JunctionTable as dicts: vehicles, scooter share and peak hours.
+    """
+
+    records = []
+    for junction in table.junctions:
+        total = table.total(junction)
+        counts = table.hourly_counts(junction)
+        records.append({
+            "junction": junction,
+            "vehicles": total,
+            "scooters_percentage": round((table.scooter_count(junction) / total) * 100) if total else 0,
+            "max_vehicles_hour": max(counts.values(), default=0),
+            "max_vehicles_time": peak_times(counts),
+        })
+    return records
+
+
+def junction_summaries(table):
+    """
+    Returns one summary line per junction of a JunctionTable.
+    """
+
+    return [f"{record['junction']}: {record['vehicles']} vehicles, {record['scooters_percentage']}% scooters, "
+            f"highest number in an hour {record['max_vehicles_hour']} ({record['max_vehicles_time']})"
+            for record in junction_records(table)]
+
+
+class FusedEvaluator:
+    def __init__(self, names=None):
+        """
+        Compiles the selected metrics (every metric if names is None) into one fused row loop.
+        """
+
+        self.selected = list(REGISTRY) if names is None else list(names)
+        self.metrics = resolve(self.selected)
+        self.source = self.generate_source()
+        namespace = {"JunctionTable": JunctionTable, "SpeedStats": SpeedStats}
+        exec(compile(self.source, "<fused metrics>", "exec"), namespace)
+        self.loop = namespace["fused_loop"]
+
+    def generate_source(self):
+        """
+        Writes the Python source of the fused loop for the row metrics.
+        """
+
+        row_metrics = [metric for metric in self.metrics if not metric.derived]
+
+        # Predicates used by the row metrics, and the fields those predicates and metrics read
+        used = set()
+        for metric in row_metrics:
+            used.update(metric.where)
+            if metric.kind == "junctions":
+                used.add("scooter")
+                used.update(*(REGISTRY[name].where for name in JUNCTION_COUNTERS))
+        predicates = [name for name in PREDICATES if name in used]
+        fields = set()
+        for name in predicates:
+            fields.update(PREDICATES[name][0])
+        for metric in row_metrics:
+            if metric.field:
+                fields.add(metric.field)
+            if metric.kind == "junctions":
+                fields.update(("hour", "junction"))
+            if metric.kind == "speeds":
+                fields.update(("junction", "hour", "vehicle_type", "vehicle_speed", "speed_limit"))
+
+        setup, body, results = [], [], []
+        for metric in row_metrics:
+            if metric.kind == "count":
+                setup.append(f"{metric.name} = 0")
+                update = f"{metric.name} += 1"
+                results.append(f'"{metric.name}": {metric.name}')
+            elif metric.kind == "distinct":
+                setup.append(f"{metric.name} = set()")
+                update = f"{metric.name}.add({metric.field})"
+                results.append(f'"{metric.name}": len({metric.name})')
+            elif metric.kind == "group":
+                setup.append(f"{metric.name} = {{}}")
+                update = f"{metric.name}[{metric.field}] = {metric.name}.get({metric.field}, 0) + 1"
+                results.append(f'"{metric.name}": {metric.name}')
+            elif metric.kind == "junctions":
+                # The table also counts the JUNCTION_COUNTERS per hour and junction, with their own predicates
+                counters = ", ".join(" and ".join(f"p_{name}" for name in REGISTRY[counter].where)
+                                     for counter in JUNCTION_COUNTERS)
+                setup.append(f"{metric.name} = JunctionTable()")
+                update = f"{metric.name}.add(hour, junction, p_scooter, 1, ({counters}))"
+                results.append(f'"{metric.name}": {metric.name}.to_dict()')
+            else:  # speeds
+                setup.append(f"{metric.name} = SpeedStats()")
+                update = f"{metric.name}.add(junction, hour, vehicle_type, vehicle_speed, speed_limit)"
+                results.append(f'"{metric.name}": {metric.name}.to_dict()')
+
+            if metric.where:
+                condition = " and ".join(f"p_{name}" for name in metric.where)
+                body.append(f"if {condition}:")
+                body.extend("    " + line for line in update.split("\n"))
+            else:
+                body.extend(update.split("\n"))
+
+        lines = ["def fused_loop(rows):"]
+        lines += ["    " + line for line in setup]
+        lines.append("    for row in rows:")
+        lines += [f"        {name} = {FIELDS[name]}" for name in FIELDS if name in fields]
+        lines += [f"        p_{name} = {PREDICATES[name][1]}" for name in predicates]
+        lines += ["        " + line for line in body] or ["        pass"]
+        lines.append("    return {" + ", ".join(results) + "}")
+        return "\n".join(lines) + "\n"
+
+    def run(self, rows):
+        """
+        Runs the fused loop over the rows and works out the derived metrics.
+        Returns a dict of metric name -> value for the selected metrics and their inputs.
+        """
+
+        values = self.loop(rows)
+        for metric in self.metrics:
+            if metric.derived:
+                values[metric.name] = derive(metric, values)
+        return values
+
+    def outcome_lines(self, file_path, values):
+        """
+        Builds the outcome lines of the selected metrics.
+        """
+
+        return outcome_lines(file_path, values, self.selected)
+
+
+@lru_cache(maxsize=32)
+def get_evaluator(names=None):
+    """
+    Returns a compiled FusedEvaluator for a tuple of metric names, reusing earlier compilations.
+    """
+
+    return FusedEvaluator(names)
+
+
+def outcome_values(values, names=None):
+    """
+    Returns the value of every selected metric that has an outcome line, in registry order:
+    - Derived metrics missing from values are worked out first
+    - Only the metrics in names (every metric if names is None) are returned
+    """
+
+    values = dict(values)
+    selected = set(REGISTRY if names is None else names)
+    reported = {}
+    for metric in resolve(selected):
+        if metric.derived and metric.name not in values:
+            values[metric.name] = derive(metric, values)
+        if metric.name in selected and metric.line:
+            reported[metric.name] = values[metric.name]
+    return reported
+
+
+def outcome_lines(file_path, values, names=None):
+    """
+    Builds the outcome lines for a dict of metric values, in registry order (see outcome_values).
+    """
+
+    lines = [f"\nData file selected is {file_path}"]
+    for name, value in outcome_values(values, names).items():
+        if isinstance(value, list):
+            lines.extend(REGISTRY[name].line.format(value=item) for item in value)
+        else:
+            lines.append(REGISTRY[name].line.format(value=value))
+    lines[-1] += "\n"
+    return lines
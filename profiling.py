@@ -0,0 +1,270 @@
+"""
+Per-stage instrumentation of the processing pipeline.
+
+When profiling is enabled, every stage of processing a day (cache lookup,
+file reading, CSV parsing, metric checks, outcome lines, saving, histogram
+drawing) adds its time, calls and rows to the active StageProfiler, and the
+cost of each registry metric is sampled on the first rows of the file. The
+metrics are timed one at a time through the fused evaluator, so their costs
+are fused-engine estimates; the whole TrafficAggregate.add_row of the rows
+engine is timed on the same rows next to them.
+When it is off, stage() returns one shared do-nothing context manager, so the
+hooks cost a function call and a None check per stage (not per row).
+
+profile_day() can also run cProfile around a whole day and save the result as
+a .prof file, which snakeviz, flameprof or pstats can turn into a flame graph.
+"""
+
+import io
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+
+# The profiler of the current run, or None when profiling is off
+ACTIVE = None
+
+# Returned by stage() when profiling is off
+NO_STAGE = nullcontext()
+
+# Stage that samples the metric costs; it is overhead of profiling, so it is left out of the total
+SAMPLING_STAGE = "metric sampling"
+
+# Rows used to sample the cost of each metric, and how often each sample is timed (the fastest run counts)
+DEFAULT_SAMPLE_ROWS = 2000
+SAMPLE_REPEATS = 3
+
+# Name the sampled cost of the rows engine's TrafficAggregate.add_row (every metric at once) is kept under
+ADD_ROW_COST = "rows engine add_row"
+
+# Rows parsed per batch and characters read per block when the row loop is profiled
+BATCH_ROWS = 10_000
+READ_BLOCK_CHARS = 1 << 20
+
+
+class StageProfiler:
+    def __init__(self, sample_metrics=True):
+        """
+        Starts an empty profile:
+        - sample_metrics turns on sampling of the per row cost of each registry metric
+        """
+
+        self.sample_metrics = sample_metrics
+        self.clear()
+
+    def clear(self):
+        """
+        Empties the profile but keeps it active, e.g. to report each day of a run on its own.
+        """
+
+        self.seconds = {}        # Stage -> total seconds
+        self.calls = {}          # Stage -> number of times the stage ran
+        self.rows = {}           # Stage -> rows handled by the stage
+        self.metric_costs = {}   # Metric name -> sampled seconds per row, one entry per sampled file
+        self.nested = []         # Seconds of the stages nested in each running stage, innermost last
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code inside the with block as one call of a stage.
+        Time spent in a stage nested inside it counts for the inner stage only, so the stages add up to the total.
+        """
+
+        start = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed - self.nested.pop()
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def add_rows(self, name, rows):
+        """
+        Adds to the number of rows handled by a stage.
+        """
+
+        self.rows[name] = self.rows.get(name, 0) + rows
+
+    def to_dict(self):
+        """
+        Returns the profile as plain dicts, so it can be sent back from a worker process.
+        """
+
+        return {"seconds": self.seconds, "calls": self.calls, "rows": self.rows, "metric_costs": self.metric_costs}
+
+    def merge(self, data):
+        """
+        Adds a profile from to_dict() (for example from a worker process) to this one.
+        """
+
+        for name, seconds in data["seconds"].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        for name, calls in data["calls"].items():
+            self.calls[name] = self.calls.get(name, 0) + calls
+        for name, rows in data["rows"].items():
+            self.rows[name] = self.rows.get(name, 0) + rows
+        for name, costs in data["metric_costs"].items():
+            self.metric_costs.setdefault(name, []).extend(costs)
+
+    def report(self):
+        """
+        Returns the breakdown tables as lines of text: time per stage, then the sampled cost per metric.
+        """
+
+        stages = {name: seconds for name, seconds in self.seconds.items() if name != SAMPLING_STAGE}
+        total = sum(stages.values())
+        lines = [f"{'Stage':<22}{'Calls':>7}{'Seconds':>11}{'Share':>8}{'Rows':>12}{'Rows/s':>14}"]
+        for name, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            rows = self.rows.get(name)
+            rate = f"{rows / max(seconds, 1e-9):,.0f}" if rows else ""
+            lines.append(f"{name:<22}{self.calls[name]:>7}{seconds:>11.4f}{seconds / max(total, 1e-9):>8.1%}"
+                         f"{rows if rows else '':>12}{rate:>14}")
+        lines.append(f"{'total':<22}{'':>7}{total:>11.4f}")
+        if SAMPLING_STAGE in self.seconds:
+            lines.append(f"{'(metric sampling)':<22}{self.calls[SAMPLING_STAGE]:>7}"
+                         f"{self.seconds[SAMPLING_STAGE]:>11.4f}  not counted in the total")
+
+        if self.metric_costs:
+            # Rows the metric checks ran on, to estimate what each metric costs for the whole run
+            rows = max(self.rows.values(), default=0)
+            costs = {name: sum(samples) / len(samples) for name, samples in self.metric_costs.items()}
+            add_row = costs.pop(ADD_ROW_COST, None)
+            lines.append("")
+            # Each metric is timed on its own in the fused evaluator, not inside the rows engine's add_row
+            lines.append(f"{'Metric (fused-engine estimate)':<34}{'ns/row':>10}{'Est. seconds':>14}")
+            for name, cost in sorted(costs.items(), key=lambda item: -item[1]):
+                lines.append(f"{name:<34}{cost * 1e9:>10.0f}{cost * rows:>14.4f}")
+            if add_row is not None:
+                lines.append(f"{ADD_ROW_COST + ' (all)':<34}{add_row * 1e9:>10.0f}{add_row * rows:>14.4f}")
+        return lines
+
+
+def enable(sample_metrics=True):
+    """
+    Turns profiling on with a new, empty profile and returns it.
+    """
+
+    global ACTIVE
+    ACTIVE = StageProfiler(sample_metrics)
+    return ACTIVE
+
+
+def disable():
+    """
+    Turns profiling off and returns the profile that was active (or None).
+    """
+
+    global ACTIVE
+    profiler, ACTIVE = ACTIVE, None
+    return profiler
+
+
+def stage(name):
+    """
+    Returns a context manager that times a stage when profiling is on, and does nothing when it is off.
+    """
+
+    return NO_STAGE if ACTIVE is None else ACTIVE.stage(name)
+
+
+def add_rows(name, rows):
+    """
+    Counts the rows handled by a stage when profiling is on.
+    """
+
+    if ACTIVE is not None:
+        ACTIVE.add_rows(name, rows)
+
+
+def timed_lines(file, name="read file"):
+    """
+    Yields the lines of a text file opened with universal newlines, reading it in blocks
+    of READ_BLOCK_CHARS that are each timed as one call of a stage. Only one block is held at a time.
+    """
+
+    rest = ""   # Start of a line that continues in the next block
+    while True:
+        with stage(name):
+            block = file.read(READ_BLOCK_CHARS)
+        if not block:
+            break
+        text = rest + block
+        end = text.rfind("\n") + 1
+        rest = text[end:]
+        yield from io.StringIO(text[:end])
+    if rest:
+        yield rest
+
+
+def sample_metric_costs(file_path, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    Times every row metric of the metric registry on its own over the first rows of a file
+    and returns metric name -> seconds per row, after taking off the cost of an empty loop.
+    - The metrics run in the fused evaluator, so these are fused-engine estimates
+    - ADD_ROW_COST is the whole TrafficAggregate.add_row of the rows engine on the same rows
+    """
+
+    from aggregate import TrafficAggregate
+    from compressed import open_csv
+    from metric_registry import REGISTRY, get_evaluator
+    from validation import DataQuality, ValidatedReader
+
+    with open_csv(file_path) as file:
+        rows = list(islice(ValidatedReader(file, DataQuality(file_path)).dicts(), sample_rows))
+    if not rows:
+        return {}
+
+    def fastest(loop):
+        timings = []
+        for _ in range(SAMPLE_REPEATS):
+            start = time.perf_counter()
+            loop(rows)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def add_rows_loop(rows):
+        add_row = TrafficAggregate().add_row
+        for row in rows:
+            add_row(row)
+
+    baseline = fastest(get_evaluator(()).loop)
+    costs = {name: max(fastest(get_evaluator((name,)).loop) - baseline, 0.0) / len(rows)
+             for name, metric in REGISTRY.items() if not metric.derived}
+    costs[ADD_ROW_COST] = fastest(add_rows_loop) / len(rows)
+    return costs
+
+
+def record_metric_costs(file_path):
+    """
+    Samples the per metric costs of a file into the active profile, if profiling is on and sampling is wanted.
+    """
+
+    if ACTIVE is not None and ACTIVE.sample_metrics:
+        with ACTIVE.stage(SAMPLING_STAGE):
+            for name, cost in sample_metric_costs(file_path).items():
+                ACTIVE.metric_costs.setdefault(name, []).append(cost)
+
+
+@contextmanager
+def profile_day(label, output_dir=None):
+    """
+    Runs cProfile around the with block and saves the result as output_dir/profile_<label>.prof.
+    Does nothing if output_dir is None.
+    """
+
+    if output_dir is None:
+        yield
+        return
+    import cProfile
+
+    os.makedirs(output_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(output_dir, f"profile_{label}.prof"))
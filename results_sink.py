@@ -0,0 +1,213 @@
+"""
+Results sinks: where the outcomes of each processed day are saved.
+
+A sink turns the outcomes of one day into a block of text in its format and
+keeps the blocks in a buffer. Buffered blocks are written to the end of the
+file with a single append while the file is locked, so:
+- a batch run opens the file once per flush instead of once per line
+- the block of a day is never split, even when several processes append to the same file
+
+Formats:
+- text   the human readable outcome lines (results.txt), as before
+- jsonl  one JSON object per day with every outcome value and a list of per junction outcomes
+- csv    one row per day with a fixed column for every outcome value
+
+A sink whose path is "-" writes to standard output instead of a file.
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
+
+try:
+    import fcntl
+except ImportError:   # Not available on Windows, where appends are not locked
+    fcntl = None
+
+from aggregate import JunctionTable
+from metric_registry import REGISTRY, junction_records, outcome_values
+from speed_stats import SpeedStats
+
+# Separator written after the outcome lines of each day in the text format
+SEPARATOR = "\n***************************\n"
+
+# Blocks kept in memory before they are written
+DEFAULT_MAX_BUFFERED = 64
+
+
+def append_atomically(path, data, header=""):
+    """
+    Appends data to a file with one write while holding an exclusive lock on it.
+    header is written first if the file is empty (for example the header row of a CSV file).
+    """
+
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        if header and os.fstat(fd).st_size == 0:
+            data = header + data
+        view = memoryview(data.encode("utf-8"))
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)   # Closing the file also releases the lock
+
+
+def text_block(outcomes):
+    """
+    Returns the outcome lines of one day in the text format of results.txt.
+    """
+
+    return "".join(f"{line}\n" for line in outcomes) + SEPARATOR
+
+
+def result_record(date, file_path, values, names=None):
+    """
+    Returns the outcomes of one day as a dict: the date, the file, the value of every
+    selected outcome metric and, when they are known, the outcomes of every junction, the speed statistics
+    and the data quality summary.
+    Outcomes estimated from a sample also carry their sample size and confidence intervals.
+    """
+
+    record = {"date": date, "file_path": file_path}
+    for name, value in outcome_values(values, names).items():
+        if not isinstance(value, list):
+            record[name] = value
+    if "junction_table" in values:
+        record["junctions"] = junction_records(JunctionTable.from_dict(values["junction_table"]))
+    if "speed_stats" in values:
+        record["speeds"] = SpeedStats.from_dict(values["speed_stats"]).summaries()
+    if "data_quality" in values:
+        record["data_quality"] = values["data_quality"]
+    if "approximation" in values:
+        record["approximation"] = values["approximation"]
+    return record
+
+
+class ResultsSink(ABC):
+    # File extension of the format
+    extension = None
+
+    def __init__(self, path, max_buffered=DEFAULT_MAX_BUFFERED):
+        """
+        Creates a sink that appends to the file at path ("-" for standard output):
+        - max_buffered is the number of days kept in memory before they are written
+        """
+
+        self.path = path
+        self.max_buffered = max_buffered
+        self.buffer = []             # Formatted blocks waiting to be written
+        self.wrote_header = False    # Standard output gets the header once, before the first day
+
+    @abstractmethod
+    def format_block(self, date, file_path, outcomes, values, names):
+        """
+        Returns the text written for one day. Implemented by each format.
+        """
+
+    def header(self):
+        """
+        Returns the text written at the start of a new file (nothing by default).
+        """
+
+        return ""
+
+    def write(self, date, file_path, outcomes, values, names=None):
+        """
+        Adds the outcomes of one day to the buffer, writing the buffer when it is full:
+        - outcomes are the outcome lines, values the raw counts or metric values behind them
+        - names are the selected metric names (every metric if None)
+        """
+
+        self.buffer.append(self.format_block(date, file_path, outcomes, values, names))
+        if len(self.buffer) >= self.max_buffered:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered day to the file in one locked append.
+        """
+
+        if not self.buffer:
+            return
+        if self.path == "-":
+            sys.stdout.write(("" if self.wrote_header else self.header()) + "".join(self.buffer))
+            sys.stdout.flush()
+            self.wrote_header = True
+        else:
+            append_atomically(self.path, "".join(self.buffer), self.header())
+        self.buffer = []
+
+    def close(self):
+        """
+        Writes anything still buffered.
+        """
+
+        self.flush()
+
+
+class TextSink(ResultsSink):
+    extension = ".txt"
+
+    def format_block(self, date, file_path, outcomes, values, names):
+        return text_block(outcomes)
+
+
+class JsonLinesSink(ResultsSink):
+    extension = ".jsonl"
+
+    def format_block(self, date, file_path, outcomes, values, names):
+        return json.dumps(result_record(date, file_path, values, names)) + "\n"
+
+
+class CsvSink(ResultsSink):
+    extension = ".csv"
+
+    # One column per outcome value, so every run writes the same columns
+    columns = ["date", "file_path"] + [name for name, metric in REGISTRY.items()
+                                       if metric.line and metric.kind not in ("junction summaries", "speed summaries")]
+
+    def csv_line(self, values):
+        line = io.StringIO()
+        csv.writer(line).writerow(values)
+        return line.getvalue()
+
+    def header(self):
+        return self.csv_line(self.columns)
+
+    def format_block(self, date, file_path, outcomes, values, names):
+        record = result_record(date, file_path, values, names)
+        return self.csv_line([record.get(column, "") for column in self.columns])
+
+
+# Sink class of each format
+SINKS = {"text": TextSink, "jsonl": JsonLinesSink, "csv": CsvSink}
+
+
+def open_sinks(formats, results_file="results.txt", max_buffered=DEFAULT_MAX_BUFFERED):
+    """
+    Creates one sink per format. The text format writes to results_file and
+    the others to a file with the same name and their own extension (results.jsonl, results.csv).
+    Raises ValueError for an unknown format, or if two formats would write to the same file
+    (for example text and csv with results_file "results.csv").
+    """
+
+    stem = os.path.splitext(results_file)[0]
+    sinks = []
+    paths = {}   # Normalised path -> format writing to it
+    for name in formats:
+        if name not in SINKS:
+            raise ValueError(f"Unknown results format '{name}'. Choose from: {', '.join(SINKS)}")
+        sink_class = SINKS[name]
+        path = results_file if name == "text" else stem + sink_class.extension
+        key = os.path.normcase(os.path.abspath(path))
+        if key in paths:
+            raise ValueError(f"The {paths[key]} and {name} results would both be written to '{path}'; "
+                             f"choose a results file with another extension")
+        paths[key] = name
+        sinks.append(sink_class(path, max_buffered))
+    return sinks
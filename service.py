@@ -0,0 +1,407 @@
+"""
+Local query service that keeps recently loaded days warm.
+
+Every run of main.py starts a new process, asks for a date and reads the CSV
+file again. The service keeps running instead and answers queries over HTTP
+with JSON:
+
+    python service.py --port 8080
+    curl http://127.0.0.1:8080/days/21-06-2024
+    curl "http://127.0.0.1:8080/days?start=15-06-2024&end=21-06-2024"
+    curl http://127.0.0.1:8080/pool
+
+- A day answers with its outcome lines, its hourly histogram data and its
+  outcomes as a record (the same fields as the jsonl results sink)
+- Days are processed with main.process_day on a pool of worker processes, so
+  loading a day never blocks the other requests
+- Requests for a day that is already being loaded wait for that load instead
+  of starting another one
+- Loaded days are kept in a pool bounded by the size of their JSON answers,
+  and the least recently used days are dropped first
+- A pooled day is loaded again when the size or modification time of its
+  file changes, and a day without a file is answered 404 for MISSING_SECONDS
+  without looking for the file again
+- With --unix PATH the service listens on a Unix socket instead of a TCP port
+
+Only the standard library is used (asyncio streams and a small HTTP/1.1 reader).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from cache import AggregateCache
+from main import DEFAULT_ENGINE, ENGINES, dates_in_range, define_file_path, process_day
+from results_sink import result_record
+from validation import DEFAULT_QUARANTINE_FILE
+
+DEFAULT_POOL_MB = 256
+MAX_RANGE_DAYS = 366          # Longest date range one request may ask for
+MAX_HEADER_LINES = 100        # Header lines read before a request is refused
+MAX_BODY_BYTES = 1 << 20      # Request bodies are not used, only skipped up to this size
+MISSING_SECONDS = 5.0         # How long a day without a file is answered 404 before looking again
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        """
+        An error answered to the client with an HTTP status and a message.
+        """
+
+        super().__init__(message)
+        self.status = status
+
+
+def normalize_date(date):
+    """
+    Checks a DD-MM-YYYY date and returns it with two digit days and months.
+    Raises RequestError (400) if it is not a valid date.
+    """
+
+    try:
+        return datetime.strptime(date, "%d-%m-%Y").strftime("%d-%m-%Y")
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"'{date}' is not a valid DD-MM-YYYY date") from None
+
+
+def file_state(file_path):
+    """
+    Returns the (size, modification time) of a file, or None if it does not exist.
+    """
+
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_day(date, file_path, engine, cache_dir, quarantine_file):
+    """
+    Processes one day in a worker process and returns its JSON answer as bytes.
+    The answer is encoded in the worker, so the service only keeps and sends bytes.
+    """
+
+    outcomes, _, hourly_data, metrics, _, _ = process_day(file_path, engine, cache_dir,
+                                                       quarantine_file=quarantine_file)
+    answer = {
+        "date": date,
+        "file_path": file_path,
+        "outcomes": [line.strip() for line in outcomes if line.strip()],
+        "hourly_data": hourly_data,
+        "results": result_record(date, file_path, metrics),
+    }
+    return json.dumps(answer).encode()
+
+
+class DayPool:
+    def __init__(self, executor, engine=DEFAULT_ENGINE, cache_dir=None, data_dir="",
+                 max_bytes=DEFAULT_POOL_MB << 20, quarantine_file=DEFAULT_QUARANTINE_FILE):
+        """
+        Creates an empty pool of loaded days:
+        - executor runs load_day (a ProcessPoolExecutor, so loads use every CPU)
+        - engine and cache_dir are passed to process_day
+        - data_dir is the folder of the traffic_dataDDMMYYYY.csv files
+        - max_bytes bounds the size of the JSON answers kept in the pool
+        - quarantine_file is where bad rows of the loaded files are written
+        """
+
+        self.executor = executor
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.data_dir = data_dir
+        self.max_bytes = max_bytes
+        self.quarantine_file = quarantine_file
+        self.days = OrderedDict()     # Date -> (file path, file state, JSON answer), least recently used first
+        self.size = 0                 # Bytes of the answers in self.days
+        self.loading = {}             # Date -> future of the load in progress
+        self.missing = OrderedDict()  # Date without a file -> time.monotonic() of the lookup, oldest first
+        self.hits = 0
+        self.loads = 0
+
+    async def get(self, date):
+        """
+        Returns the JSON answer of a day, loading it if it is not in the pool
+        or if its file changed since it was loaded.
+        Concurrent requests for the same day share one load.
+        Raises RequestError (404) if the day has no file.
+        """
+
+        pooled = self.days.get(date)
+        if pooled is not None:
+            file_path, state, answer = pooled
+            if file_state(file_path) == state:
+                self.days.move_to_end(date)
+                self.hits += 1
+                return answer
+            self.drop(date)   # The file changed or went away, so the answer is stale
+        checked = self.missing.get(date)
+        if checked is not None and time.monotonic() - checked < MISSING_SECONDS:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No traffic data file for {date}")
+        future = self.loading.get(date)
+        if future is None:
+            future = self.loading[date] = asyncio.ensure_future(self.load(date))
+            future.add_done_callback(lambda done: self.finish_load(date, done))
+        # A request that is cancelled (its client went away) must not cancel the load the others wait for
+        return await asyncio.shield(future)
+
+    def finish_load(self, date, future):
+        del self.loading[date]
+        if not future.cancelled():
+            future.exception()   # Marks the error as seen even if every waiting request has gone
+
+    async def load(self, date):
+        file_path = define_file_path(date, self.data_dir)
+        # The state is taken before loading, so a change made during the load is seen by the next request
+        state = file_state(file_path)
+        if state is None:
+            raise self.not_found(date)
+        self.missing.pop(date, None)
+        loop = asyncio.get_running_loop()
+        self.loads += 1
+        try:
+            answer = await loop.run_in_executor(self.executor, load_day, date, file_path,
+                                                self.engine, self.cache_dir, self.quarantine_file)
+        except FileNotFoundError:
+            raise self.not_found(date) from None
+        self.keep(date, file_path, state, answer)
+        return answer
+
+    def not_found(self, date):
+        """
+        Notes that a day has no file, forgets the lookups older than MISSING_SECONDS
+        and returns the RequestError (404) to raise.
+        """
+
+        now = time.monotonic()
+        self.missing.pop(date, None)
+        while self.missing and now - next(iter(self.missing.values())) >= MISSING_SECONDS:
+            self.missing.popitem(last=False)
+        self.missing[date] = now
+        return RequestError(HTTPStatus.NOT_FOUND, f"No traffic data file for {date}")
+
+    def keep(self, date, file_path, state, answer):
+        """
+        Adds an answer and the state of its file to the pool, dropping the least recently used days until it fits.
+        An answer larger than the whole pool is not kept.
+        """
+
+        if date in self.days:
+            self.drop(date)
+        if len(answer) > self.max_bytes:
+            return
+        self.days[date] = (file_path, state, answer)
+        self.size += len(answer)
+        while self.size > self.max_bytes:
+            self.drop(next(iter(self.days)))
+
+    def drop(self, date):
+        """
+        Removes a day from the pool.
+        """
+
+        _, _, answer = self.days.pop(date)
+        self.size -= len(answer)
+
+    async def get_range(self, start, end):
+        """
+        Returns the JSON answer of a date range: {"days": [...]} with the answer of every day,
+        or {"date": ..., "error": ...} for a day that has no file. Days load concurrently.
+        """
+
+        dates = dates_in_range(start, end)
+        if not dates:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "The start date is after the end date")
+        if len(dates) > MAX_RANGE_DAYS:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"A date range may have at most {MAX_RANGE_DAYS} days")
+        answers = await asyncio.gather(*(self.get(date) for date in dates), return_exceptions=True)
+        parts = []
+        for date, answer in zip(dates, answers):
+            if isinstance(answer, RequestError) and answer.status == HTTPStatus.NOT_FOUND:
+                answer = json.dumps({"date": date, "error": str(answer)}).encode()
+            elif isinstance(answer, BaseException):
+                raise answer
+            parts.append(answer)
+        # The cached answers are joined as they are instead of being decoded and encoded again
+        return b'{"days":[' + b",".join(parts) + b"]}"
+
+    def stats(self):
+        return {
+            "days": list(self.days),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "loading": list(self.loading),
+            "missing": list(self.missing),
+            "hits": self.hits,
+            "loads": self.loads,
+        }
+
+
+class TrafficService:
+    def __init__(self, pool):
+        """
+        Answers HTTP requests from the days in a DayPool.
+        """
+
+        self.pool = pool
+
+    async def answer(self, method, target):
+        """
+        Returns the JSON answer of one request as bytes.
+        Raises RequestError for requests that cannot be answered.
+        """
+
+        if method != "GET":
+            raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, "Only GET requests are answered")
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/")
+        query = parse_qs(url.query)
+
+        if path == "/pool":
+            return json.dumps(self.pool.stats()).encode()
+        if path.startswith("/days/"):
+            return await self.pool.get(normalize_date(path[len("/days/"):]))
+        if path == "/days":
+            if "start" not in query:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Give a date range as ?start=DD-MM-YYYY&end=DD-MM-YYYY")
+            start = normalize_date(query["start"][0])
+            end = normalize_date(query["end"][0]) if "end" in query else start
+            return await self.pool.get_range(start, end)
+        raise RequestError(HTTPStatus.NOT_FOUND, f"Unknown path '{path}', use /days/DD-MM-YYYY, /days or /pool")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers the requests of one connection, keeping it open between requests (HTTP/1.1 keep-alive).
+        """
+
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except RequestError as error:
+                    writer.write(response(error.status, error_body(error), keep_alive=False))
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive = request
+                try:
+                    status, body = HTTPStatus.OK, await self.answer(method, target)
+                except RequestError as error:
+                    status, body = error.status, error_body(error)
+                except Exception as error:
+                    # A file that cannot be processed (for example a missing column) fails only its request
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, error_body(error)
+                writer.write(response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """
+    Reads one request and returns (method, target, keep alive), or None when the client closed the connection.
+    Raises RequestError (400) for a malformed request.
+    """
+
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    method, target, version = parts
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Too many header lines")
+
+    # Skip a request body so the next request on the connection starts in the right place
+    length = headers.get("content-length", "0")
+    if not length.isdigit() or int(length) > MAX_BODY_BYTES:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Bad or too large Content-Length")
+    if int(length):
+        await reader.readexactly(int(length))
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    return method, target, keep_alive
+
+
+def error_body(error):
+    return json.dumps({"error": str(error)}).encode()
+
+
+def response(status, body, keep_alive=True):
+    """
+    Returns the bytes of an HTTP response with a JSON body.
+    """
+
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def serve(pool, host="127.0.0.1", port=8080, unix_path=None):
+    """
+    Runs the service until it is stopped.
+    """
+
+    service = TrafficService(pool)
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle_connection, unix_path)
+        print(f"Serving traffic data on {unix_path}")
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving traffic data on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+# Run the service from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve traffic survey outcomes as JSON over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--unix", metavar="PATH", help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--data-dir", default="", metavar="DIR",
+                        help="folder of the traffic_dataDDMMYYYY.csv files (default: the current folder)")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="how the CSV files are processed (default: auto)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes that load days (default: one per CPU)")
+    parser.add_argument("--pool-mb", type=float, default=DEFAULT_POOL_MB,
+                        help=f"memory kept for loaded days in MB (default: {DEFAULT_POOL_MB})")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the on-disk aggregate cache")
+    parser.add_argument("--quarantine-file", metavar="PATH", default=DEFAULT_QUARANTINE_FILE,
+                        help="CSV file that bad rows are appended to (default: quarantine.csv)")
+    args = parser.parse_args()
+    if args.pool_mb <= 0:
+        parser.error("--pool-mb must be more than 0")
+
+    cache_dir = None if args.no_cache else AggregateCache().cache_dir
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        pool = DayPool(executor, args.engine, cache_dir, args.data_dir, int(args.pool_mb * (1 << 20)),
+                       args.quarantine_file)
+        try:
+            asyncio.run(serve(pool, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            print("Service stopped")
@@ -0,0 +1,226 @@
+"""
+Speed distribution statistics of the traffic survey files.
+
+Speeds are whole numbers and validation keeps them between 0 and 200, so the
+number of vehicles at each speed is a quantile sketch with no error:
+- It holds at most 201 counts, however many rows are read
+- Two sketches merge by adding their counts (chunks of a file, days of a range)
+- The mean and any percentile are read off the counts in one walk
+A t-digest or KLL sketch would need about the same memory and only add error.
+
+SpeedStats keeps one sketch per junction, per hour and per vehicle type, and
+one of how far over the limit the speeding vehicles went. It is updated in
+the same pass over the rows as the other counts. To keep that pass fast, a
+row only adds one to the count of its speed in the cell of its (junction,
+hour, vehicle type); the cells are folded into the sketches when they are
+read or merged. The number of cells depends on the junctions, hours and
+vehicle types in the file, not on the number of rows.
+"""
+
+# Percentiles shown for every sketch
+PERCENTILES = (50, 85, 95, 99)
+
+# Groups of a SpeedStats, as they are named in its dict form
+DIMENSIONS = ("junctions", "hours", "vehicle_types")
+
+
+class SpeedSketch:
+    def __init__(self, counts=None):
+        """
+        Starts a sketch from a dict of speed -> vehicles (empty if None).
+        """
+
+        self.counts = dict(counts or {})
+
+    def add(self, speed, vehicles=1):
+        self.counts[speed] = self.counts.get(speed, 0) + vehicles
+
+    def merge(self, other, scale=1):
+        """
+        Adds the counts of another sketch (multiplied by scale) to this one and returns this sketch.
+        """
+
+        for speed, vehicles in other.counts.items():
+            self.counts[speed] = self.counts.get(speed, 0) + vehicles * scale
+        return self
+
+    @property
+    def vehicles(self):
+        return sum(self.counts.values())
+
+    def mean(self):
+        vehicles = self.vehicles
+        return sum(speed * count for speed, count in self.counts.items()) / vehicles if vehicles else 0.0
+
+    def percentile(self, percent):
+        """
+        Returns the smallest speed that at least percent% of the vehicles do not exceed (0 if empty).
+        """
+
+        needed = self.vehicles * percent / 100
+        running = 0
+        for speed in sorted(self.counts):
+            running += self.counts[speed]
+            if running >= needed and running:
+                return speed
+        return 0
+
+    def summary(self):
+        """
+        Returns the vehicles, mean, percentiles and highest speed of the sketch as a plain dict.
+        """
+
+        summary = {"vehicles": round(self.vehicles), "mean": round(self.mean(), 1)}
+        summary.update((f"p{percent}", self.percentile(percent)) for percent in PERCENTILES)
+        summary["max"] = max(self.counts, default=0)
+        return summary
+
+    def to_pairs(self):
+        return [[speed, self.counts[speed]] for speed in sorted(self.counts)]
+
+
+class SpeedStats:
+    def __init__(self):
+        """
+        Starts empty speed sketches. Groups are kept in the order they first appear.
+        """
+
+        self.cells = {}            # (junction, hour, vehicle type) -> {speed: vehicles} not folded in yet
+        self.junctions = {}        # Junction -> {speed: vehicles}
+        self.hours = {}            # Hour ("HH") -> {speed: vehicles}
+        self.vehicle_types = {}    # Vehicle type -> {speed: vehicles}
+        self.over_limit = {}       # Speed over the limit -> speeding vehicles
+
+    def add(self, junction, hour, vehicle_type, speed, limit):
+        """
+        Adds the speed of one vehicle.
+        """
+
+        counts = self.cells.get((junction, hour, vehicle_type))
+        if counts is None:
+            counts = self.cells[junction, hour, vehicle_type] = {}
+        counts[speed] = counts.get(speed, 0) + 1
+        if speed > limit:
+            self.over_limit[speed - limit] = self.over_limit.get(speed - limit, 0) + 1
+
+    def fold(self):
+        """
+        Adds the counted cells to the sketches. Cells are in order of first appearance, so the groups are too.
+        """
+
+        for (junction, hour, vehicle_type), cell in self.cells.items():
+            for sketches, group in ((self.junctions, junction), (self.hours, hour),
+                                    (self.vehicle_types, vehicle_type)):
+                counts = sketches.get(group)
+                if counts is None:
+                    counts = sketches[group] = {}
+                for speed, vehicles in cell.items():
+                    counts[speed] = counts.get(speed, 0) + vehicles
+        self.cells = {}
+
+    def add_counts(self, dimension, group, pairs, scale=1):
+        """
+        Adds (speed, vehicles) pairs to the sketch of one group of a dimension ("junctions", "hours",
+        "vehicle_types", or "over_limit" with group None), multiplying the vehicles by scale.
+        """
+
+        self.fold()
+        if dimension == "over_limit":
+            counts = self.over_limit
+        else:
+            counts = getattr(self, dimension).setdefault(group, {})
+        for speed, vehicles in pairs:
+            counts[speed] = counts.get(speed, 0) + vehicles * scale
+
+    def merge(self, other, scale=1):
+        """
+        Adds the sketches of another SpeedStats (their counts multiplied by scale) and returns this one.
+        """
+
+        other.fold()
+        for dimension in DIMENSIONS:
+            for group, counts in getattr(other, dimension).items():
+                self.add_counts(dimension, group, counts.items(), scale)
+        self.add_counts("over_limit", None, other.over_limit.items(), scale)
+        return self
+
+    def sketches(self, dimension):
+        """
+        Returns group -> SpeedSketch for one dimension.
+        """
+
+        self.fold()
+        return {group: SpeedSketch(counts) for group, counts in getattr(self, dimension).items()}
+
+    def overall(self):
+        """
+        Returns the sketch of every vehicle (the junction sketches added up).
+        """
+
+        self.fold()
+        sketch = SpeedSketch()
+        for counts in self.junctions.values():
+            sketch.merge(SpeedSketch(counts))
+        return sketch
+
+    def summaries(self):
+        """
+        Returns the summary (see SpeedSketch.summary) of every sketch as a plain dict,
+        with the groups of each dimension sorted by name (hours in hour order).
+        """
+
+        summaries = {"all": self.overall().summary()}
+        for dimension in DIMENSIONS:
+            summaries[dimension] = {group: sketch.summary()
+                                    for group, sketch in sorted(self.sketches(dimension).items())}
+        summaries["over_limit"] = SpeedSketch(self.over_limit).summary()
+        return summaries
+
+    def to_dict(self):
+        """
+        Returns the sketches as plain lists of [speed, vehicles] pairs, so they can be saved as JSON.
+        """
+
+        self.fold()
+        data = {dimension: {group: SpeedSketch(counts).to_pairs() for group, counts in getattr(self, dimension).items()}
+                for dimension in DIMENSIONS}
+        data["over_limit"] = SpeedSketch(self.over_limit).to_pairs()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds the sketches from the output of to_dict.
+        """
+
+        stats = cls()
+        for dimension in DIMENSIONS:
+            for group, pairs in data.get(dimension, {}).items():
+                stats.add_counts(dimension, group, pairs)
+        stats.add_counts("over_limit", None, data.get("over_limit", []))
+        return stats
+
+
+def summary_text(summary):
+    """
+    Returns the mean and percentiles of a sketch summary as text.
+    """
+
+    percentiles = ", ".join(f"{percent}th percentile {summary[f'p{percent}']}" for percent in PERCENTILES[1:])
+    return f"mean {summary['mean']}, median {summary['p50']}, {percentiles}"
+
+
+def speed_lines(stats):
+    """
+    Returns the compact outcome lines of the speed statistics: all vehicles, speeding vehicles,
+    then every junction (sorted by name). The per hour and per vehicle type statistics are left
+    to results.jsonl and the summary store, so they do not swamp the outcomes.
+    """
+
+    summaries = stats.summaries()
+    lines = [f"Speed of all vehicles: {summary_text(summaries['all'])}"]
+    over = summaries["over_limit"]
+    if over["vehicles"]:
+        lines.append(f"Vehicles over the speed limit went over it by {summary_text(over)}, most {over['max']}")
+    lines.extend(f"Speed at {junction}: {summary_text(summary)}" for junction, summary in summaries["junctions"].items())
+    return lines
@@ -0,0 +1,431 @@
+"""
+Persisted daily summary store.
+
+Every processed day is written to a SQLite database as structured rows
+instead of free text:
+- days:           one row per day with every raw count of the outcomes
+- junction_days:  one row per day and junction with its vehicles, scooters and counters
+- junction_hours: one row per day, junction and hour with its vehicles and counters
+- day_hours:      one row per day and hour with the vehicles and counters of all junctions
+- speed_counts:   one row per day, speed sketch and speed with its vehicles
+The counters are the plain counts of the outcomes (trucks, electric vehicles,
+...; see aggregate.JUNCTION_COUNTERS), so every count can be rolled up and
+its peak hours compared for one junction as well as for all of them.
+
+Week and month rollups, day over day changes, peak hour comparisons and
+speed percentiles over any range of days are then answered with SQL over
+these tables, without opening any CSV file. A database written with another
+SCHEMA_VERSION is emptied and rebuilt as days are processed again (it only
+holds counts that can be worked out from the CSV files).
+Dates are given and shown in DD-MM-YYYY format like the rest of the program
+and stored as YYYY-MM-DD so they sort and compare as text:
+
+    python summary_store.py rollup month --start 01-01-2024 --end 31-12-2024
+    python summary_store.py deltas total_trucks --start 01-06-2024 --end 30-06-2024
+    python summary_store.py peaks --junction "Hanley Highway/Westway" --metric total_trucks
+    python summary_store.py compare 01-06-2024 15-06-2024 16-06-2024 30-06-2024
+    python summary_store.py speeds --by junctions --start 01-06-2024 --end 30-06-2024
+"""
+
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+
+from aggregate import COUNTERS, JUNCTION_COUNTERS, JunctionTable
+from cache import user_cache_dir
+from speed_stats import DIMENSIONS, SpeedSketch
+
+# Default database file, in the user's cache folder next to the aggregate cache
+DEFAULT_DB_PATH = os.path.join(user_cache_dir(), "traffic_summary.db")
+
+# Raw counts kept for every day, one column each
+DAY_COUNTS = COUNTERS + ("rain_hours",)
+
+# Counts kept for every hour and junction: the vehicles, then the counters of those vehicles
+HOUR_COUNTS = ("vehicles",) + JUNCTION_COUNTERS
+
+# Layout of the tables, kept in the database's user_version
+SCHEMA_VERSION = 2
+
+# strftime formats of the rollup periods
+PERIODS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+# Tables of the store, in the order they are created
+TABLES = ("days", "junction_days", "junction_hours", "day_hours", "speed_counts")
+
+COUNTER_COLUMNS = ", ".join(f"{name} INTEGER NOT NULL" for name in JUNCTION_COUNTERS)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    {", ".join(f"{name} INTEGER NOT NULL" for name in DAY_COUNTS)}
+);
+CREATE TABLE IF NOT EXISTS junction_days (
+    day TEXT NOT NULL,
+    junction TEXT NOT NULL,
+    vehicles INTEGER NOT NULL,
+    scooters INTEGER NOT NULL,
+    {COUNTER_COLUMNS},
+    PRIMARY KEY (day, junction)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS junction_hours (
+    day TEXT NOT NULL,
+    junction TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    vehicles INTEGER NOT NULL,
+    {COUNTER_COLUMNS},
+    PRIMARY KEY (day, junction, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS day_hours (
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    vehicles INTEGER NOT NULL,
+    {COUNTER_COLUMNS},
+    PRIMARY KEY (day, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS speed_counts (
+    day TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    name TEXT NOT NULL,
+    speed INTEGER NOT NULL,
+    vehicles INTEGER NOT NULL,
+    PRIMARY KEY (day, dimension, name, speed)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS junction_hours_by_junction ON junction_hours (junction, day);
+CREATE INDEX IF NOT EXISTS junction_days_by_junction ON junction_days (junction, day);
+"""
+
+
+def iso_date(date):
+    """
+    Turns a DD-MM-YYYY date into YYYY-MM-DD. Raises ValueError for anything else.
+    """
+
+    return datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d")
+
+
+def display_date(day):
+    """
+    Turns a stored YYYY-MM-DD day back into DD-MM-YYYY.
+    """
+
+    return datetime.strptime(day, "%Y-%m-%d").strftime("%d-%m-%Y")
+
+
+class SummaryStore:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        """
+        Opens (and creates if needed) the summary database at path.
+        """
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        # Tables of another layout are dropped, the days are stored again when they are processed
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self.connection:
+                for name in TABLES:
+                    self.connection.execute(f"DROP TABLE IF EXISTS {name}")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+
+        self.connection.close()
+
+    def record_day(self, date, file_path, metrics):
+        """
+        Stores the raw counts of one processed day (DD-MM-YYYY), replacing anything stored for it before.
+        metrics is the raw counts dict of compute_csv_metrics. Returns False if date is not a valid date.
+        """
+
+        try:
+            day = iso_date(date)
+        except ValueError:
+            return False
+        table = JunctionTable.from_dict(metrics["junction_table"])
+
+        # Vehicles and counters (HOUR_COUNTS) per junction and hour, summed per junction and per hour
+        junction_hours = []
+        junction_days = {junction: [0] * len(HOUR_COUNTS) for junction in table.junctions}
+        day_hours = {}
+        for hour, hour_counts, hour_counters in zip(table.hours, table.counts, table.counters):
+            for junction, vehicles, counters in zip(table.junctions, hour_counts, hour_counters):
+                if vehicles:
+                    counts = (vehicles, *counters)
+                    junction_hours.append((day, junction, int(hour), *counts))
+                    for totals in (junction_days[junction], day_hours.setdefault(int(hour), [0] * len(HOUR_COUNTS))):
+                        for index, count in enumerate(counts):
+                            totals[index] += count
+
+        # Vehicles per speed of every speed sketch (junction, hour, vehicle type and over the limit)
+        speed_counts = []
+        speed_stats = metrics.get("speed_stats", {})
+        for dimension in DIMENSIONS:
+            for name, pairs in speed_stats.get(dimension, {}).items():
+                speed_counts.extend((day, dimension, name, speed, vehicles) for speed, vehicles in pairs)
+        speed_counts.extend((day, "over_limit", "", speed, vehicles)
+                            for speed, vehicles in speed_stats.get("over_limit", []))
+
+        # Replace the whole day in one transaction, so a day is never half stored
+        with self.connection:
+            for name in TABLES:
+                self.connection.execute(f"DELETE FROM {name} WHERE day = ?", (day,))
+            self.connection.execute(
+                f"INSERT INTO days (day, file_path, {', '.join(DAY_COUNTS)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(DAY_COUNTS))})",
+                (day, file_path, *(metrics[name] for name in DAY_COUNTS)))
+            columns = ", ".join(HOUR_COUNTS)
+            marks = ", ".join("?" * len(HOUR_COUNTS))
+            self.connection.executemany(
+                f"INSERT INTO junction_days (day, junction, scooters, {columns}) VALUES (?, ?, ?, {marks})",
+                [(day, junction, table.scooter_count(junction), *counts)
+                 for junction, counts in junction_days.items()])
+            self.connection.executemany(
+                f"INSERT INTO junction_hours (day, junction, hour, {columns}) VALUES (?, ?, ?, {marks})",
+                junction_hours)
+            self.connection.executemany(f"INSERT INTO day_hours (day, hour, {columns}) VALUES (?, ?, {marks})",
+                                        [(day, hour, *counts) for hour, counts in day_hours.items()])
+            self.connection.executemany("INSERT INTO speed_counts VALUES (?, ?, ?, ?, ?)", speed_counts)
+        return True
+
+    def date_filter(self, start=None, end=None, junction=None):
+        """
+        Returns the WHERE clause and parameters for an optional date range (DD-MM-YYYY) and junction.
+        """
+
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("day >= ?")
+            parameters.append(iso_date(start))
+        if end is not None:
+            conditions.append("day <= ?")
+            parameters.append(iso_date(end))
+        if junction is not None:
+            conditions.append("junction = ?")
+            parameters.append(junction)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+    def days(self, start=None, end=None):
+        """
+        Returns the stored days in a date range, in date order, each as a dict of its raw counts.
+        """
+
+        where, parameters = self.date_filter(start, end)
+        rows = self.connection.execute(f"SELECT * FROM days{where} ORDER BY day", parameters)
+        return [dict(row, day=display_date(row["day"])) for row in rows]
+
+    def rollup(self, period="week", start=None, end=None):
+        """
+        Sums the raw counts per week, month, year (or day) over a date range.
+        Returns one dict per period in date order, with the number of days stored for that period.
+        rain_hours is summed too, so it is the number of rainy hours in the period.
+        """
+
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}'. Choose one of: {', '.join(PERIODS)}")
+        where, parameters = self.date_filter(start, end)
+        sums = ", ".join(f"SUM({name}) AS {name}" for name in DAY_COUNTS)
+        rows = self.connection.execute(
+            f"SELECT strftime('{PERIODS[period]}', day) AS period, COUNT(*) AS days, {sums} "
+            f"FROM days{where} GROUP BY period ORDER BY period", parameters)
+        return [dict(row) for row in rows]
+
+    def junction_rollup(self, period="week", start=None, end=None, junction=None):
+        """
+        Sums the vehicles, scooters and counters of every junction (or one junction) per period over a date range.
+        """
+
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}'. Choose one of: {', '.join(PERIODS)}")
+        where, parameters = self.date_filter(start, end, junction)
+        sums = ", ".join(f"SUM({name}) AS {name}" for name in ("vehicles", "scooters") + JUNCTION_COUNTERS)
+        rows = self.connection.execute(
+            f"SELECT strftime('{PERIODS[period]}', day) AS period, junction, COUNT(*) AS days, {sums} "
+            f"FROM junction_days{where} GROUP BY period, junction ORDER BY period, vehicles DESC", parameters)
+        return [dict(row) for row in rows]
+
+    def check_hour_count(self, metric):
+        """
+        Raises ValueError if metric is not one of the counts kept per hour (HOUR_COUNTS).
+        """
+
+        if metric not in HOUR_COUNTS:
+            raise ValueError(f"Unknown hourly count '{metric}'. Choose one of: {', '.join(HOUR_COUNTS)}")
+
+    def day_over_day(self, metric="total_vehicles", start=None, end=None):
+        """
+        Returns one metric for every stored day in a date range with its change from the stored day before.
+        The first day has no change (None).
+        """
+
+        if metric not in DAY_COUNTS:
+            raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(DAY_COUNTS)}")
+        where, parameters = self.date_filter(start, end)
+        rows = self.connection.execute(
+            f"SELECT day, {metric} AS value, {metric} - LAG({metric}) OVER (ORDER BY day) AS delta "
+            f"FROM days{where} ORDER BY day", parameters)
+        return [{"day": display_date(row["day"]), "value": row["value"], "delta": row["delta"]} for row in rows]
+
+    def peak_hours(self, start=None, end=None, junction=None, metric="vehicles"):
+        """
+        Returns the busiest hour(s) of every stored day in a date range, at one junction
+        or at all junctions together. Tied hours are all listed, earliest first.
+        metric is the count that makes an hour busy: the vehicles or one of the counters (HOUR_COUNTS);
+        each day's peak count is under "vehicles" whatever the metric.
+        """
+
+        self.check_hour_count(metric)
+        table = "day_hours" if junction is None else "junction_hours"
+        where, parameters = self.date_filter(start, end, junction)
+        rows = self.connection.execute(
+            f"SELECT day, hour, vehicles FROM ("
+            f"SELECT day, hour, {metric} AS vehicles, RANK() OVER (PARTITION BY day ORDER BY {metric} DESC) AS peak "
+            f"FROM {table}{where}) WHERE peak = 1 ORDER BY day, hour", parameters)
+        peaks = {}
+        for row in rows:
+            peak = peaks.setdefault(row["day"], {"day": display_date(row["day"]), "hours": [],
+                                                 "vehicles": row["vehicles"]})
+            peak["hours"].append(row["hour"])
+        return list(peaks.values())
+
+    def hourly_profile(self, start=None, end=None, junction=None, metric="vehicles"):
+        """
+        Returns the average of one count (see peak_hours) per day for each hour over a date range,
+        at one junction or at all junctions. Days in the range with no vehicles in an hour count as zero.
+        """
+
+        self.check_hour_count(metric)
+        where, parameters = self.date_filter(start, end)
+        days = self.connection.execute(f"SELECT COUNT(*) FROM days{where}", parameters).fetchone()[0]
+        table = "day_hours" if junction is None else "junction_hours"
+        where, parameters = self.date_filter(start, end, junction)
+        rows = self.connection.execute(
+            f"SELECT hour, SUM({metric}) AS vehicles FROM {table}{where} GROUP BY hour ORDER BY hour", parameters)
+        return {row["hour"]: row["vehicles"] / days for row in rows} if days else {}
+
+    def compare_peak_hours(self, first_range, second_range, junction=None, metric="vehicles"):
+        """
+        Compares the average hourly profile of one count (see peak_hours) over two date ranges,
+        each given as (start, end): returns the peak hour and its average per day for both ranges,
+        and the change in the average of every hour from the first range to the second.
+        """
+
+        profiles = [self.hourly_profile(start, end, junction, metric) for start, end in (first_range, second_range)]
+        comparison = {"ranges": []}
+        for (start, end), profile in zip((first_range, second_range), profiles):
+            peak_hour = max(profile, key=profile.get) if profile else None
+            comparison["ranges"].append({"start": start, "end": end, "peak_hour": peak_hour,
+                                         "peak_average": profile.get(peak_hour, 0)})
+        first, second = profiles
+        comparison["hourly_change"] = {hour: second.get(hour, 0) - first.get(hour, 0)
+                                       for hour in sorted(set(first) | set(second))}
+        return comparison
+
+    def speed_summaries(self, dimension="all", start=None, end=None):
+        """
+        Merges the speed sketches of the stored days in a date range and returns name -> summary
+        (see speed_stats.SpeedSketch.summary) for every junction, hour or vehicle type (dimension "junctions",
+        "hours" or "vehicle_types"), or for all vehicles or the speeding vehicles ("all" or "over_limit", name "").
+        """
+
+        if dimension not in ("all", "over_limit") + DIMENSIONS:
+            raise ValueError(f"Unknown speed dimension '{dimension}'")
+        where, parameters = self.date_filter(start, end)
+        where += (" AND " if where else " WHERE ") + "dimension = ?"
+        parameters.append("junctions" if dimension == "all" else dimension)
+        rows = self.connection.execute(
+            f"SELECT name, speed, SUM(vehicles) AS vehicles FROM speed_counts{where} "
+            f"GROUP BY name, speed ORDER BY name, speed", parameters)
+        sketches = {}
+        for row in rows:
+            name = "" if dimension == "all" else row["name"]
+            sketches.setdefault(name, SpeedSketch()).add(row["speed"], row["vehicles"])
+        return {name: sketch.summary() for name, sketch in sketches.items()}
+
+
+def print_table(rows):
+    """
+    Prints a list of dicts as aligned columns.
+    """
+
+    if not rows:
+        print("No stored days match.")
+        return
+    columns = list(rows[0])
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+# Query the store from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the daily traffic summary store")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="summary database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollup_parser = commands.add_parser("rollup", help="sum the counts per week, month or year")
+    rollup_parser.add_argument("period", choices=PERIODS)
+    rollup_parser.add_argument("--junctions", action="store_true", help="sum per junction instead")
+
+    deltas_parser = commands.add_parser("deltas", help="day over day change of one count")
+    deltas_parser.add_argument("metric", choices=DAY_COUNTS)
+
+    peaks_parser = commands.add_parser("peaks", help="busiest hour of every day")
+
+    compare_parser = commands.add_parser("compare", help="compare the peak hours of two date ranges")
+    compare_parser.add_argument("dates", nargs=4, metavar="DD-MM-YYYY",
+                                help="start and end of the first range, then of the second range")
+
+    speeds_parser = commands.add_parser("speeds", help="speed percentiles over a date range")
+    speeds_parser.add_argument("--by", choices=("all", "over_limit") + DIMENSIONS, default="all",
+                               help="one line per junction, hour or vehicle type, or all vehicles "
+                                    "or how far speeding vehicles went over the limit")
+
+    for command in (rollup_parser, deltas_parser, peaks_parser, speeds_parser):
+        command.add_argument("--start", metavar="DD-MM-YYYY", help="first day (default: the first stored day)")
+        command.add_argument("--end", metavar="DD-MM-YYYY", help="last day (default: the last stored day)")
+    for command in (rollup_parser, peaks_parser, compare_parser):
+        command.add_argument("--junction", help="only this junction")
+    for command in (peaks_parser, compare_parser):
+        command.add_argument("--metric", choices=HOUR_COUNTS, default="vehicles",
+                             help="count whose busiest hour is the peak (default: vehicles)")
+    args = parser.parse_args()
+
+    store = SummaryStore(args.db)
+    if args.command == "rollup" and (args.junctions or args.junction):
+        print_table(store.junction_rollup(args.period, args.start, args.end, args.junction))
+    elif args.command == "rollup":
+        print_table(store.rollup(args.period, args.start, args.end))
+    elif args.command == "deltas":
+        print_table(store.day_over_day(args.metric, args.start, args.end))
+    elif args.command == "speeds":
+        print_table([{"group": name or args.by, **summary}
+                     for name, summary in store.speed_summaries(args.by, args.start, args.end).items()])
+    elif args.command == "peaks":
+        print_table([{"day": peak["day"], "hours": ", ".join(f"{hour:02d}:00" for hour in peak["hours"]),
+                      args.metric: peak["vehicles"]}
+                     for peak in store.peak_hours(args.start, args.end, args.junction, args.metric)])
+    else:
+        comparison = store.compare_peak_hours(args.dates[:2], args.dates[2:], args.junction, args.metric)
+        for summary in comparison["ranges"]:
+            peak = "none" if summary["peak_hour"] is None else f"{summary['peak_hour']:02d}:00"
+            print(f"{summary['start']} to {summary['end']}: peak hour {peak}, "
+                  f"{summary['peak_average']:.1f} {args.metric} per day")
+        print_table([{"hour": f"{hour:02d}:00", "change": f"{change:+.1f}"}
+                     for hour, change in comparison["hourly_change"].items()])
+    store.close()
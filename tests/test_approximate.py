@@ -0,0 +1,90 @@
+"""
+Sampled outcomes must come with 95% confidence intervals that hold the exact value about
+95% of the time, and files that are not worth sampling must be left to the exact engines.
+"""
+
+import gzip
+import os
+
+import pytest
+
+from approximate import SamplingPlan, line_at, round_to_total, sample_file, sample_results
+from main import compute_csv_metrics
+from metric_registry import outcome_values
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(ROOT, "traffic_data21062024.csv")
+
+# Counts whose intervals are checked, and the seeds of the samples
+CHECKED = ("total_vehicles", "total_trucks", "total_electric_vehicles", "vehicles_over_speed",
+           "vehicles_elm_rabbit", "trucks_percentage")
+SEEDS = range(40)
+
+
+@pytest.fixture(scope="module")
+def large_file(tmp_path_factory):
+    """
+    Writes a file with the rows of a sample day 40 times over (about 40,000 rows) and returns its path.
+    """
+
+    with open(SAMPLE_FILE) as file:
+        header, *rows = file.read().splitlines()
+    file_path = tmp_path_factory.mktemp("large") / "traffic_data21062024.csv"
+    file_path.write_text("\n".join([header] + rows * 40) + "\n")
+    return str(file_path)
+
+
+def test_sample_size_from_error_target():
+    assert SamplingPlan().sample_size() == 10_000
+    assert SamplingPlan(sample_rows=500).sample_size() == 500
+    assert SamplingPlan(max_error=1).sample_size() == 9604
+    assert SamplingPlan(sample_rows=2000, max_error=1).sample_size() == 2000
+    with pytest.raises(ValueError):
+        SamplingPlan(sample_rows=1)
+    with pytest.raises(ValueError):
+        SamplingPlan(max_error=0)
+
+
+def test_intervals_hold_the_exact_values(large_file, tmp_path):
+    exact = outcome_values(compute_csv_metrics(large_file, "rows", str(tmp_path / "quarantine.csv"))[1])
+    held = dict.fromkeys(CHECKED, 0)
+    for seed in SEEDS:
+        _, _, metrics = sample_results(large_file, SamplingPlan(sample_rows=1000, seed=seed))
+        intervals = metrics["approximation"]["intervals"]
+        values = outcome_values(metrics)
+        for name in CHECKED:
+            low, high = intervals[name]
+            assert low <= values[name] <= high
+            held[name] += low <= exact[name] <= high
+    # 95% intervals: allow a few misses more than the 2 expected in 40 samples
+    assert all(count >= 35 for count in held.values()), held
+
+
+def test_same_seed_gives_the_same_sample(large_file):
+    first = sample_results(large_file, SamplingPlan(sample_rows=500, seed=7))
+    assert sample_results(large_file, SamplingPlan(sample_rows=500, seed=7)) == first
+    assert first[2]["approximation"]["sample_rows"] == 500
+
+
+def test_small_and_compressed_files_are_read_in_full(large_file, tmp_path):
+    # Fewer than four rows per sampled row
+    assert sample_file(large_file, SamplingPlan(sample_rows=20_000)) is None
+    compressed_file = tmp_path / "traffic_data21062024.csv.gz"
+    with open(large_file, "rb") as file:
+        compressed_file.write_bytes(gzip.compress(file.read()))
+    assert sample_file(str(compressed_file), SamplingPlan(sample_rows=100)) is None
+
+
+def test_line_at_returns_the_whole_line(tmp_path):
+    file_path = tmp_path / "lines.csv"
+    file_path.write_bytes(b"header\nfirst\n" + b"x" * 1000 + b"\nlast")
+    with open(file_path, "rb") as file:
+        assert line_at(file, 8, 7, 1023) == (b"first\n", 6)
+        # A line longer than the window is still read whole
+        assert line_at(file, 600, 7, 1023) == (b"x" * 1000 + b"\n", 1001)
+        assert line_at(file, 1021, 7, 1023) == (b"last", 4)
+
+
+def test_round_to_total():
+    assert round_to_total([1.5, 1.5, 2.0], 5) == [2, 1, 2]
+    assert round_to_total([0.3, 0.3, 0.4], 1) == [0, 0, 1]
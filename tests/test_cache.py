@@ -0,0 +1,121 @@
+"""
+The aggregate cache must answer from memory or disk only while the file is unchanged,
+survive a touch that does not change the file, and keep the disk entries within their budget.
+"""
+
+import os
+
+import pytest
+
+from cache import AggregateCache
+
+HOURLY_DATA = {"Elm Avenue/Rabbit Road": [1] * 24}
+METRICS = {"total_vehicles": 24}
+
+
+@pytest.fixture
+def survey_file(tmp_path):
+    """
+    Writes a small survey file into a temporary folder and returns its path.
+    """
+
+    file_path = tmp_path / "traffic_data15062024.csv"
+    file_path.write_text("JunctionName,VehicleType\nElm Avenue/Rabbit Road,Car\n")
+    return str(file_path)
+
+
+def touch(file_path, seconds):
+    """
+    Moves the modification time of a file forward without changing it, and returns the new time.
+    """
+
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+    return stat.st_mtime_ns + seconds * 10**9
+
+
+def test_fresh_entry_is_found_in_memory_then_on_disk(tmp_path, survey_file):
+    cache = AggregateCache(str(tmp_path / "cache"))
+    assert cache.get(survey_file) is None
+    cache.put(survey_file, HOURLY_DATA, METRICS)
+    assert cache.get(survey_file) == (HOURLY_DATA, METRICS)
+
+    # A new cache (a new run) reads the entry back from disk
+    cache = AggregateCache(str(tmp_path / "cache"))
+    assert cache.get(survey_file) == (HOURLY_DATA, METRICS)
+    assert cache.get(survey_file) == (HOURLY_DATA, METRICS)
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_changed_file_is_not_answered(tmp_path, survey_file):
+    cache = AggregateCache(str(tmp_path / "cache"))
+    cache.put(survey_file, HOURLY_DATA, METRICS)
+    # Same size, new content and a new modification time
+    with open(survey_file, "w") as file:
+        file.write("JunctionName,VehicleType\nElm Avenue/Rabbit Road,Bus\n")
+    touch(survey_file, 1)
+    assert cache.get(survey_file) is None
+    assert AggregateCache(str(tmp_path / "cache")).get(survey_file) is None
+
+
+def test_touched_file_is_still_fresh(tmp_path, survey_file):
+    cache = AggregateCache(str(tmp_path / "cache"))
+    cache.put(survey_file, HOURLY_DATA, METRICS)
+
+    # The first put does not read the file again for its hash, so the first touch is a miss
+    # that hashes the file, and the entry stored after it keeps the hash
+    touch(survey_file, 1)
+    assert cache.get(survey_file) is None
+    cache.put(survey_file, HOURLY_DATA, METRICS)
+    assert cache.read_entry(survey_file)["content_hash"] is not None
+
+    # From then on a touch is answered from the hash, and the new modification time is stored
+    mtime_ns = touch(survey_file, 1)
+    assert cache.get(survey_file) == (HOURLY_DATA, METRICS)
+    assert AggregateCache(str(tmp_path / "cache")).get(survey_file) == (HOURLY_DATA, METRICS)
+    assert cache.read_entry(survey_file)["mtime_ns"] == mtime_ns
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = AggregateCache(str(cache_dir))
+    files = []
+    for day in range(3):
+        file_path = tmp_path / f"traffic_data1{day}062024.csv"
+        file_path.write_text("JunctionName\n")
+        files.append(str(file_path))
+    for number, file_path in enumerate(files):
+        cache.put(file_path, HOURLY_DATA, METRICS)
+        # Give each entry its own age, oldest first
+        os.utime(cache.entry_path(file_path), ns=(number * 10**9, number * 10**9))
+
+    # Room for two entries: the oldest one goes when the next one is stored
+    cache.max_disk_bytes = 2 * os.path.getsize(cache.entry_path(files[0]))
+    cache.evict()
+    assert [os.path.exists(cache.entry_path(file_path)) for file_path in files] == [False, True, True]
+
+
+def test_in_memory_layer_keeps_the_most_recent_entries(tmp_path):
+    cache = AggregateCache(str(tmp_path / "cache"), memory_entries=2)
+    for day in range(3):
+        file_path = tmp_path / f"traffic_data1{day}062024.csv"
+        file_path.write_text("JunctionName\n")
+        cache.put(str(file_path), HOURLY_DATA, METRICS)
+    assert list(cache.memory) == [str(tmp_path / f"traffic_data1{day}062024.csv") for day in (1, 2)]
+
+
+def test_invalidate_one_file_or_all(tmp_path, survey_file):
+    cache = AggregateCache(str(tmp_path / "cache"))
+    other_file = tmp_path / "traffic_data16062024.csv"
+    other_file.write_text("JunctionName\n")
+    cache.put(survey_file, HOURLY_DATA, METRICS)
+    cache.put(str(other_file), HOURLY_DATA, METRICS)
+
+    cache.invalidate(survey_file)
+    assert cache.get(survey_file) is None
+    assert cache.get(str(other_file)) == (HOURLY_DATA, METRICS)
+
+    cache.invalidate()
+    assert cache.get(str(other_file)) is None
+    assert os.listdir(tmp_path / "cache") == []
@@ -0,0 +1,137 @@
+"""
+The command line options of main.py: batch runs, results formats, metric selection,
+sampling, the summary store, follow mode and the options that are refused.
+"""
+
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = ("traffic_data15062024.csv", "traffic_data16062024.csv", "traffic_data21062024.csv")
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    Copies the sample files into a temporary folder that main.py is run in.
+    """
+
+    for name in SAMPLE_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    return tmp_path
+
+
+def run_main(data_dir, *options, stdin=None):
+    """
+    Runs main.py with options in data_dir, with the user cache folder inside it, and returns the finished process.
+    """
+
+    environment = dict(os.environ, XDG_CACHE_HOME=str(data_dir / "cache"))
+    environment.pop("DISPLAY", None)
+    return subprocess.run([sys.executable, os.path.join(ROOT, "main.py"), *options], cwd=data_dir,
+                          env=environment, input=stdin, capture_output=True, text=True, timeout=120)
+
+
+def test_batch_writes_every_results_format(data_dir):
+    process = run_main(data_dir, "--batch", "15-06-2024", "16-06-2024", "--no-gui",
+                       "--results-format", "text", "jsonl", "csv")
+    assert process.returncode == 0, process.stderr
+    assert (data_dir / "results.txt").read_text().count("Data file selected is") == 2
+    with open(data_dir / "results.jsonl") as file:
+        assert [json.loads(line)["date"] for line in file] == ["15-06-2024", "16-06-2024"]
+    with open(data_dir / "results.csv", newline="") as file:
+        assert [row["date"] for row in csv.DictReader(file)] == ["15-06-2024", "16-06-2024"]
+
+
+def test_print_sends_the_outcomes_to_stdout(data_dir):
+    process = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--print", "jsonl",
+                       "--metrics", "total_vehicles,total_trucks")
+    assert process.returncode == 0, process.stderr
+    record, = [json.loads(line) for line in process.stdout.splitlines()]
+    assert record["date"] == "21-06-2024"
+    assert "total_trucks" in record and "vehicles_over_speed" not in record
+    # Progress lines go to standard error
+    assert "traffic_data21062024.csv" in process.stderr
+
+
+@pytest.mark.parametrize("engine", ("rows", "columnar", "fused"))
+def test_glob_with_each_engine(data_dir, engine):
+    process = run_main(data_dir, "--glob", "traffic_data1*.csv", "--no-gui", "--no-cache", "--engine", engine,
+                       "--print", "text")
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.count("Data file selected is") == 2
+    assert process.stdout.index("15062024") < process.stdout.index("16062024")
+
+
+def test_summary_db_is_opt_in(data_dir):
+    run_main(data_dir, "--batch", "15-06-2024", "--no-gui")
+    assert not (data_dir / "cache" / "traffic-data-analysis" / "traffic_summary.db").exists()
+
+    process = run_main(data_dir, "--batch", "15-06-2024", "16-06-2024", "--no-gui", "--summary-db", "summary.db")
+    assert process.returncode == 0, process.stderr
+    assert "summary.db" in process.stdout
+    connection = sqlite3.connect(data_dir / "summary.db")
+    assert connection.execute("SELECT COUNT(*) FROM days").fetchone()[0] == 2
+    connection.close()
+
+
+def test_cache_is_used_and_cleared(data_dir):
+    for expected in ("1 misses", "1 memory hits|1 disk hits"):
+        process = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--profile")
+        assert process.returncode == 0, process.stderr
+        assert any(part in process.stdout for part in expected.split("|")), process.stdout
+    assert os.listdir(data_dir / "cache" / "traffic-data-analysis" / "aggregates")
+    run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--no-cache", "--clear-cache")
+    assert not os.listdir(data_dir / "cache" / "traffic-data-analysis" / "aggregates")
+
+
+def test_profile_prints_the_stage_table(data_dir):
+    process = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--no-cache", "--profile")
+    assert process.returncode == 0, process.stderr
+    assert "Stage" in process.stdout and "parse rows" in process.stdout
+    assert "Metric (fused-engine estimate)" in process.stdout
+
+
+def test_sample_rows_on_a_small_file_is_exact(data_dir):
+    exact = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--no-cache", "--print", "text").stdout
+    sampled = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--no-cache", "--print", "text",
+                       "--sample-rows", "1000", "--seed", "1").stdout
+    assert sampled == exact
+
+
+def test_quarantine_file_gets_the_bad_rows(data_dir):
+    with open(data_dir / "traffic_data21062024.csv", "a") as file:
+        file.write("Elm Avenue/Rabbit Road,21/06/2024,25:00:00,N,N,Clear,30,20,Car,False\n")
+    process = run_main(data_dir, "--batch", "21-06-2024", "--no-gui", "--no-cache",
+                       "--quarantine-file", "bad_rows.csv")
+    assert process.returncode == 0, process.stderr
+    assert "25:00:00" in (data_dir / "bad_rows.csv").read_text()
+
+
+def test_follow_stdin_prints_the_final_counts(data_dir):
+    rows = (data_dir / "traffic_data16062024.csv").read_text()
+    process = run_main(data_dir, "--follow", "-", "--interval", "60", "--no-gui", stdin=rows)
+    assert process.returncode == 0, process.stderr
+    assert "The total number of vehicles recorded for this date is 101" in process.stdout
+
+
+@pytest.mark.parametrize("options, message", (
+    (("--print", "text"), "--print needs --batch or --glob"),
+    (("--batch", "15-06-2024", "16-06-2024", "17-06-2024"), "--batch takes a single date"),
+    (("--batch", "15-06-2024", "--metrics", "colour"), "colour"),
+    (("--batch", "15-06-2024", "--metrics", "total_vehicles", "--sample-rows", "100"), "cannot be combined"),
+    (("--batch", "15-06-2024", "--sample-rows", "1"), "at least 2 rows"),
+    (("--batch", "15-06-2024", "--results-format", "text", "csv", "--results-file", "out.csv"), "out.csv"),
+    (("--batch", "15-06-2024", "--engine", "magic"), "invalid choice"),
+))
+def test_refused_options(data_dir, options, message):
+    process = run_main(data_dir, "--no-gui", *options)
+    assert process.returncode == 2
+    assert message in process.stderr
@@ -0,0 +1,86 @@
+"""
+Compressed survey files must read exactly like the plain file, with every engine,
+and the background decompression must pass on errors and stop when the file is closed.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+
+import pytest
+
+from compressed import ThreadedDecompressor, find_csv_file, open_csv
+from main import ENGINES, process_csv_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = "traffic_data21062024.csv"
+
+# Compression of each codec that the standard library can write
+COMPRESSORS = {".gz": gzip.compress, ".xz": lzma.compress, ".bz2": bz2.compress}
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    Puts the plain sample file and a copy in every codec into a temporary folder.
+    """
+
+    shutil.copy(os.path.join(ROOT, SAMPLE_FILE), tmp_path / SAMPLE_FILE)
+    data = (tmp_path / SAMPLE_FILE).read_bytes()
+    for extension, compress in COMPRESSORS.items():
+        (tmp_path / (SAMPLE_FILE + extension)).write_bytes(compress(data))
+    return tmp_path
+
+
+@pytest.mark.parametrize("extension", COMPRESSORS)
+def test_compressed_file_reads_like_the_plain_file(data_dir, extension):
+    with open_csv(str(data_dir / (SAMPLE_FILE + extension))) as file:
+        assert file.read() == (data_dir / SAMPLE_FILE).read_text()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("extension", COMPRESSORS)
+def test_engines_give_the_same_outcomes(data_dir, engine, extension):
+    compressed_file = str(data_dir / (SAMPLE_FILE + extension))
+    expected = process_csv_results(str(data_dir / SAMPLE_FILE), "rows", quarantine_file=os.devnull)
+    hourly_data, outcomes, _ = process_csv_results(compressed_file, engine, quarantine_file=os.devnull)
+    # The outcome lines name the file they were read from
+    assert outcomes[1:] == expected[1][1:]
+    assert hourly_data == expected[0]
+
+
+def test_small_blocks_and_a_short_queue(data_dir):
+    data = (data_dir / SAMPLE_FILE).read_bytes()
+    compressed = gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(data)))
+    stream = ThreadedDecompressor(compressed, block_size=100, max_blocks=1)
+    assert b"".join(iter(lambda: stream.read(37), b"")) == data
+    stream.close()
+
+
+def test_decompression_errors_reach_the_reader(tmp_path):
+    broken_file = tmp_path / (SAMPLE_FILE + ".gz")
+    broken_file.write_bytes(gzip.compress(b"JunctionName\n" * 1000)[:-20])
+    with pytest.raises(EOFError):
+        with open_csv(str(broken_file)) as file:
+            file.read()
+
+
+def test_closing_early_stops_the_thread(data_dir):
+    stream = ThreadedDecompressor(io.BytesIO(os.urandom(1 << 16)), block_size=16, max_blocks=1)
+    stream.read(16)
+    stream.close()
+    assert not stream.thread.is_alive()
+    assert stream.stream.closed
+
+
+def test_find_csv_file_prefers_the_plain_file(data_dir):
+    plain_file = str(data_dir / SAMPLE_FILE)
+    assert find_csv_file(plain_file) == plain_file
+    os.remove(plain_file)
+    assert find_csv_file(plain_file) == plain_file + ".gz"
+    os.remove(plain_file + ".gz")
+    assert find_csv_file(plain_file) == plain_file + ".xz"
+    assert find_csv_file(str(data_dir / "traffic_data01012024.csv")) == str(data_dir / "traffic_data01012024.csv")
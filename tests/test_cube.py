@@ -0,0 +1,93 @@
+"""
+Cube queries must count the same vehicles as filtering the rows of the file one by one,
+and the saved cube must be reused until the CSV file changes.
+"""
+
+import csv
+import os
+import shutil
+
+import pytest
+
+from cube import TrafficCube, cube_path, load_cube
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = "traffic_data21062024.csv"
+
+
+@pytest.fixture
+def survey_file(tmp_path):
+    """
+    Copies a sample file into a temporary folder (the cube is saved next to it) and returns its path.
+    """
+
+    shutil.copy(os.path.join(ROOT, SAMPLE_FILE), tmp_path / SAMPLE_FILE)
+    return str(tmp_path / SAMPLE_FILE)
+
+
+def count_rows(file_path, test):
+    """
+    Counts the rows of a CSV file that pass test, one row at a time.
+    """
+
+    with open(file_path) as file:
+        return sum(1 for row in csv.DictReader(file) if test(row))
+
+
+@pytest.mark.parametrize("filters, test", (
+    ({}, lambda row: True),
+    ({"vehicle_type": "Truck"}, lambda row: row["VehicleType"] == "Truck"),
+    ({"electric": True, "junction": "Hanley Highway/Westway"},
+     lambda row: row["elctricHybrid"] == "True" and row["JunctionName"] == "Hanley Highway/Westway"),
+    ({"hour": range(7, 9), "direction_out": "S"},
+     lambda row: row["timeOfDay"][:2] in ("07", "08") and row["travel_Direction_out"] == "S"),
+    ({"hour": ["07", "08"], "direction_out": "S"},
+     lambda row: row["timeOfDay"][:2] in ("07", "08") and row["travel_Direction_out"] == "S"),
+    ({"weather": ("Light Rain", "Heavy Rain"), "over_limit": True},
+     lambda row: row["Weather_Conditions"] in ("Light Rain", "Heavy Rain")
+     and int(row["VehicleSpeed"]) > int(row["JunctionSpeedLimit"])),
+))
+def test_count_matches_row_filter(survey_file, filters, test):
+    assert load_cube(survey_file).count(**filters) == count_rows(survey_file, test)
+
+
+def test_group_by_keeps_file_order(survey_file):
+    groups = load_cube(survey_file).group_by("hour", junction="Elm Avenue/Rabbit Road")
+    expected = {}
+    with open(survey_file) as file:
+        for row in csv.DictReader(file):
+            if row["JunctionName"] == "Elm Avenue/Rabbit Road":
+                expected[row["timeOfDay"][:2]] = expected.get(row["timeOfDay"][:2], 0) + 1
+    assert list(groups.items()) == list(expected.items())
+
+
+def test_no_turn_count(survey_file):
+    assert load_cube(survey_file).no_turn_count() == count_rows(
+        survey_file, lambda row: row["travel_Direction_in"] == row["travel_Direction_out"])
+
+
+def test_unknown_dimension_is_refused(survey_file):
+    with pytest.raises(ValueError, match="colour"):
+        load_cube(survey_file).count(colour="red")
+
+
+def test_saved_cube_is_reused_until_the_file_changes(survey_file):
+    cube = load_cube(survey_file)
+    assert os.path.exists(cube_path(survey_file))
+    assert TrafficCube.load(cube_path(survey_file)).cells == cube.cells
+
+    # A saved cube with other counts is answered as long as the source still matches
+    loaded = TrafficCube.load(cube_path(survey_file))
+    loaded.cells = {key: count * 2 for key, count in loaded.cells.items()}
+    loaded.save(cube_path(survey_file))
+    assert load_cube(survey_file).count() == 2 * cube.count()
+
+    # Once the file changes the cube is built again
+    with open(survey_file, "a") as file:
+        file.write("Elm Avenue/Rabbit Road,21/06/2024,23:59:00,N,N,Clear,30,20,Car,False\n")
+    assert load_cube(survey_file).count() == cube.count() + 1
+
+
+@pytest.mark.parametrize("name", (SAMPLE_FILE, SAMPLE_FILE + ".gz", SAMPLE_FILE + ".xz", SAMPLE_FILE + ".bz2"))
+def test_compressed_file_shares_the_cube_of_the_plain_file(name):
+    assert cube_path(os.path.join("data", name)) == os.path.join("data", "traffic_data21062024.cube.json")
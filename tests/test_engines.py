@@ -0,0 +1,160 @@
+"""
+Every engine of main.ENGINES must give the same outcomes as the row loop,
+on the sample survey files and on a file with bad rows.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from chunked import compute_chunked_metrics
+import main
+from binary_columns import binary_path
+from main import ENGINES, choose_engine, compute_csv_metrics, process_csv_results
+from validation import DataQuality, ValidatedReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = ("traffic_data15062024.csv", "traffic_data16062024.csv", "traffic_data21062024.csv")
+
+# Lines put into a sample file to make the bad rows file: (line number, text)
+BAD_LINES = (
+    (7, "Elm Avenue/Rabbit Road,21/06/2024,00:50:08,W,N,Overcast,30,n/a,Buss,False"),
+    (13, "Elm Avenue/Rabbit Road,21/06/2024,00:50:08,W,N"),
+    (20, ""),
+    (35, "Hanley Highway/Westway,21/06/2024,02:10:00,W,N,Fog,30,250,Car,False"),
+    (46, "Hanley Highway/Westway,21/06/2024,25:10:00,W,N,Clear,30,20,Car,False"),
+    (60, "Hanley Highway/Westway,21/06/2024,03:10:00,W,N,Fog,30,20,Tram,false"),
+    (90, ",21/06/2024,03:12:00,W,W,Clear,30,10,Car,False"),
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    Copies the sample files into a temporary folder (the binary and cube engines write next to them)
+    and adds traffic_data22062024.csv, a copy of the last one with bad rows.
+    """
+
+    for name in SAMPLE_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    with open(os.path.join(ROOT, SAMPLE_FILES[-1])) as file:
+        lines = file.read().splitlines()
+    for number, line in BAD_LINES:
+        lines.insert(number - 1, line)
+    (tmp_path / "traffic_data22062024.csv").write_text("\n".join(lines) + "\n")
+    return tmp_path
+
+
+def results(file_path, engine, quarantine_file):
+    """
+    Returns what an engine gives for a file: the outcome lines, the histogram data and the quarantined rows.
+    """
+
+    hourly_data, outcomes, metrics = process_csv_results(str(file_path), engine, quarantine_file=quarantine_file)
+    quarantined = ""
+    if os.path.exists(quarantine_file):
+        with open(quarantine_file) as file:
+            quarantined = file.read()
+    return outcomes, hourly_data, metrics["data_quality"], quarantined
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", SAMPLE_FILES + ("traffic_data22062024.csv",))
+def test_engine_matches_row_loop(data_dir, name, engine):
+    expected = results(data_dir / name, "rows", str(data_dir / "rows_quarantine.csv"))
+    assert results(data_dir / name, engine, str(data_dir / f"{engine}_quarantine.csv")) == expected
+    # The binary and cube engines answer a second run from the file they saved
+    assert results(data_dir / name, engine, str(data_dir / f"{engine}_quarantine.csv")) == expected
+
+
+def test_bad_rows_are_quarantined(data_dir):
+    _, _, quality, quarantined = results(data_dir / "traffic_data22062024.csv", "rows",
+                                         str(data_dir / "quarantine.csv"))
+    assert quality["bad_rows"] == 5
+    assert quality["unknown_categories"] == {"VehicleType=Tram": 1, "Weather_Conditions=Fog": 1}
+    lines = [line.split(",")[1] for line in quarantined.splitlines()[1:]]
+    assert lines == ["7", "13", "35", "46", "90"]
+
+
+def read_quality(file_path, read):
+    """
+    Reads a file with read(ValidatedReader) and returns the good rows and the DataQuality.
+    """
+
+    quality = DataQuality(str(file_path))
+    with open(file_path, newline="") as file:
+        rows = read(ValidatedReader(file, quality))
+    return rows, quality
+
+
+@pytest.mark.parametrize("batch_rows", (1, 7, 1000))
+@pytest.mark.parametrize("quoted", (False, True))
+def test_column_batches_match_row_reading(data_dir, batch_rows, quoted):
+    file_path = data_dir / "traffic_data22062024.csv"
+    lines = file_path.read_text().splitlines()
+    if quoted:
+        # From a quoted line on the rest of the file is read through the csv module
+        lines[49] = '"Hanley Highway/Westway",21/06/2024,03:00:00,W,N,Clear,30,20,Car,False'
+    file_path.write_bytes("\r\n".join(lines).encode() + b"\r\n")
+
+    expected_rows, expected = read_quality(file_path, list)
+    rows, quality = read_quality(file_path, lambda reader: [row for batch in reader.columns(batch_rows)
+                                                            for row in map(list, zip(*batch.values()))])
+    assert rows == expected_rows
+    assert quality.quarantined == expected.quarantined
+    assert quality.unknown == expected.unknown
+
+
+@pytest.mark.parametrize("chunk_count", (1, 2, 3, 7, 50))
+@pytest.mark.parametrize("name", ("traffic_data15062024.csv", "traffic_data22062024.csv"))
+def test_chunk_counts_match_row_loop(data_dir, name, chunk_count):
+    file_path = str(data_dir / name)
+    expected = compute_csv_metrics(file_path, "rows", str(data_dir / "rows_quarantine.csv"))
+    quality = DataQuality(file_path)
+    hourly_data, metrics = compute_chunked_metrics(file_path, workers=2, chunk_count=chunk_count, quality=quality)
+    metrics["data_quality"] = quality.summary()
+    assert (hourly_data, metrics) == expected
+    # The quarantined rows keep the line numbers they have in the whole file
+    quality.save_quarantine(str(data_dir / "chunked_quarantine.csv"))
+    if quality.bad_rows:
+        assert (data_dir / "chunked_quarantine.csv").read_text() == (data_dir / "rows_quarantine.csv").read_text()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_empty_file_is_refused(tmp_path, engine):
+    file_path = tmp_path / "traffic_data01012024.csv"
+    file_path.write_text("")
+    with pytest.raises(ValueError):
+        compute_csv_metrics(str(file_path), engine, str(tmp_path / "quarantine.csv"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_header_only_file_has_no_vehicles(tmp_path, engine):
+    file_path = tmp_path / "traffic_data01012024.csv"
+    with open(os.path.join(ROOT, SAMPLE_FILES[0])) as file:
+        file_path.write_text(file.readline())
+    _, metrics = compute_csv_metrics(str(file_path), engine, str(tmp_path / "quarantine.csv"))
+    assert metrics["total_vehicles"] == 0
+
+
+def test_auto_engine_reads_the_binary_copy(data_dir, monkeypatch):
+    pytest.importorskip("numpy")
+    file_path = str(data_dir / SAMPLE_FILES[0])
+    # A small file without a binary copy is read row by row
+    assert choose_engine(file_path, "auto") == "rows"
+    assert choose_engine(file_path, "cube") == "cube"
+
+    # A large file is converted, and from then on the binary copy is used whatever the size
+    monkeypatch.setattr(main, "AUTO_BINARY_MIN_BYTES", 0)
+    assert choose_engine(file_path, "auto") == "binary"
+    expected = compute_csv_metrics(file_path, "rows", str(data_dir / "rows_quarantine.csv"))
+    assert compute_csv_metrics(file_path, "auto", str(data_dir / "auto_quarantine.csv")) == expected
+    assert os.path.exists(binary_path(file_path))
+    monkeypatch.undo()
+    assert choose_engine(file_path, "auto") == "binary"
+
+    # A changed file makes the copy stale
+    with open(file_path, "a") as file:
+        file.write("Elm Avenue/Rabbit Road,15/06/2024,23:59:00,N,N,Clear,30,20,Car,False\n")
+    assert choose_engine(file_path, "auto") == "rows"
@@ -0,0 +1,95 @@
+"""
+Follow mode must only count complete lines, start again when the file is rotated,
+and end up with the same counts as processing the whole file at once.
+"""
+
+import io
+import os
+import random
+
+from follow import follow_events, stream_events, tail_file_events
+from main import compute_csv_metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(ROOT, "traffic_data21062024.csv")
+
+with open(SAMPLE_FILE) as sample:
+    HEADER, *ROWS = sample.read().splitlines()
+
+
+def next_lines(events):
+    """
+    Returns the next event of a follow stream that is not "idle".
+    """
+
+    for kind, lines in events:
+        if kind != "idle":
+            return kind, lines
+    return None
+
+
+def test_partial_line_waits_for_the_rest(tmp_path):
+    file_path = tmp_path / "feed.csv"
+    file_path.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1][:20]}")
+    events = tail_file_events(str(file_path), poll_interval=0)
+    assert next_lines(events) == ("lines", [HEADER, ROWS[0]])
+
+    with open(file_path, "a") as file:
+        file.write(f"{ROWS[1][20:]}\r\n{ROWS[2]}")
+    assert next_lines(events) == ("lines", [ROWS[1]])
+    events.close()
+
+
+def test_rotated_file_ends_the_old_file_and_starts_again(tmp_path):
+    file_path = tmp_path / "feed.csv"
+    file_path.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}")
+    events = tail_file_events(str(file_path), poll_interval=0)
+    assert next_lines(events) == ("lines", [HEADER, ROWS[0]])
+
+    # The new day's file replaces the old one; the old last line had no newline yet
+    os.replace(file_path, tmp_path / "feed.csv.old")
+    file_path.write_text(f"{HEADER}\n{ROWS[2]}\n")
+    assert next_lines(events) == ("lines", [ROWS[1]])
+    assert next_lines(events) == ("rotated", None)
+    assert next_lines(events) == ("lines", [HEADER, ROWS[2]])
+
+    # Truncating the file in place is a rotation too
+    file_path.write_text("")
+    assert next_lines(events) == ("rotated", None)
+    events.close()
+
+
+def test_follow_counts_match_the_whole_file(tmp_path):
+    _, expected = compute_csv_metrics(SAMPLE_FILE, "rows", str(tmp_path / "rows_quarantine.csv"))
+    lines = [HEADER] + ROWS
+    for seed in range(3):
+        # Hand the lines on in random batches with quiet spells in between
+        rnd = random.Random(seed)
+        events = []
+        start = 0
+        while start < len(lines):
+            size = rnd.randint(1, 300)
+            events.append(("lines", lines[start:start + size]))
+            start += size
+            if rnd.random() < 0.3:
+                events.append(("idle", None))
+        updates = []
+        skipped = follow_events(iter(events), lambda metrics, final: updates.append((metrics, final)),
+                                interval=1e9, quarantine_file=str(tmp_path / "follow_quarantine.csv"))
+        assert skipped == 0
+        assert updates == [(expected, True)]
+
+
+def test_rotation_sends_the_final_counts_of_each_file(tmp_path):
+    events = [("lines", [HEADER] + ROWS[:10]), ("rotated", None), ("lines", [HEADER] + ROWS[10:13])]
+    updates = []
+    follow_events(iter(events), lambda metrics, final: updates.append((metrics["total_vehicles"], final)),
+                  interval=1e9, quarantine_file=str(tmp_path / "quarantine.csv"))
+    assert updates == [(10, True), (3, True)]
+
+
+def test_stream_events_hand_on_every_line():
+    stream = io.StringIO("".join(f"{line}\r\n" for line in [HEADER] + ROWS))
+    # The lines waiting when a batch is taken go together, so the split depends on the reader thread
+    lines = [line for kind, batch in stream_events(stream, poll_interval=1) if kind == "lines" for line in batch]
+    assert lines == [HEADER] + ROWS
@@ -0,0 +1,107 @@
+"""
+Results sinks must append whole days under a lock, and write the same columns for every day.
+"""
+
+import csv
+import json
+import os
+import threading
+
+import pytest
+
+from main import build_outcomes, compute_csv_metrics
+from results_sink import SEPARATOR, CsvSink, JsonLinesSink, TextSink, append_atomically, fcntl, open_sinks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(ROOT, "traffic_data21062024.csv")
+
+
+@pytest.fixture(scope="module")
+def day():
+    """
+    Returns the date, file, outcome lines and values of a sample file, as the sinks are given them.
+    """
+
+    _, values = compute_csv_metrics(SAMPLE_FILE, "rows", os.devnull)
+    return "21-06-2024", SAMPLE_FILE, build_outcomes(SAMPLE_FILE, values), values
+
+
+@pytest.mark.skipif(fcntl is None, reason="appends are only locked where fcntl is available")
+def test_append_waits_for_the_lock(tmp_path):
+    path = tmp_path / "results.txt"
+    path.write_text("")
+    with open(path) as holder:
+        fcntl.flock(holder, fcntl.LOCK_EX)
+        writer = threading.Thread(target=append_atomically, args=(str(path), "day\n"))
+        writer.start()
+        writer.join(timeout=0.2)
+        # The append is still waiting for the lock
+        assert writer.is_alive()
+        assert path.read_text() == ""
+        fcntl.flock(holder, fcntl.LOCK_UN)
+    writer.join()
+    assert path.read_text() == "day\n"
+
+
+def test_header_is_only_written_to_an_empty_file(tmp_path):
+    path = str(tmp_path / "results.csv")
+    append_atomically(path, "1\n", "header\n")
+    append_atomically(path, "2\n", "header\n")
+    with open(path) as file:
+        assert file.read() == "header\n1\n2\n"
+
+
+def test_days_are_buffered_until_flushed(tmp_path, day):
+    path = tmp_path / "results.txt"
+    sink = TextSink(str(path), max_buffered=2)
+    sink.write(*day)
+    assert not path.exists()
+    sink.write(*day)
+    assert path.read_text().count(SEPARATOR) == 2
+    sink.write(*day)
+    sink.close()
+    assert path.read_text().count(SEPARATOR) == 3
+
+
+def test_jsonl_has_one_record_per_day(tmp_path, day):
+    sink = JsonLinesSink(str(tmp_path / "results.jsonl"))
+    sink.write(*day)
+    sink.write(*day, names=["total_vehicles", "total_trucks"])
+    sink.close()
+    with open(tmp_path / "results.jsonl") as file:
+        every, selected = [json.loads(line) for line in file]
+    date, _, _, values = day
+    assert every["date"] == date
+    assert every["total_vehicles"] == values["total_vehicles"]
+    assert {"junctions", "speeds", "data_quality"} <= set(every)
+    assert [junction["junction"] for junction in every["junctions"]] == ["Elm Avenue/Rabbit Road",
+                                                                         "Hanley Highway/Westway"]
+    assert "total_trucks" in selected and "vehicles_over_speed" not in selected
+
+
+def test_csv_writes_the_same_columns_for_every_day(tmp_path, day):
+    path = tmp_path / "results.csv"
+    for names in (None, ["total_vehicles"]):
+        # Two runs append to the same file; the header is written once
+        sink = CsvSink(str(path))
+        sink.write(*day, names=names)
+        sink.close()
+    with open(path, newline="") as file:
+        header, every, selected = list(csv.reader(file))
+    assert header == CsvSink.columns
+    assert len(every) == len(selected) == len(header)
+    record = dict(zip(header, every))
+    assert record["date"] == day[0]
+    assert record["total_vehicles"] == str(day[3]["total_vehicles"])
+    assert dict(zip(header, selected))["total_trucks"] == ""
+
+
+def test_open_sinks_names_the_files_after_the_results_file(tmp_path):
+    results_file = str(tmp_path / "results.txt")
+    sinks = open_sinks(["text", "jsonl", "csv"], results_file)
+    assert [sink.path for sink in sinks] == [results_file, str(tmp_path / "results.jsonl"),
+                                             str(tmp_path / "results.csv")]
+    with pytest.raises(ValueError, match="xml"):
+        open_sinks(["xml"], results_file)
+    with pytest.raises(ValueError, match="same|both"):
+        open_sinks(["text", "csv"], str(tmp_path / "results.csv"))
@@ -0,0 +1,154 @@
+"""
+The query service must answer days and date ranges over HTTP, share loads between
+concurrent requests, and reload a pooled day when its file changes.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from main import process_csv_results
+from service import DayPool, TrafficService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = ("traffic_data15062024.csv", "traffic_data16062024.csv", "traffic_data21062024.csv")
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    Copies the sample files into a temporary folder and returns it.
+    """
+
+    for name in SAMPLE_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    return tmp_path
+
+
+def run_service(data_dir, test):
+    """
+    Starts the service on a free port, runs test(pool, port) against it and returns what test returns.
+    Days are loaded on threads instead of worker processes, which is enough for the tests.
+    """
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pool = DayPool(executor, data_dir=str(data_dir), quarantine_file=str(data_dir / "quarantine.csv"))
+            server = await asyncio.start_server(TrafficService(pool).handle_connection, "127.0.0.1", 0)
+            async with server:
+                return await test(pool, server.sockets[0].getsockname()[1])
+
+    return asyncio.run(main())
+
+
+async def fetch(port, *targets, method="GET", request_line=None):
+    """
+    Sends requests for targets over one keep-alive connection and returns (status, JSON body) of each.
+    """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    answers = []
+    for number, target in enumerate(targets, 1):
+        # The last request closes the connection, so the service is done with it when the test ends
+        connection = "close" if number == len(targets) else "keep-alive"
+        writer.write(f"{request_line or f'{method} {target} HTTP/1.1'}\r\nHost: test\r\n"
+                     f"Connection: {connection}\r\n\r\n".encode())
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) != b"\r\n":
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        answers.append((status, json.loads(await reader.readexactly(int(headers["content-length"])))))
+    writer.close()
+    return answers
+
+
+def test_day_has_the_outcomes_of_main(data_dir):
+    async def test(pool, port):
+        return await fetch(port, "/days/21-06-2024", "/days/21-6-2024/", "/pool")
+
+    (status, day), (_, again), (_, stats) = run_service(data_dir, test)
+    hourly_data, outcomes, values = process_csv_results(str(data_dir / "traffic_data21062024.csv"),
+                                                        quarantine_file=os.devnull)
+    assert status == 200
+    assert day["outcomes"] == [line.strip() for line in outcomes if line.strip()]
+    assert day["hourly_data"] == hourly_data
+    assert day["results"]["total_vehicles"] == values["total_vehicles"]
+    # The second request, with a date written another way, is answered from the pool
+    assert again == day
+    assert (stats["days"], stats["loads"], stats["hits"]) == (["21-06-2024"], 1, 1)
+
+
+def test_concurrent_requests_share_one_load(data_dir):
+    async def test(pool, port):
+        answers = await asyncio.gather(*(fetch(port, "/days/15-06-2024") for _ in range(5)))
+        return answers, pool.loads
+
+    answers, loads = run_service(data_dir, test)
+    assert loads == 1
+    assert all(answer == answers[0] for answer in answers)
+
+
+def test_changed_file_is_loaded_again(data_dir):
+    async def test(pool, port):
+        (_, before), = await fetch(port, "/days/16-06-2024")
+        with open(data_dir / "traffic_data16062024.csv", "a") as file:
+            file.write("Elm Avenue/Rabbit Road,16/06/2024,23:59:00,N,N,Clear,30,20,Car,False\n")
+        (_, after), = await fetch(port, "/days/16-06-2024")
+        return before, after, pool.loads
+
+    before, after, loads = run_service(data_dir, test)
+    assert after["results"]["total_vehicles"] == before["results"]["total_vehicles"] + 1
+    assert loads == 2
+
+
+def test_date_range_lists_missing_days(data_dir):
+    async def test(pool, port):
+        return await fetch(port, "/days?start=15-06-2024&end=17-06-2024")
+
+    (status, answer), = run_service(data_dir, test)
+    assert status == 200
+    assert [day["date"] for day in answer["days"]] == ["15-06-2024", "16-06-2024", "17-06-2024"]
+    assert "error" in answer["days"][2]
+
+
+def test_least_recently_used_days_leave_a_full_pool(data_dir):
+    async def test(pool, port):
+        # 16-06-2024 is used least recently, and the pool is left just full
+        await fetch(port, "/days/16-06-2024", "/days/15-06-2024")
+        pool.max_bytes = pool.size
+        await fetch(port, "/days/21-06-2024")
+        return list(pool.days), pool.size, pool.max_bytes
+
+    days, size, max_bytes = run_service(data_dir, test)
+    assert "16-06-2024" not in days
+    assert days[-1] == "21-06-2024"
+    assert size <= max_bytes
+
+
+@pytest.mark.parametrize("target, method, status", (
+    ("/days/31-02-2024", "GET", 400),
+    ("/days/01-01-2024", "GET", 404),
+    ("/days?start=21-06-2024&end=15-06-2024", "GET", 400),
+    ("/days", "GET", 400),
+    ("/weather", "GET", 404),
+    ("/days/21-06-2024", "POST", 405),
+))
+def test_requests_that_cannot_be_answered(data_dir, target, method, status):
+    async def test(pool, port):
+        return await fetch(port, target, method=method)
+
+    (answer_status, answer), = run_service(data_dir, test)
+    assert answer_status == status
+    assert "error" in answer
+
+
+def test_malformed_request_line(data_dir):
+    async def test(pool, port):
+        return await fetch(port, "", request_line="GARBAGE")
+
+    assert run_service(data_dir, test)[0][0] == 400
@@ -0,0 +1,140 @@
+"""
+The summary store must answer rollups, day over day changes and peak hours with the same
+counts as the processed days it was given, for the vehicles and for every counter.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+from aggregate import JUNCTION_COUNTERS, JunctionTable
+from main import compute_csv_metrics
+from summary_store import DAY_COUNTS, SCHEMA_VERSION, SummaryStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sample days: a Saturday and Sunday of one week, and the Friday of the next
+SAMPLE_DAYS = {"15-06-2024": "traffic_data15062024.csv", "16-06-2024": "traffic_data16062024.csv",
+               "21-06-2024": "traffic_data21062024.csv"}
+
+
+@pytest.fixture(scope="module")
+def day_metrics():
+    """
+    Returns DD-MM-YYYY -> raw counts of every sample day.
+    """
+
+    return {date: compute_csv_metrics(os.path.join(ROOT, name), "rows", os.devnull)[1]
+            for date, name in SAMPLE_DAYS.items()}
+
+
+@pytest.fixture
+def store(tmp_path, day_metrics):
+    """
+    Returns a new store in a temporary folder with every sample day recorded.
+    """
+
+    store = SummaryStore(str(tmp_path / "summary.db"))
+    for date, metrics in day_metrics.items():
+        assert store.record_day(date, SAMPLE_DAYS[date], metrics)
+    yield store
+    store.close()
+
+
+def test_days_keep_the_raw_counts(store, day_metrics):
+    days = store.days()
+    assert [day["day"] for day in days] == list(SAMPLE_DAYS)
+    for day in days:
+        assert {name: day[name] for name in DAY_COUNTS} == {name: day_metrics[day["day"]][name]
+                                                            for name in DAY_COUNTS}
+
+
+def test_recording_a_day_again_replaces_it(store, day_metrics):
+    store.record_day("15-06-2024", SAMPLE_DAYS["15-06-2024"], day_metrics["15-06-2024"])
+    assert len(store.days()) == 3
+    assert store.rollup("year")[0]["total_vehicles"] == sum(m["total_vehicles"] for m in day_metrics.values())
+
+
+def test_invalid_date_is_not_stored(store, day_metrics):
+    assert not store.record_day("31-02-2024", "traffic_data31022024.csv", day_metrics["15-06-2024"])
+    assert len(store.days()) == 3
+
+
+def test_weekly_rollup_sums_the_days(store, day_metrics):
+    weeks = store.rollup("week")
+    assert [(week["period"], week["days"]) for week in weeks] == [("2024-W24", 2), ("2024-W25", 1)]
+    for name in DAY_COUNTS:
+        assert weeks[0][name] == day_metrics["15-06-2024"][name] + day_metrics["16-06-2024"][name]
+        assert weeks[1][name] == day_metrics["21-06-2024"][name]
+    with pytest.raises(ValueError, match="fortnight"):
+        store.rollup("fortnight")
+
+
+def test_junction_rollup_sums_every_counter(store, day_metrics):
+    expected = {}
+    for metrics in day_metrics.values():
+        table = JunctionTable.from_dict(metrics["junction_table"])
+        for junction in table.junctions:
+            totals = expected.setdefault(junction, dict.fromkeys(("vehicles",) + JUNCTION_COUNTERS, 0))
+            totals["vehicles"] += table.total(junction)
+            for hour in table.hours:
+                for name, count in table.cell_counters(hour, junction).items():
+                    totals[name] += count
+    rows = store.junction_rollup("year")
+    assert {row["junction"]: {name: row[name] for name in ("vehicles",) + JUNCTION_COUNTERS}
+            for row in rows} == expected
+
+
+def test_day_over_day_deltas(store, day_metrics):
+    trucks = [metrics["total_trucks"] for metrics in day_metrics.values()]
+    assert store.day_over_day("total_trucks") == [
+        {"day": "15-06-2024", "value": trucks[0], "delta": None},
+        {"day": "16-06-2024", "value": trucks[1], "delta": trucks[1] - trucks[0]},
+        {"day": "21-06-2024", "value": trucks[2], "delta": trucks[2] - trucks[1]},
+    ]
+    assert [day["day"] for day in store.day_over_day(start="16-06-2024")] == ["16-06-2024", "21-06-2024"]
+    with pytest.raises(ValueError):
+        store.day_over_day("colour")
+
+
+@pytest.mark.parametrize("metric", ("vehicles", "total_trucks", "vehicles_over_speed"))
+@pytest.mark.parametrize("junction", (None, "Hanley Highway/Westway"))
+def test_peak_hours_match_the_hourly_counts(store, day_metrics, metric, junction):
+    for peak, (date, metrics) in zip(store.peak_hours(junction=junction, metric=metric), day_metrics.items()):
+        table = JunctionTable.from_dict(metrics["junction_table"])
+        counts = {}
+        for hour in table.hours:
+            for name in table.junctions:
+                if junction in (None, name) and table.hourly_counts(name).get(hour):
+                    cell = table.hourly_counts(name)[hour] if metric == "vehicles" else \
+                        table.cell_counters(hour, name)[metric]
+                    counts[int(hour)] = counts.get(int(hour), 0) + cell
+        most = max(counts.values())
+        assert peak == {"day": date, "vehicles": most,
+                        "hours": sorted(hour for hour, count in counts.items() if count == most)}
+
+
+def test_compare_peak_hours_over_two_ranges(store):
+    comparison = store.compare_peak_hours(("15-06-2024", "16-06-2024"), ("21-06-2024", "21-06-2024"))
+    first = store.hourly_profile("15-06-2024", "16-06-2024")
+    second = store.hourly_profile("21-06-2024", "21-06-2024")
+    assert comparison["ranges"][0]["peak_average"] == max(first.values())
+    assert comparison["ranges"][1]["peak_hour"] == max(second, key=second.get)
+    assert comparison["hourly_change"] == {hour: second.get(hour, 0) - first.get(hour, 0)
+                                           for hour in sorted(set(first) | set(second))}
+
+
+def test_store_of_another_layout_is_emptied(tmp_path, day_metrics):
+    path = str(tmp_path / "summary.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE days (day TEXT PRIMARY KEY, total_vehicles INTEGER)")
+    connection.execute("INSERT INTO days VALUES ('2024-06-15', 1)")
+    connection.commit()
+    connection.close()
+
+    store = SummaryStore(path)
+    assert store.days() == []
+    assert store.record_day("15-06-2024", SAMPLE_DAYS["15-06-2024"], day_metrics["15-06-2024"])
+    assert store.connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    store.close()
@@ -0,0 +1,392 @@
+"""
+Validated reading of the survey CSV files.
+
+A single malformed row (a sensor writing "n/a" as a speed, a truncated line)
+used to stop the whole day with a ValueError. ValidatedReader checks every
+row against the schema of the ten survey columns instead:
+- Rows that cannot be counted (wrong number of fields, speeds that are not
+  numbers or out of range, a bad timeOfDay, no junction) are quarantined:
+  they are left out of the counts and written to a quarantine CSV file with
+  their line number and the reason
+- Values outside the known categories (a new vehicle type, an unknown
+  weather) are counted as unknown but the row is kept
+
+The check of a good row is one chain of lookups in prepared sets (no int()
+calls and no exceptions); only a row that fails it goes through the slower
+check that works out the reason. DataQuality keeps the per file
+summary shown under the outcomes.
+"""
+
+import io
+import os
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache, partial
+from itertools import chain, compress, islice, product, repeat
+from operator import itemgetter, methodcaller, ne, not_
+
+try:
+    import fcntl
+except ImportError:   # Not available on Windows, where writes go ahead without a lock
+    fcntl = None
+
+# Where quarantined rows are written unless another file is given (--quarantine-file)
+DEFAULT_QUARANTINE_FILE = "quarantine.csv"
+QUARANTINE_HEADER = "file,line,reason,row\n"
+
+# Columns of a survey file
+FIELDS = ("JunctionName", "Date", "timeOfDay", "travel_Direction_in", "travel_Direction_out",
+          "Weather_Conditions", "JunctionSpeedLimit", "VehicleSpeed", "VehicleType", "elctricHybrid")
+
+# Known values of the category columns
+CATEGORIES = {
+    "VehicleType": frozenset(("Car", "Bicycle", "Van", "Motorcycle", "Truck", "Buss", "Scooter")),
+    "travel_Direction_in": frozenset(("N", "NE", "E", "SE", "S", "SW", "W", "NW")),
+    "travel_Direction_out": frozenset(("N", "NE", "E", "SE", "S", "SW", "W", "NW")),
+    "Weather_Conditions": frozenset(("Clear", "Overcast", "Light Rain", "Heavy Rain", "Bright")),
+    "elctricHybrid": frozenset(("True", "False")),
+}
+
+# Accepted ranges of the speed columns (km/h or mph, whatever the survey uses)
+SPEED_RANGES = {"VehicleSpeed": (0, 200), "JunctionSpeedLimit": (1, 120)}
+
+
+@lru_cache(maxsize=None)
+def fast_check_tables():
+    """
+    Returns the lookup tables of the fast check, built on first use so importing this module stays cheap:
+    - every combination of known category values
+    - the speeds in range written the usual way, per speed column
+    - the HH:MM and :SS parts of a valid timeOfDay
+    """
+
+    known_categories = frozenset(product(*CATEGORIES.values()))
+    speed_values = {column: frozenset(str(speed) for speed in range(low, high + 1))
+                    for column, (low, high) in SPEED_RANGES.items()}
+    hours_minutes = frozenset(f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in range(60))
+    seconds = frozenset(f":{second:02d}" for second in range(60))
+    return known_categories, speed_values, hours_minutes, seconds
+
+
+@lru_cache(maxsize=None)
+def time_pattern():
+    """
+    Returns the compiled pattern of a valid HH:MM:SS timeOfDay (re is only imported when a row needs it).
+    """
+
+    import re
+    return re.compile(r"([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]")
+
+
+class DataQuality:
+    def __init__(self, file_path):
+        """
+        Starts an empty data quality summary for one file.
+        """
+
+        self.file_path = file_path
+        self.reasons = Counter()         # Reason -> quarantined rows
+        self.unknown = Counter()         # (column, value) -> rows kept with an unknown category value
+        self.quarantined = []            # (line number, reason, values) of every quarantined row
+
+    @property
+    def bad_rows(self):
+        return sum(self.reasons.values())
+
+    def quarantine(self, line, reason, values):
+        """
+        Records a row that is left out of the counts.
+        """
+
+        self.reasons[reason] += 1
+        self.quarantined.append((line, reason, values))
+
+    def merge(self, other, line_offset=0):
+        """
+        Adds the summary of another part of the same file (for example a chunk) to this one.
+        line_offset is added to the line numbers of the other part's quarantined rows.
+        """
+
+        self.reasons.update(other.reasons)
+        self.unknown.update(other.unknown)
+        self.quarantined.extend((line + line_offset, reason, values) for line, reason, values in other.quarantined)
+
+    def add_summary(self, summary):
+        """
+        Adds the counts of a saved summary (see summary()), for example one kept with a binary or cube file.
+        """
+
+        self.reasons.update(summary.get("reasons", {}))
+        for name, count in summary.get("unknown_categories", {}).items():
+            column, value = name.split("=", 1)
+            self.unknown[(column, value)] += count
+
+    def summary(self):
+        """
+        Returns the summary as a plain dict that can be cached and saved with the counts.
+        """
+
+        return {
+            "bad_rows": self.bad_rows,
+            "reasons": dict(self.reasons),
+            "out_of_range_speeds": sum(count for reason, count in self.reasons.items()
+                                       if reason.endswith("out of range")),
+            "unknown_categories": {f"{column}={value}": count for (column, value), count in self.unknown.items()},
+        }
+
+    def save_quarantine(self, path=DEFAULT_QUARANTINE_FILE):
+        """
+        Appends the quarantined rows to the quarantine CSV file at path in one write.
+        Rows the file already has (the same file, line, reason and values) are left out,
+        so processing a file again does not repeat its rows.
+        """
+
+        if not self.quarantined:
+            return
+        import csv
+        entries = []
+        for line, reason, values in sorted(self.quarantined, key=lambda item: item[0]):
+            row = io.StringIO()
+            csv.writer(row).writerow(values)
+            entries.append((self.file_path, str(line), reason, row.getvalue().rstrip("\r\n")))
+        append_new_entries(path, self.file_path, entries)
+        self.quarantined = []
+
+
+def append_new_entries(path, file_path, entries):
+    """
+    Appends the quarantine entries of one file that the quarantine CSV file does not have yet,
+    holding an exclusive lock on it while it is read and written. The header row is written first
+    if the file is empty.
+    """
+
+    import csv
+    with open(path, "a+", newline="", encoding="utf-8") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        file.seek(0)
+        saved = {tuple(entry) for entry in csv.reader(file) if entry and entry[0] == file_path}
+        text = io.StringIO()
+        if os.fstat(file.fileno()).st_size == 0:
+            text.write(QUARANTINE_HEADER)
+        csv.writer(text).writerows(entry for entry in entries if entry not in saved)
+        file.write(text.getvalue())
+        file.flush()   # Written before closing the file releases the lock
+
+
+def quality_lines(summary):
+    """
+    Returns the data quality lines shown under the outcomes of a file, or no lines if every row was good.
+    """
+
+    lines = []
+    if summary.get("bad_rows"):
+        reasons = ", ".join(f"{count} {reason}" for reason, count in sorted(summary["reasons"].items(),
+                                                                            key=lambda item: -item[1]))
+        lines.append(f"Data quality: bad rows quarantined and not counted: {summary['bad_rows']} ({reasons})")
+    if summary.get("out_of_range_speeds"):
+        lines.append(f"Data quality: out-of-range speeds: {summary['out_of_range_speeds']}")
+    if summary.get("unknown_categories"):
+        unknown = ", ".join(f"{name} ({count})" for name, count in summary["unknown_categories"].items())
+        lines.append(f"Data quality: unknown category values (still counted): {unknown}")
+    return lines
+
+
+def check_fields(fields):
+    """
+    Raises ValueError if the column names of a file (its header) miss any of the survey columns,
+    for example because the file is empty.
+    """
+
+    missing = [name for name in FIELDS if name not in fields]
+    if missing:
+        raise ValueError(f"The file has no {', '.join(missing)} column(s)")
+
+
+class RowChecker:
+    def __init__(self, fields, quality):
+        """
+        Prepares the full check of rows with these column names:
+        - quality is the DataQuality that records quarantined rows and unknown values
+        """
+
+        check_fields(fields)
+        self.fields = list(fields)
+        self.quality = quality
+
+    def accept(self, values, line):
+        """
+        Fully checks a row (a list of values):
+        - Returns False and quarantines the row if it cannot be counted
+        - Returns True if it can, recording any unknown category values
+        """
+
+        reason = self.problem(values)
+        if reason:
+            self.quality.quarantine(line, reason, values)
+            return False
+        row = dict(zip(self.fields, values))
+        for column, known in CATEGORIES.items():
+            value = row[column]
+            if column == "elctricHybrid":
+                value = value.capitalize()
+            if value not in known:
+                self.quality.unknown[(column, row[column])] += 1
+        return True
+
+    def problem(self, values):
+        """
+        Returns why a row cannot be counted, or None if it can.
+        """
+
+        if len(values) != len(self.fields):
+            return "wrong number of fields"
+        row = dict(zip(self.fields, values))
+        for column, (low, high) in SPEED_RANGES.items():
+            try:
+                number = int(row[column])
+            except ValueError:
+                return f"{column} not a number"
+            if not low <= number <= high:
+                return f"{column} out of range"
+        if not time_pattern().fullmatch(row["timeOfDay"]):
+            return "timeOfDay not HH:MM:SS"
+        if not row["JunctionName"]:
+            return "JunctionName empty"
+        return None
+
+
+class ValidatedReader:
+    def __init__(self, file, quality, fields=None):
+        """
+        Reads the good rows of a survey CSV file, quarantining the others in quality:
+        - fields are the column names; if None they are read from the first line (the header)
+        - quarantined rows get the number of their line in what this reader read
+        Iterating gives each good row as a list of values; dicts() gives dicts like csv.DictReader,
+        and columns() gives batches of good rows as columns.
+        Empty lines are skipped like csv.DictReader does.
+        """
+
+        import csv
+        self.file = file
+        self.reader = csv.reader(file)
+        if fields is None:
+            fields = next(self.reader, [])
+        self.fields = list(fields)
+        self.checker = RowChecker(self.fields, quality)
+
+    @property
+    def line_num(self):
+        """
+        Number of lines read so far (including the header if it was read).
+        """
+
+        return self.reader.line_num
+
+    def __iter__(self):
+        width = len(self.fields)
+        junction, time, limit, speed = (self.fields.index(name) for name in
+                                        ("JunctionName", "timeOfDay", "JunctionSpeedLimit", "VehicleSpeed"))
+        categories = itemgetter(*(self.fields.index(name) for name in CATEGORIES))
+        known_categories, speed_values, hours_minutes, seconds = fast_check_tables()
+        speeds, limits = speed_values["VehicleSpeed"], speed_values["JunctionSpeedLimit"]
+        accept, reader = self.checker.accept, self.reader
+
+        # The fast check is one expression of lookups in prepared sets; a row that fails it
+        # is not necessarily bad (an unknown vehicle type, a speed written as "030"), accept() decides
+        for values in reader:
+            if ((len(values) == width and categories(values) in known_categories
+                    and values[speed] in speeds and values[limit] in limits
+                    and (time_of_day := values[time])[:5] in hours_minutes and time_of_day[5:] in seconds
+                    and values[junction])
+                    or (values and accept(values, reader.line_num))):
+                yield values
+
+    def dicts(self):
+        """
+        Returns an iterator over the good rows as dicts of column name -> value.
+        """
+
+        return map(dict, map(partial(zip, self.fields), self))
+
+    def columns(self, batch_rows):
+        """
+        Reads the rest of the file a batch of batch_rows lines at a time and yields the good rows of each batch
+        as a dict of column name -> list of values, with the same rows, quarantine and unknown values as iterating:
+        - A batch is split on commas in one go and each column is sliced out of the split values,
+          instead of parsing and checking it row by row
+        - Each column is checked once per distinct value; only the rows holding a value that fails
+          (or with the wrong number of fields) go through the full check of the row
+        - Once a line holds a quote character the rest of the file is read through the csv module
+        The file must have been opened with newline="" (lines keep their own line ending).
+        """
+
+        width = len(self.fields)
+        checks = self.column_checks()
+        line_count = self.reader.line_num
+        accept = self.checker.accept
+        for lines in iter(lambda: list(islice(self.file, batch_rows)), []):
+            rows = list(map(methodcaller("rstrip", "\r\n"), lines))
+            if '"' in "".join(rows):
+                yield from self.quoted_columns(chain(lines, self.file), line_count, batch_rows)
+                return
+
+            # Lines with the wrong number of fields (and empty lines) are left out of the split
+            positions = range(len(rows))
+            odd = set()
+            field_counts = list(map(str.count, rows, repeat(",")))
+            if field_counts.count(width - 1) != len(rows):
+                wrong = list(map(ne, field_counts, repeat(width - 1)))
+                odd = {position for position in compress(positions, wrong) if rows[position]}
+                positions = list(compress(positions, map(not_, wrong)))
+            values = ",".join(map(rows.__getitem__, positions)).split(",") if positions else []
+            columns = {name: values[index::width] for index, name in enumerate(self.fields)}
+
+            # Rows holding a value that fails the check of its column, by position in the batch
+            suspects = set(odd)
+            for name, check in checks:
+                column = columns[name]
+                failed = check(set(column))
+                if failed:
+                    failing = compress(range(len(column)), map(failed.__contains__, column))
+                    suspects.update(map(positions.__getitem__, failing))
+
+            # The full check decides each suspect row, in line order
+            dropped = []
+            for position in sorted(suspects):
+                if not accept(rows[position].split(","), line_count + position + 1) and position not in odd:
+                    dropped.append(bisect_left(positions, position))
+            if dropped:
+                keep = [True] * len(positions)
+                for index in dropped:
+                    keep[index] = False
+                columns = {name: list(compress(column, keep)) for name, column in columns.items()}
+            line_count += len(lines)
+            yield columns
+
+    def column_checks(self):
+        """
+        Returns (column name, check) pairs for columns(): check takes the distinct values of a column
+        and returns those that fail the fast check of a row.
+        """
+
+        _, speed_values, hours_minutes, seconds = fast_check_tables()
+        checks = [(name, lambda values, known=known: values - known)
+                  for name, known in chain(CATEGORIES.items(), speed_values.items())]
+        checks.append(("timeOfDay", lambda values: {value for value in values
+                                                    if value[:5] not in hours_minutes or value[5:] not in seconds}))
+        checks.append(("JunctionName", lambda values: values & {""}))
+        return checks
+
+    def quoted_columns(self, lines, line_count, batch_rows):
+        """
+        Reads the rest of the file (lines, after line_count lines already read) through the csv module
+        for columns(), yielding the good rows of each batch as columns.
+        """
+
+        quality = self.checker.quality
+        part_quality = DataQuality(quality.file_path)
+        reader = ValidatedReader(lines, part_quality, self.fields)
+        for batch in iter(lambda: list(islice(reader, batch_rows)), []):
+            yield dict(zip(self.fields, map(list, zip(*batch))))
+        quality.merge(part_quality, line_count)